@@ -124,10 +124,11 @@ def seed_data(user):
         datasource = Datasource(
             container=demo_container, name=name, connection=connection
         )
-        datasource.data = datasource.retrieve_data()
-        datasource.fields = [field for field in datasource.data[0]]
+        data = datasource.retrieve_data()
+        datasource.fields = [field for field in data[0]]
         datasource.types = TYPES[name]
         datasource.save()
+        datasource.store_data(data)
 
         return datasource
 
@@ -0,0 +1,452 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+import mongoengine
+from bson import ObjectId
+from datetime import datetime as dt
+from statistics import median
+from time import perf_counter
+from unittest import mock
+import random
+import json
+import jwt
+
+from ontask.settings import SECRET_KEY, DB_HOST
+
+from container.models import Container, Term
+from datasource.models import Datasource
+from datalab.models import (
+    Datalab,
+    DatalabCache,
+    Module,
+    DatasourceModule,
+    ComputedModule,
+    ComputedField,
+    Column,
+)
+from datalab.utils import get_relations
+from form.models import Form, Field
+from form.views import AccessForm
+from workflow.models import (
+    Workflow,
+    EmailSettings,
+    Rule,
+    Condition,
+    Formula,
+)
+from scheduler.tasks import workflow_send_email
+from scheduler.utils import RateLimiter
+
+BENCHMARKS = [
+    "get_relations",
+    "datalab_data_cold",
+    "datalab_data_warm",
+    "filter_details",
+    "access_form",
+    "populate_content",
+    "email_job",
+]
+
+GRADES = ["HD", "DN", "CR", "PS", "FL"]
+TOPICS = ["lectures", "tutorials", "labs", "assignments"]
+
+FILTERS = {
+    "filters": {"grade": ["HD", "DN"]},
+    "checkboxFilters": {"topics": []},
+    "checkboxFilterModes": {"topics": False},
+    "search": "1",
+    "sorter": {"field": "mark", "order": "descend"},
+    "pagination": {"current": 1, "pageSize": 10},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the datalab, form and action hot paths over synthetic courses "
+        "of increasing size, and records the results as a JSON baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", type=int, nargs="+", default=[1000, 10000, 100000]
+        )
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--only", nargs="+", choices=BENCHMARKS)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--database",
+            default="ontask_benchmark",
+            help="Database in which the synthetic data is generated",
+        )
+        parser.add_argument(
+            "--mongomock",
+            action="store_true",
+            help="Use an in-memory mongomock database instead of a local mongod",
+        )
+        parser.add_argument("--output", help="Path of the JSON file to write")
+        parser.add_argument(
+            "--compare", help="Path of a JSON baseline to compare the results against"
+        )
+
+    def handle(self, *args, **options):
+        # Never generate synthetic data in the application database
+        mongoengine.disconnect()
+        if options["mongomock"]:
+            try:
+                import mongomock
+            except ImportError:
+                raise CommandError(
+                    "mongomock must be installed to use --mongomock "
+                    "(see requirements-test.txt)"
+                )
+
+            # Newer versions of mongoengine no longer accept mongomock:// hosts
+            if mongoengine.VERSION >= (0, 27):
+                mongoengine.connect(
+                    options["database"], mongo_client_class=mongomock.MongoClient
+                )
+            else:
+                mongoengine.connect(options["database"], host="mongomock://localhost")
+        else:
+            mongoengine.connect(options["database"], host=DB_HOST if DB_HOST else "db")
+
+        baseline = None
+        if options["compare"]:
+            try:
+                with open(options["compare"]) as baseline_file:
+                    baseline = json.load(baseline_file)
+            except (OSError, ValueError):
+                raise CommandError(f"Could not read baseline {options['compare']}")
+
+        benchmarks = options["only"] or BENCHMARKS
+        results = {
+            "created": dt.utcnow().isoformat(),
+            "repeat": options["repeat"],
+            "seed": options["seed"],
+            "results": {},
+        }
+
+        for size in options["sizes"]:
+            self.stdout.write(f"Generating a course of {size} students")
+            fixture = create_fixture(size, options["seed"])
+
+            try:
+                results["results"][str(size)] = {
+                    benchmark: self.run(fixture, benchmark, options["repeat"])
+                    for benchmark in benchmarks
+                }
+            finally:
+                fixture["container"].delete()
+
+            for benchmark, timings in results["results"][str(size)].items():
+                self.report(size, benchmark, timings, baseline)
+
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                json.dump(results, output_file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def run(self, fixture, benchmark, repeat):
+        timings = []
+        for _ in range(repeat):
+            setup, target = BENCHMARK_FUNCTIONS[benchmark](fixture)
+            if setup:
+                setup()
+
+            start = perf_counter()
+            target()
+            timings.append(perf_counter() - start)
+
+        return {"min": min(timings), "median": median(timings), "runs": timings}
+
+    def report(self, size, benchmark, timings, baseline):
+        line = f"{size:>8} {benchmark:<20} {timings['median']:>10.4f}s"
+
+        previous = (
+            baseline.get("results", {}).get(str(size), {}).get(benchmark)
+            if baseline
+            else None
+        )
+        if previous:
+            ratio = timings["median"] / previous["median"] if previous["median"] else 0
+            line += f" ({ratio:.2f}x baseline)"
+            if ratio > 1.1:
+                self.stdout.write(self.style.WARNING(line))
+                return
+
+        self.stdout.write(line)
+
+
+def create_fixture(size, seed):
+    """Synthetic course: two datasources, a form and an action over a DataLab"""
+    rng = random.Random(seed)
+
+    term = Term.objects(code=0).first() or Term(code=0, name="Benchmark").save()
+    container = Container(
+        owner="benchmark@ontask.local", code=f"BENCHMARK_{size}", term=term
+    ).save()
+
+    zids = [f"z{5000000 + index}" for index in range(size)]
+
+    students = Datasource(
+        container=container,
+        name="Students",
+        fields=["zid", "name", "email", "mark", "grade"],
+        types={
+            "zid": "text",
+            "name": "text",
+            "email": "text",
+            "mark": "number",
+            "grade": "text",
+        },
+    ).save()
+    students.store_data(
+        [
+            {
+                "zid": zid,
+                "name": f"Student {index}",
+                "email": f"{zid}@student.ontask.local",
+                "mark": rng.randint(0, 100),
+                "grade": rng.choice(GRADES),
+            }
+            for index, zid in enumerate(zids)
+        ]
+    )
+
+    # Not every student has a submission
+    submissions = Datasource(
+        container=container,
+        name="Submissions",
+        fields=["student", "score", "late"],
+        types={"student": "text", "score": "number", "late": "boolean"},
+    ).save()
+    submissions.store_data(
+        [
+            {
+                "student": zid,
+                "score": round(rng.uniform(0, 10), 2),
+                "late": rng.random() < 0.1,
+            }
+            for zid in zids
+            if rng.random() < 0.9
+        ]
+    )
+
+    total = ComputedField(
+        name="total",
+        type="number",
+        formula={
+            "object": "value",
+            "document": {
+                "object": "document",
+                "data": {},
+                "nodes": [
+                    {"object": "block", "type": "field", "data": {"name": "mark"}},
+                    {"object": "block", "type": "operator", "data": {"type": "+"}},
+                    {
+                        "object": "block",
+                        "type": "aggregation",
+                        "data": {"type": "sum", "columns": ["1_0"]},
+                    },
+                ],
+            },
+        },
+    )
+
+    datalab = Datalab(
+        container=container,
+        name="Course",
+        permission="email",
+        emailAccess=True,
+        groupBy="grade",
+        steps=[
+            Module(
+                type="datasource",
+                datasource=DatasourceModule(
+                    id=str(students.id),
+                    primary="zid",
+                    fields=students.fields,
+                    labels={field: field for field in students.fields},
+                    types=students.types,
+                ),
+            ),
+            Module(
+                type="datasource",
+                datasource=DatasourceModule(
+                    id=str(submissions.id),
+                    primary="student",
+                    matching="zid",
+                    fields=["score", "late"],
+                    labels={"score": "score", "late": "late"},
+                    types={"score": "number", "late": "boolean"},
+                    discrepencies={"primary": False, "matching": True},
+                ),
+            ),
+        ],
+        order=[
+            *[Column(stepIndex=0, field=field) for field in students.fields],
+            Column(stepIndex=1, field="score"),
+            Column(stepIndex=1, field="late"),
+        ],
+    ).save()
+
+    form = Form(
+        container=container,
+        datalab=datalab,
+        name="Feedback",
+        primary="zid",
+        permission="email",
+        emailAccess=True,
+        visibleFields=["name", "grade"],
+        fields=[
+            Field(name="topics", type="checkbox-group", columns=TOPICS),
+            Field(name="comment", type="text"),
+        ],
+        data=[
+            {
+                "zid": zid,
+                **{f"topics__{topic}": rng.random() < 0.5 for topic in TOPICS},
+                "comment": f"Comment {index}",
+            }
+            for index, zid in enumerate(zids)
+            if rng.random() < 0.6
+        ],
+        lastUpdated=dt.utcnow(),
+    ).save()
+
+    datalab.steps.append(Module(type="form", form=str(form.id)))
+    datalab.steps.append(
+        Module(type="computed", computed=ComputedModule(fields=[total]))
+    )
+    datalab.order.append(Column(stepIndex=2, field="topics"))
+    datalab.order.append(Column(stepIndex=2, field="comment"))
+    datalab.order.append(Column(stepIndex=3, field="total"))
+    datalab.relations = get_relations(
+        datalab.to_mongo()["steps"], datalab_id=datalab.id, permission="email"
+    )
+    datalab.save()
+
+    rule_id = ObjectId()
+    passed, catch_all = ObjectId(), ObjectId()
+    action = Workflow(
+        container=container,
+        datalab=datalab,
+        name="Progress",
+        rules=[
+            Rule(
+                ruleId=rule_id,
+                name="Passing",
+                parameters=["mark"],
+                conditions=[
+                    Condition(
+                        conditionId=passed,
+                        formulas=[Formula(operator=">=", comparator=50)],
+                    )
+                ],
+                catchAll=catch_all,
+            )
+        ],
+        content=(
+            "<p>Hi <attribute>field:name</attribute>,</p>"
+            f'<condition conditionid="{passed}" ruleid="{rule_id}">'
+            "<p>Well done, your mark is <attribute>field:mark</attribute>.</p>"
+            "</condition>"
+            f'<condition conditionid="{catch_all}" ruleid="{rule_id}" label="else">'
+            "<p>Please see your tutor about your progress.</p>"
+            "</condition>"
+            '<p><hyperlink href="https://ontask.local/course" params="?zid=zid">'
+            "Course page</hyperlink></p>"
+        ),
+        emailSettings=EmailSettings(
+            subject="Your progress",
+            field="email",
+            replyTo="benchmark@ontask.local",
+        ),
+    ).save()
+
+    return {
+        "container": container,
+        "datalab": datalab,
+        "form": form,
+        "action": action,
+        "recipient": f"{zids[0]}@student.ontask.local",
+    }
+
+
+def benchmark_get_relations(fixture):
+    datalab = Datalab.objects.get(id=fixture["datalab"].id)
+    steps = datalab.to_mongo()["steps"]
+
+    return (
+        None,
+        lambda: get_relations(steps, datalab_id=datalab.id, permission="email"),
+    )
+
+
+def benchmark_datalab_data_cold(fixture):
+    datalab = Datalab.objects.get(id=fixture["datalab"].id)
+
+    return (
+        lambda: DatalabCache.objects(datalab=datalab.id).delete(),
+        lambda: datalab.data,
+    )
+
+
+def benchmark_datalab_data_warm(fixture):
+    datalab = Datalab.objects.get(id=fixture["datalab"].id)
+
+    def setup():
+        # Ensure that the table is materialized, but read it back from the cache
+        datalab.data
+        datalab._materialized = None
+
+    return (setup, lambda: datalab.data)
+
+
+def benchmark_filter_details(fixture):
+    datalab = Datalab.objects.get(id=fixture["datalab"].id)
+
+    return (None, lambda: datalab.filter_details(FILTERS))
+
+
+def benchmark_access_form(fixture):
+    view = AccessForm()
+    view.request = RequestFactory().get("/")
+    view.request.user = AnonymousUser()
+    token = jwt.encode(
+        {"email": fixture["recipient"]}, SECRET_KEY, algorithm="HS256"
+    ).decode("utf-8")
+
+    return (None, lambda: view.get_data(fixture["form"].id, token))
+
+
+def benchmark_populate_content(fixture):
+    action = Workflow.objects.get(id=fixture["action"].id)
+
+    return (None, lambda: action.populate_content())
+
+
+def benchmark_email_job(fixture):
+    def send():
+        # Emails are delivered to the in-memory outbox, without any rate limit
+        with override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend"
+        ), mock.patch("scheduler.tasks.email_rate_limiter", RateLimiter(None)):
+            workflow_send_email(action_id=str(fixture["action"].id))
+        mail.outbox = []
+
+    return (None, send)
+
+
+BENCHMARK_FUNCTIONS = {
+    "get_relations": benchmark_get_relations,
+    "datalab_data_cold": benchmark_datalab_data_cold,
+    "datalab_data_warm": benchmark_datalab_data_warm,
+    "filter_details": benchmark_filter_details,
+    "access_form": benchmark_access_form,
+    "populate_content": benchmark_populate_content,
+    "email_job": benchmark_email_job,
+}
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+
+from bson.objectid import ObjectId
+
+from workflow.models import Workflow, EmailJob, Email
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves the email jobs embedded in actions to their own collections, "
+        "and removes them from the actions"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of emails inserted at once",
+        )
+
+    def handle(self, *args, **options):
+        actions = Workflow._get_collection()
+        jobs = EmailJob._get_collection()
+        emails = Email._get_collection()
+        batch_size = options["batch_size"]
+
+        migrated_actions = 0
+        migrated_emails = 0
+        for action in actions.find(
+            {"emailJobs": {"$exists": True}}, {"emailJobs": True}
+        ):
+            for job in action["emailJobs"]:
+                job = dict(job)
+                job_emails = job.pop("emails", None) or []
+                job_id = job.pop("job_id", None) or ObjectId()
+
+                jobs.replace_one(
+                    {"_id": job_id},
+                    {**job, "_id": job_id, "action": action["_id"]},
+                    upsert=True,
+                )
+
+                # The emails of the job are replaced, in case a previous run was
+                # interrupted part way through the job
+                emails.delete_many({"job_id": job_id})
+                for start in range(0, len(job_emails), batch_size):
+                    emails.insert_many(
+                        [
+                            {**email, "action": action["_id"], "job_id": job_id}
+                            for email in job_emails[start : start + batch_size]
+                        ],
+                        ordered=False,
+                    )
+                migrated_emails += len(job_emails)
+
+            actions.update_one({"_id": action["_id"]}, {"$unset": {"emailJobs": ""}})
+            migrated_actions += 1
+
+        self.stdout.write(
+            f"Migrated {migrated_emails} emails from {migrated_actions} actions"
+        )
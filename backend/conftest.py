@@ -0,0 +1,122 @@
+"""
+Configuration shared by the tests of every app
+
+The settings are imported from ontask/env.py, which is only created when the
+application is deployed (see the README), so placeholder values are provided
+when it doesn't exist. The documents are stored in an in-memory mongomock
+database rather than the MongoDB container, and the user model in an in-memory
+SQLite database rather than Djongo.
+"""
+import importlib.util
+import os
+import sys
+import types
+
+import django
+import mongoengine
+import mongomock
+import pytest
+from cryptography.fernet import Fernet
+
+if importlib.util.find_spec("ontask.env") is None:
+    env = types.ModuleType("ontask.env")
+    env.__dict__.update(
+        {
+            "SECRET_KEY": Fernet.generate_key().decode("utf-8"),
+            "ADMINS": [],
+            "FRONTEND_DOMAIN": "https://localhost:3000",
+            "BACKEND_DOMAIN": "https://localhost:8000",
+            "ALLOWED_HOSTS": ["localhost"],
+            "AWS_REGION": "ap-southeast-2",
+            "ENABLE_CLOUDWATCH_LOGGING": False,
+            "DEMO_BUCKET": None,
+            "EMAIL_HOST": "localhost",
+            "EMAIL_PORT": 587,
+            "EMAIL_HOST_USER": "ontask@localhost",
+            "EMAIL_HOST_PASSWORD": "",
+            "EMAIL_USE_TLS": False,
+            "AAF_CONFIG": {},
+            "LTI_CONFIG": {},
+        }
+    )
+    sys.modules["ontask.env"] = env
+
+import ontask.settings  # noqa: E402
+
+# The user model is stored in an in-memory SQLite database instead of Djongo
+ontask.settings.DATABASES = {
+    "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}
+}
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ontask.settings")
+django.setup()
+
+mongoengine.disconnect()
+if mongoengine.VERSION >= (0, 27):
+    mongoengine.connect("ontask", mongo_client_class=mongomock.MongoClient)
+else:
+    mongoengine.connect("ontask", host="mongomock://localhost")
+
+
+@pytest.fixture(autouse=True)
+def clean_database():
+    yield
+    # The documents are removed rather than the database dropped, since the
+    # indexes of each collection are only created once
+    database = mongoengine.get_db()
+    for name in database.list_collection_names():
+        database[name].delete_many({})
+
+
+@pytest.fixture
+def container():
+    from container.models import Container, Term
+
+    term = Term(code=1, name="Term 1").save()
+    return Container(owner="owner@ontask.org", code="TEST1000", term=term).save()
+
+
+@pytest.fixture
+def make_datalab(container):
+    """
+    Factory of DataLabs whose only step is a datasource of the given rows, with
+    the relations (and the access index of the permission field, if any) built
+    """
+    from datalab.models import Column, Datalab, DatasourceModule, Module
+    from datalab.utils import get_relations
+    from datasource.models import Datasource
+
+    def make_datalab(rows, primary="zid", types=None, permission=None, fields=None):
+        types = types or {}
+        fields = fields or list(types or rows[0])
+
+        datasource = Datasource(
+            container=container, name="Students", fields=fields, types=types
+        ).save()
+        datasource.store_data(rows)
+
+        datalab = Datalab(
+            container=container,
+            name="Course",
+            steps=[
+                Module(
+                    type="datasource",
+                    datasource=DatasourceModule(
+                        id=str(datasource.id),
+                        primary=primary,
+                        fields=fields,
+                        labels={field: field for field in fields},
+                        types=types,
+                    ),
+                )
+            ],
+            order=[Column(stepIndex=0, field=field) for field in fields],
+            permission=permission,
+        ).save()
+        datalab.relations = get_relations(
+            datalab.to_mongo()["steps"], datalab.id, permission=permission
+        )
+        if permission:
+            datalab.refresh_access()
+        return datalab.save()
+
+    return make_datalab
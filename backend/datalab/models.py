@@ -11,13 +11,41 @@ from mongoengine.fields import (
     DateTimeField,
     FloatField,
 )
+from pymongo import ReplaceOne
+from datetime import datetime as dt
+from collections import defaultdict
 import pandas as pd
+import hashlib
+import json
+import logging
 
 from container.models import Container
 from datasource.models import Datasource
 
 from form.utils import get_filters, get_column_filter, get_filtered_data
 
+from .profiler import profile, stage
+
+logger = logging.getLogger("ontask")
+
+
+def access_value(value):
+    """Normalized value of a permission field, or None if it can't grant access"""
+    if not isinstance(value, str) or not value:
+        return None
+    return value.lower()
+
+
+def access_version(relations, permission):
+    """
+    Hash of the values of a permission field in each row of a relations table,
+    which changes whenever rows are added, removed or reordered, or their
+    values change
+    """
+    values = [access_value(record.get(permission)) for record in relations]
+    return hashlib.sha1(json.dumps(values).encode("utf-8")).hexdigest()
+
+
 class Column(EmbeddedDocument):
     stepIndex = IntField()
     field = StringField()
@@ -95,11 +123,99 @@ class Datalab(Document):
 
     @property
     def data(self):
+        """
+        Combined table of the DataLab, served from the materialized cache if
+        none of its steps or upstream sources have changed since it was built
+        """
+        if self.id is None:
+            return self.build_data()
+
+        fingerprint = self.fingerprint()
+
+        # Memoize on the instance, as serializers access the data more than once
+        if getattr(self, "_materialized", None) and self._materialized[0] == fingerprint:
+            return self._materialized[1]
+
+        data = DatalabCache.load(self.id, fingerprint)
+        if data is None:
+            with profile("datalab.build", datalab=str(self.id)):
+                data = self.build_data()
+                with stage("cache_store"):
+                    DatalabCache.store(self.id, fingerprint, data)
+
+        self._materialized = (fingerprint, data)
+        return data
+
+    def fingerprint(self):
+        """
+        Hash of everything that the combined table depends on: the steps and
+        relations of this DataLab, plus the version of each upstream source
+        (lastUpdated and generation of datasources, lastUpdated of forms,
+        fingerprint of other DataLabs)
+        """
         from form.models import Form
+
+        source_ids = [
+            step.datasource.id for step in self.steps if step.type == "datasource"
+        ]
+        form_ids = [step.form for step in self.steps if step.type == "form"]
+
+        datasources = {
+            str(datasource.id): [datasource.lastUpdated, datasource.generation]
+            for datasource in Datasource.objects(id__in=source_ids).only(
+                "lastUpdated", "generation"
+            )
+        }
+        datalabs = {
+            str(datalab.id): datalab
+            for datalab in Datalab.objects(
+                id__in=[source for source in source_ids if source not in datasources]
+            ).only("steps", "relations")
+        }
+        forms = {
+            str(form.id): form.lastUpdated
+            for form in Form.objects(id__in=form_ids).only("lastUpdated")
+        }
+
+        dependencies = []
+        for step in self.steps:
+            if step.type == "datasource":
+                if step.datasource.id in datasources:
+                    dependencies.append(datasources[step.datasource.id])
+                elif step.datasource.id in datalabs:
+                    dependencies.append(datalabs[step.datasource.id].fingerprint())
+
+            elif step.type == "form":
+                if str(step.form) in forms:
+                    dependencies.append(forms[str(step.form)])
+
+        document = self.to_mongo()
+        payload = json.dumps(
+            [document.get("steps"), document.get("relations"), dependencies],
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def build_data(self, rows=None):
+        """
+        Join the relations table with the data of each step. If the positions
+        of rows of the relations table are given, then only those rows are built
+        """
         from .utils import calculate_computed_field
+        from .resolver import get_resolver
+
+        resolver = get_resolver()
+        with stage("source_fetch"):
+            resolver.prefetch(self.steps)
+
+        relations = (
+            self.relations if rows is None else [self.relations[row] for row in rows]
+        )
 
         build_fields = []
-        combined_data = pd.DataFrame(self.relations)
+        with stage("frame", rows=len(relations)):
+            combined_data = pd.DataFrame(relations)
 
         # # Gather all tracking and feedback data for associated actions
         # # Consumed by the computed column
@@ -128,15 +244,8 @@ class Datalab(Document):
         for step_index, step in enumerate(self.steps):
             if step.type == "datasource":
                 step = step.datasource
-                try:
-                    datasource = Datasource.objects.get(id=step.id)
-                except:
-                    pass
-
-                try:
-                    datasource = Datalab.objects.get(id=step.id)
-                except:
-                    pass
+                with stage("source_fetch", step=step_index):
+                    datasource = resolver.get_source(step)
 
                 build_fields.append([step.labels[field] for field in step.fields])
 
@@ -156,58 +265,129 @@ class Datalab(Document):
                     ).stepIndex
                     form_module_id = datasource.steps[form_module_index].form
 
-                    form = Form.objects.get(id=form_module_id)
+                    form = resolver.get_form(form_module_id)
                     for form_field in form.fields:
                         if form_field.name == field:
                             included_fields.extend(form_field.columns)
 
-                data = (
-                    pd.DataFrame(data=datasource.data)
-                    .set_index(step.primary)
-                    .filter(items=included_fields)
-                    .rename(
-                        columns={field: step.labels[field] for field in step.fields}
+                with stage("frame", step=step_index) as current:
+                    data = (
+                        datasource.load_data(fields=[step.primary, *included_fields])
+                        .set_index(step.primary)
+                        .filter(items=included_fields)
+                        .rename(
+                            columns={field: step.labels[field] for field in step.fields}
+                        )
                     )
-                )
-
-                combined_data = combined_data.join(
-                    data,
-                    on=step.matching
-                    if step_index != 0
-                    else step.labels.get(step.primary, step.primary),
-                )
+                    current.details["rows"] = len(data)
+
+                with stage("join", step=step_index, rows_in=len(combined_data)) as current:
+                    combined_data = combined_data.join(
+                        data,
+                        on=step.matching
+                        if step_index != 0
+                        else step.labels.get(step.primary, step.primary),
+                    )
+                    current.details["rows_out"] = len(combined_data)
 
             elif step.type == "form":
-                form = Form.objects.get(id=step.form)
-                data = pd.DataFrame(data=form.data)
+                with stage("source_fetch", step=step_index):
+                    form = resolver.get_form(step.form)
+
+                with stage("frame", step=step_index) as current:
+                    data = pd.DataFrame(data=form.data)
+                    current.details["rows"] = len(data)
 
                 build_fields.append([field.name for field in form.fields])
 
                 if form.primary in data:
-                    data.set_index(form.primary, inplace=True)
-                    combined_data = combined_data.join(data, on=form.primary)
+                    with stage(
+                        "join", step=step_index, rows_in=len(combined_data)
+                    ) as current:
+                        data.set_index(form.primary, inplace=True)
+                        combined_data = combined_data.join(data, on=form.primary)
+                        current.details["rows_out"] = len(combined_data)
 
             elif step.type == "computed":
                 step = step.computed
                 
                 build_fields.append([field.name for field in step.fields])
 
-                computed_fields = {
-                    field.name: combined_data.apply(
-                        lambda item: calculate_computed_field(
-                            field.formula, item, build_fields, {}
-                        ),
-                        axis=1,
-                    ).values
-                    for field in step.fields
-                }
-                combined_data = combined_data.assign(**computed_fields)
+                with stage("computed", step=step_index, fields=len(step.fields)):
+                    computed_fields = {
+                        field.name: calculate_computed_field(
+                            field.formula, combined_data, build_fields, {}
+                        )
+                        for field in step.fields
+                    }
+                    combined_data = combined_data.assign(**computed_fields)
+
+        with stage("nan_replace"):
+            combined_data.replace({pd.np.nan: None}, inplace=True)
+
+        with stage("to_dict", rows=len(combined_data)):
+            return combined_data.to_dict("records")
+
+    def load_rows(self, rows):
+        """
+        Rows of the combined table at the given positions, read from the
+        materialized cache if it is up to date, or otherwise built on their own
+        """
+        if not rows:
+            return []
+
+        fingerprint = self.fingerprint()
+        if getattr(self, "_materialized", None) and self._materialized[0] == fingerprint:
+            return [self._materialized[1][row] for row in rows]
+
+        data = DatalabCache.load_rows(self.id, fingerprint, rows)
+        if data is None:
+            with profile("datalab.build_rows", datalab=str(self.id), rows=len(rows)):
+                data = self.build_data(rows=rows)
+        return data
+
+    def accessible_data(self, permission, values):
+        """
+        Rows of the combined table whose value of the permission field is one of
+        the given values (lowercase emails or LTI payload values)
+
+        The rows are found with the access index and fetched on their own. If
+        the index is missing or was built from other relations, then the whole
+        table is filtered and the index is rebuilt for the next request
+        """
+        values = set(values)
+
+        if self.id is not None and permission:
+            rows = AccessIndex.lookup(
+                self.id, permission, values, access_version(self.relations, permission)
+            )
+            if rows is not None:
+                return self.load_rows(rows)
+
+            AccessIndex.refresh(self, permission)
 
-        combined_data.replace({pd.np.nan: None}, inplace=True)
+        return [
+            record
+            for record in self.data
+            if access_value(record.get(permission)) in values
+        ]
+
+    def load_data(self, fields=None):
+        """
+        Combined table as a DataFrame, for when this DataLab is used as a source
+
+        If fields are provided and the materialized table is up to date, then
+        only those columns are read from the cache
+        """
+        if fields is not None and self.id is not None:
+            data = DatalabCache.load(self.id, self.fingerprint(), fields=fields)
+            if data is not None:
+                return pd.DataFrame(data=data).filter(items=fields)
 
-        return combined_data.to_dict("records")
+        data = pd.DataFrame(data=self.data)
+        return data.filter(items=fields) if fields is not None else data
 
-    def filter_details(self, filters):
+    def filter_details(self, filters, data=None):
         """
         Function used in Serializers to get filter_details
         Input
@@ -223,34 +403,47 @@ class Datalab(Document):
                 - The actual table data
             - groups: List of {text value} for groupby dropdown (essentially another filter)
         """
-        data = self.data
+        with profile("datalab.filter_details", datalab=str(self.id)):
+            return self._filter_details(filters, data)
+
+    def _filter_details(self, filters, data=None):
+        if data is None:
+            with stage("data"):
+                data = self.data
         if filters is None: filters = {}
-        df = pd.DataFrame.from_dict(data)
+        with stage("frame", rows=len(data)):
+            df = pd.DataFrame.from_dict(data)
 
         # Grab Column Information to help with filtering because the filter algorithm depends on the column type
         from datalab.serializers import OrderItemSerializer
-        columns = OrderItemSerializer(
-            self.order, many=True, context={"steps": self.steps}
-        ).data
+        with stage("columns"):
+            columns = OrderItemSerializer(
+                self.order, many=True, context={"steps": self.steps}
+            ).data
 
         group_column = next(column for column in columns if column['details']['label'] == self.groupBy) if self.groupBy is not None else None
 
         # Perform Actual Filtering
-        filtered_data, pagination_total = get_filtered_data(data, columns, filters, self.groupBy)
-
-        return {
-            'dataNum': len(data),
-            'paginationTotal': pagination_total,
-            'filters': get_filters(df, columns),
-            'filteredData': filtered_data,
-            'groups': get_column_filter(df, group_column)
-        }
+        with stage("filter", rows_in=len(data)) as current:
+            filtered_data, pagination_total = get_filtered_data(data, columns, filters, self.groupBy)
+            current.details["rows_out"] = pagination_total
+
+        with stage("filter_options"):
+            return {
+                'dataNum': len(data),
+                'paginationTotal': pagination_total,
+                'filters': get_filters(df, columns),
+                'filteredData': filtered_data,
+                'groups': get_column_filter(df, group_column)
+            }
 
 
     # Flat representation of which users should see this DataLab when they load the dashboard
     def refresh_access(self):
+        from form.models import Form
+
         users = set(
-            record.get(self.permission, "").lower() for record in self.relations
+            access_value(record.get(self.permission)) for record in self.relations
         )
         for invalid_value in [None, ""]:
             if invalid_value in users:
@@ -258,3 +451,175 @@ class Datalab(Document):
 
         self.permitted_users = list(users)
         self.save()
+
+        # The relations have changed, so the access index of the permission
+        # field of the DataLab and of each of its forms is rebuilt
+        permissions = {
+            self.permission,
+            *Form.objects(datalab=self.id).distinct("permission"),
+        }
+        for permission in permissions:
+            if permission:
+                AccessIndex.refresh(self, permission)
+
+
+class DatalabCache(Document):
+    """
+    Materialized copy of the combined table of a DataLab, keyed on the
+    fingerprint of the DataLab at the time that the table was built
+    """
+
+    # Cascade delete if datalab is deleted
+    datalab = ReferenceField(Datalab, required=True, unique=True, reverse_delete_rule=2)
+    fingerprint = StringField(required=True)
+    data = ListField(DictField())
+    built = DateTimeField(default=dt.utcnow)
+
+    # The cache is read and written through the raw collection, which avoids
+    # deserializing every record into mongoengine documents
+    @classmethod
+    def load(cls, datalab_id, fingerprint, fields=None):
+        projection = (
+            {f"data.{field}": 1 for field in fields} if fields else {"data": 1}
+        )
+        cache = cls._get_collection().find_one(
+            {"datalab": datalab_id, "fingerprint": fingerprint}, projection
+        )
+        return cache.get("data", []) if cache else None
+
+    @classmethod
+    def load_rows(cls, datalab_id, fingerprint, rows):
+        """Only the rows of the cached table at the given positions"""
+        caches = cls._get_collection().aggregate(
+            [
+                {"$match": {"datalab": datalab_id, "fingerprint": fingerprint}},
+                {
+                    "$project": {
+                        "_id": False,
+                        "data": {
+                            "$map": {
+                                "input": list(rows),
+                                "as": "row",
+                                "in": {"$arrayElemAt": ["$data", "$$row"]},
+                            }
+                        },
+                    }
+                },
+            ]
+        )
+        cache = next(caches, None)
+        return cache["data"] if cache else None
+
+    @classmethod
+    def store(cls, datalab_id, fingerprint, data):
+        try:
+            cls._get_collection().update_one(
+                {"datalab": datalab_id},
+                {
+                    "$set": {
+                        "fingerprint": fingerprint,
+                        "data": data,
+                        "built": dt.utcnow(),
+                    }
+                },
+                upsert=True,
+            )
+        except Exception as error:
+            # The table is still served, it just won't be cached (e.g. the
+            # materialized document would exceed the BSON size limit)
+            logger.warning(
+                "datalab.cache_failed",
+                extra={"datalab": str(datalab_id), "error": str(error)},
+            )
+
+
+class AccessIndex(Document):
+    """
+    Rows of the combined table of a DataLab (by their position in the relations
+    table) which each value of a permission field grants access to, so that the
+    rows of a student or tutor can be fetched without building the whole table.
+
+    Every indexed permission field has an entry with an empty value, which
+    distinguishes a field without any matching rows from one not yet indexed,
+    and holds the version of the relations that the index was built from
+    """
+
+    # Cascade delete if datalab is deleted
+    datalab = ReferenceField(Datalab, required=True, reverse_delete_rule=2)
+    permission = StringField(required=True)
+    value = StringField()
+    rows = ListField(IntField())
+    # Only set on the entry with an empty value (see access_version)
+    version = StringField(null=True)
+
+    meta = {
+        "indexes": [
+            {"fields": ("datalab", "permission", "value"), "unique": True}
+        ]
+    }
+
+    @classmethod
+    def refresh(cls, datalab, permission):
+        rows = defaultdict(list)
+        for row, record in enumerate(datalab.relations):
+            value = access_value(record.get(permission))
+            if value is not None:
+                rows[value].append(row)
+
+        collection = cls._get_collection()
+        query = {"datalab": datalab.id, "permission": permission}
+
+        # Lookups fall back to filtering the whole table until every value of
+        # the new relations has been written
+        collection.update_one({**query, "value": ""}, {"$set": {"version": None}})
+
+        if rows:
+            collection.bulk_write(
+                [
+                    ReplaceOne(
+                        {**query, "value": value},
+                        {**query, "value": value, "rows": value_rows},
+                        upsert=True,
+                    )
+                    for value, value_rows in rows.items()
+                ],
+                ordered=False,
+            )
+        collection.delete_many({**query, "value": {"$nin": ["", *rows]}})
+
+        # The index is only trusted again once the version is set
+        collection.replace_one(
+            {**query, "value": ""},
+            {
+                **query,
+                "value": "",
+                "rows": [],
+                "version": access_version(datalab.relations, permission),
+            },
+            upsert=True,
+        )
+
+    @classmethod
+    def lookup(cls, datalab_id, permission, values, version):
+        """
+        Sorted rows which any of the given values grant access to, or None if
+        the permission field hasn't been indexed from the given version of the
+        relations
+        """
+        entries = list(
+            cls._get_collection().find(
+                {
+                    "datalab": datalab_id,
+                    "permission": permission,
+                    "value": {"$in": ["", *values]},
+                },
+                {"_id": False, "value": True, "rows": True, "version": True},
+            )
+        )
+        if not any(
+            entry["value"] == "" and entry.get("version") == version
+            for entry in entries
+        ):
+            return None
+
+        return sorted({row for entry in entries for row in entry["rows"]})
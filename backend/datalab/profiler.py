@@ -0,0 +1,116 @@
+"""
+Instrumentation of DataLab builds
+
+A profile records the duration of each stage of a build, along with details
+such as the number of rows going in and out of a join. Stages are only
+recorded while a profile is active, so instrumented code costs nothing
+otherwise. When the outermost profile finishes, it is logged as a structured
+event on the ontask logger.
+
+If tracemalloc is tracing (e.g. when explaining a build), each stage also
+records the memory it allocated and its high-water mark, relative to the
+memory in use when the stage started. The high-water mark is reset for each
+stage where tracemalloc supports it (Python 3.9+). Otherwise it is only known
+for the stages which raised the high-water mark of the whole trace.
+"""
+from contextlib import contextmanager
+from time import perf_counter
+import threading
+import tracemalloc
+
+import logging
+
+logger = logging.getLogger("ontask")
+
+_local = threading.local()
+
+
+class Profile:
+    def __init__(self, name, **details):
+        self.name = name
+        self.details = details
+        self.stages = []
+        self.duration = None
+        self.memory = None
+        # Highest peak of the stages nested in this one, as the peak is reset
+        # for each of them
+        self.nested_peak = 0
+
+    def as_dict(self):
+        profile = {"stage": self.name, "duration": self.duration, **self.details}
+        if self.memory is not None:
+            profile["memory"] = self.memory
+        if self.stages:
+            profile["stages"] = [stage.as_dict() for stage in self.stages]
+        return profile
+
+
+@contextmanager
+def _record(name, details, log):
+    parent = getattr(_local, "profile", None)
+    current = Profile(name, **details)
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        baseline, initial_peak = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc, "reset_peak"):
+            if parent is not None:
+                parent.nested_peak = max(parent.nested_peak, initial_peak)
+            tracemalloc.reset_peak()
+
+    _local.profile = current
+    start = perf_counter()
+    try:
+        yield current
+    finally:
+        current.duration = round(perf_counter() - start, 6)
+        if tracing and tracemalloc.is_tracing():
+            size, peak = tracemalloc.get_traced_memory()
+            current.memory = {"current": size, "allocated": size - baseline}
+            if hasattr(tracemalloc, "reset_peak"):
+                peak = max(peak, current.nested_peak)
+                current.memory["peak"] = peak - baseline
+                if parent is not None:
+                    parent.nested_peak = max(parent.nested_peak, peak)
+            elif peak > initial_peak:
+                current.memory["peak"] = peak - baseline
+
+        _local.profile = parent
+        if parent is not None:
+            parent.stages.append(current)
+        elif log:
+            logger.info(name, extra=current.as_dict())
+
+
+def profile(name, **details):
+    """
+    Profile the enclosed block, which is logged if it isn't nested inside
+    another profile
+    """
+    return _record(name, details, log=True)
+
+
+@contextmanager
+def stage(name, **details):
+    """Record the enclosed block as a stage of the active profile, if any"""
+    if getattr(_local, "profile", None) is None:
+        yield Profile(name, **details)
+        return
+
+    with _record(name, details, log=False) as current:
+        yield current
+
+
+@contextmanager
+def explain(name, **details):
+    """Profile the enclosed block, including memory usage"""
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+
+    try:
+        with _record(name, details, log=True) as current:
+            yield current
+    finally:
+        if not tracing:
+            tracemalloc.stop()
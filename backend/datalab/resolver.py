@@ -0,0 +1,119 @@
+"""
+Resolution of the sources referenced by the steps of a DataLab (datasources,
+other DataLabs and forms).
+
+Lookups are batched per collection, and within a source scope (e.g. a request
+or a task) every source document is fetched at most once. As the same document
+instance is shared, a DataLab used as a source also only builds its data once.
+"""
+from contextlib import contextmanager
+import threading
+
+_local = threading.local()
+
+
+def _get(obj, key, default=None):
+    # Steps are either embedded documents or the raw dicts of a request payload
+    try:
+        value = obj[key]
+    except (KeyError, AttributeError):
+        return default
+    return default if value is None else value
+
+
+class SourceResolver:
+    def __init__(self):
+        self.documents = {}
+
+    def prefetch(self, steps):
+        """Fetch the sources of all of the given steps, in one query per collection"""
+        from datasource.models import Datasource
+        from datalab.models import Datalab
+        from form.models import Form
+
+        pending = {"datasource": set(), "datalab": set()}
+        forms = set()
+
+        for step in steps:
+            if step["type"] == "datasource":
+                module = step["datasource"]
+                source_id = str(module["id"])
+                if source_id not in self.documents:
+                    pending[_get(module, "source_type", "datasource")].add(source_id)
+
+            elif step["type"] == "form" and _get(step, "form"):
+                if str(step["form"]) not in self.documents:
+                    forms.add(str(step["form"]))
+
+        # The source type of older DataLabs may not be accurate, so any source
+        # that isn't found is then looked up in the other collection
+        models = {"datasource": Datasource, "datalab": Datalab}
+        for source_type, ids in pending.items():
+            if ids:
+                self._fetch(models[source_type], ids)
+
+        for source_type, ids in pending.items():
+            missing = ids - set(self.documents)
+            if missing:
+                other = "datalab" if source_type == "datasource" else "datasource"
+                self._fetch(models[other], missing)
+
+        if forms:
+            self._fetch(Form, forms)
+
+    def _fetch(self, model, ids):
+        from datasource.models import Datasource
+
+        queryset = model.objects(id__in=list(ids))
+        if model is Datasource:
+            # Rows are loaded on demand by Datasource.load_data
+            queryset = queryset.exclude("inline_data")
+
+        for document in queryset:
+            self.documents[str(document.id)] = document
+
+    def get_source(self, module):
+        """Datasource or DataLab referenced by a datasource module"""
+        source_id = str(module["id"])
+        if source_id not in self.documents:
+            self.prefetch([{"type": "datasource", "datasource": module}])
+        return self.documents.get(source_id)
+
+    def get_form(self, form_id):
+        form_id = str(form_id)
+        if form_id not in self.documents:
+            self.prefetch([{"type": "form", "form": form_id}])
+        return self.documents.get(form_id)
+
+
+@contextmanager
+def source_scope():
+    """Share a single identity map of sources within the enclosed block"""
+    previous = getattr(_local, "resolver", None)
+    _local.resolver = previous or SourceResolver()
+    try:
+        yield _local.resolver
+    finally:
+        _local.resolver = previous
+
+
+def get_resolver():
+    """Resolver of the current source scope, or a new resolver outside of one"""
+    return getattr(_local, "resolver", None) or SourceResolver()
+
+
+class SourceScopeMiddleware:
+    """
+    Opens a source scope for each read-only request. Requests which modify
+    data are not scoped, so that they never rebuild from stale documents.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method not in ["GET", "HEAD"]:
+            return self.get_response(request)
+
+        with source_scope():
+            return self.get_response(request)
@@ -5,34 +5,26 @@ from rest_framework_mongoengine.serializers import (
 )
 
 from .models import Datalab, Column
+from .resolver import get_resolver
 from datasource.models import Datasource
 from form.models import Form
 from form.serializers import FormSerializer
-from workflow.models import Workflow, EmailJob, Email
-
-
-class EmailSerializer(EmbeddedDocumentSerializer):
-    class Meta:
-        model = Email
-        exclude = ["content"]
-
-
-class EmailJobSerializer(EmbeddedDocumentSerializer):
-    emails = EmailSerializer(many=True, allow_null=True, read_only=True)
-
-    class Meta:
-        model = EmailJob
-        fields = "__all__"
+from workflow.models import Workflow, EmailJob
+from workflow.serializers import EmailJobSerializer
 
 
 class ActionSerializer(DocumentSerializer):
-    emailJobs = EmailJobSerializer(many=True, allow_null=True, read_only=True)
+    emailJobs = serializers.SerializerMethodField()
     emailField = serializers.SerializerMethodField()
 
     class Meta:
         model = Workflow
         fields = ["id", "name", "emailJobs", "emailField"]
 
+    def get_emailJobs(self, action):
+        jobs = EmailJob.objects(action=action.id).order_by("initiated_at")
+        return EmailJobSerializer(jobs, many=True).data
+
     def get_emailField(self, action):
         if "emailSettings" in action:
             return action.emailSettings.field
@@ -50,28 +42,17 @@ class OrderItemSerializer(EmbeddedDocumentSerializer):
     details = serializers.SerializerMethodField()
 
     def get_details(self, order_item):
-        if not "objects" in self.context:
-            self.context["objects"] = {}
+        if not "resolver" in self.context:
+            self.context["resolver"] = get_resolver()
+            self.context["resolver"].prefetch(self.context["steps"])
 
+        resolver = self.context["resolver"]
         module = self.context["steps"][order_item.stepIndex]
 
         details = {"label": order_item.field, "module_type": module.type}
 
         if module.type == "datasource":
-            if module.datasource.id in self.context["objects"]:
-                datasource = self.context["objects"][module.datasource.id]
-            else:
-                try:
-                    datasource = Datasource.objects.get(id=module.datasource.id)
-                except:
-                    pass
-
-                try:
-                    datasource = Datalab.objects.get(id=module.datasource.id)
-                except:
-                    pass
-
-                self.context["objects"][module.datasource.id] = datasource
+            datasource = resolver.get_source(module.datasource)
 
             details["from"] = datasource.name
             details["label"] = module.datasource.labels.get(order_item.field)
@@ -84,11 +65,7 @@ class OrderItemSerializer(EmbeddedDocumentSerializer):
                 ).stepIndex
                 form_module_id = datasource.steps[form_module_index].form
 
-                if form_module_id in self.context["objects"]:
-                    form = self.context["objects"][form_module_id]
-                else:
-                    form = Form.objects.get(id=form_module_id)
-                    self.context["objects"][form_module_id] = form
+                form = resolver.get_form(form_module_id)
 
                 details["from"] = form.name
                 for field in form.fields:
@@ -105,11 +82,7 @@ class OrderItemSerializer(EmbeddedDocumentSerializer):
                             ]
 
         elif module.type == "form":
-            if module.form in self.context["objects"]:
-                form = self.context["objects"][module.form]
-            else:
-                form = Form.objects.get(id=module.form)
-                self.context["objects"][module.form] = form
+            form = resolver.get_form(module.form)
 
             details["from"] = form.name
             for field in form.fields:
@@ -184,7 +157,7 @@ class DatalabSerializer(DocumentSerializer):
         return serializer.data
 
     def get_actions(self, datalab):
-        actions = Workflow.objects(datalab=datalab.id)
+        actions = Workflow.objects(datalab=datalab.id).only("id", "name", "emailSettings")
         serializer = ActionSerializer(actions, many=True)
         return serializer.data
 
@@ -218,7 +191,10 @@ class RestrictedDatalabSerializer(DocumentSerializer):
         return self.context.get("data", datalab.data)
 
     def get_filter_details(self, datalab):
-        return datalab.filter_details(filters=self.context.get("filters"))
+        # Only the rows which the user has access to are filtered
+        return datalab.filter_details(
+            filters=self.context.get("filters"), data=self.context.get("data")
+        )
 
     def get_default_group(self, datalab):
         return self.context.get("default_group")
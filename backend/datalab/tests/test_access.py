@@ -0,0 +1,147 @@
+import pytest
+
+from datalab.models import AccessIndex, Datalab, access_version
+from datalab.utils import get_relations
+from datasource.models import Datasource
+from form.models import Field, Form
+
+STUDENTS = [
+    {"zid": "z1", "email": "Ada@ontask.org", "tutor": "barbara@ontask.org"},
+    {"zid": "z2", "email": "alan@ontask.org", "tutor": "Barbara@ontask.org"},
+    {"zid": "z3", "email": None, "tutor": "edsger@ontask.org"},
+    {"zid": "z4", "email": "", "tutor": None},
+    {"zid": "z5", "email": "ada@ontask.org", "tutor": 5},
+]
+
+
+def accessible(data, permission, values):
+    # The baseline filtered the whole table by the lowercase value of each row,
+    # but also matched rows with an empty value to an empty value of the user
+    # (e.g. of their LTI payload), although those users weren't permitted
+    return [
+        record
+        for record in data
+        if isinstance(record.get(permission), str)
+        and record[permission]
+        and record[permission].lower() in values
+    ]
+
+
+def relate(datalab):
+    """Rebuild the relations of a DataLab, as is done once its sources change"""
+    datalab.relations = get_relations(
+        datalab.to_mongo()["steps"], datalab.id, permission=datalab.permission
+    )
+    datalab.refresh_access()
+    return datalab
+
+
+@pytest.fixture
+def datalab(make_datalab):
+    return make_datalab(STUDENTS, permission="email")
+
+
+@pytest.fixture
+def students(datalab):
+    return Datasource.objects.get(id=datalab.steps[0].datasource.id)
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        {"ada@ontask.org"},
+        {"alan@ontask.org", "ada@ontask.org"},
+        {"grace@ontask.org"},
+        {"", "5"},
+        set(),
+    ],
+)
+def test_accessible_data(datalab, values):
+    expected = accessible(datalab.data, "email", values)
+
+    # Once from the index rebuilt on a miss, and then from the index itself
+    assert datalab.accessible_data("email", values) == expected
+    assert datalab.accessible_data("email", values) == expected
+
+
+def test_lookup(datalab):
+    version = access_version(datalab.relations, "email")
+
+    def lookup(permission, *values):
+        return AccessIndex.lookup(datalab.id, permission, values, version)
+
+    assert lookup("email", "ada@ontask.org") == [0, 4]
+    assert lookup("email", "ada@ontask.org", "alan@ontask.org") == [0, 1, 4]
+    assert lookup("email", "grace@ontask.org") == []
+    # Permission fields which haven't been indexed
+    assert lookup("tutor", "barbara@ontask.org") is None
+
+
+def test_rows_are_fetched_from_the_index(datalab, monkeypatch):
+    datalab = Datalab.objects.get(id=datalab.id)
+
+    def build_data(self, rows=None):
+        assert rows == [1]
+        return [STUDENTS[1]]
+
+    monkeypatch.setattr(Datalab, "build_data", build_data)
+    assert datalab.accessible_data("email", ["alan@ontask.org"]) == [STUDENTS[1]]
+
+
+def test_index_is_stale_once_the_relations_change(datalab, students):
+    version = access_version(datalab.relations, "email")
+    current = [
+        STUDENTS[0],
+        *STUDENTS[2:],
+        {"zid": "z6", "email": "ADA@ontask.org", "tutor": None},
+    ]
+    students.store_data(current)
+
+    datalab.relations = get_relations(
+        datalab.to_mongo()["steps"], datalab.id, permission="email"
+    )
+    datalab.save()
+    new_version = access_version(datalab.relations, "email")
+
+    assert new_version != version
+    assert AccessIndex.lookup(datalab.id, "email", set(), new_version) is None
+    # The new rows are found, and the index is rebuilt from the new relations
+    assert datalab.accessible_data("email", {"ada@ontask.org"}) == [
+        STUDENTS[0],
+        STUDENTS[4],
+        {"zid": "z6", "email": "ADA@ontask.org", "tutor": None},
+    ]
+    rows = AccessIndex.lookup(datalab.id, "email", {"ada@ontask.org"}, new_version)
+    assert rows == [0, 3, 4]
+    # Values which no longer grant access to any rows are removed
+    assert not AccessIndex.objects(datalab=datalab.id, value="alan@ontask.org")
+
+
+def test_refresh_access_indexes_form_permissions(container, datalab):
+    Form(
+        container=container,
+        datalab=datalab,
+        name="Feedback",
+        primary="zid",
+        fields=[Field(name="comment", type="text")],
+        permission="tutor",
+    ).save()
+    relate(datalab)
+    version = access_version(datalab.relations, "tutor")
+
+    assert sorted(datalab.permitted_users) == ["ada@ontask.org", "alan@ontask.org"]
+    rows = AccessIndex.lookup(datalab.id, "tutor", {"barbara@ontask.org"}, version)
+    assert rows == [0, 1]
+    assert datalab.accessible_data("tutor", {"barbara@ontask.org"}) == accessible(
+        datalab.data, "tutor", {"barbara@ontask.org"}
+    )
+
+
+def test_empty_relations(make_datalab):
+    datalab = make_datalab([], fields=["zid", "email", "tutor"], permission="email")
+
+    assert datalab.relations == []
+    assert datalab.permitted_users == []
+    version = access_version([], "email")
+    assert AccessIndex.lookup(datalab.id, "email", {"ada@ontask.org"}, version) == []
+    assert datalab.accessible_data("email", {"ada@ontask.org"}) == []
@@ -0,0 +1,76 @@
+import pytest
+
+from datalab.models import Datalab, DatalabCache
+from datasource.models import Datasource
+
+
+@pytest.fixture
+def datalab(make_datalab):
+    return make_datalab(
+        [
+            {"zid": "z1", "name": "Ada", "mark": 7.0},
+            {"zid": "z2", "name": "Alan", "mark": 4.5},
+        ],
+        types={"zid": "text", "name": "text", "mark": "number"},
+    )
+
+
+@pytest.fixture
+def students(datalab):
+    return Datasource.objects.get(id=datalab.steps[0].datasource.id)
+
+
+def test_data_is_built_and_cached(datalab):
+    assert datalab.data == [
+        {"zid": "z1", "name": "Ada", "mark": 7.0},
+        {"zid": "z2", "name": "Alan", "mark": 4.5},
+    ]
+
+    cache = DatalabCache.objects.get(datalab=datalab.id)
+    assert cache.fingerprint == datalab.fingerprint()
+    assert cache.data == datalab.data
+
+
+def test_cached_data_is_served_without_a_build(datalab, monkeypatch):
+    expected = Datalab.objects.get(id=datalab.id).data
+
+    def build_data(self, rows=None):
+        raise AssertionError("The cached table should have been served")
+
+    monkeypatch.setattr(Datalab, "build_data", build_data)
+    assert Datalab.objects.get(id=datalab.id).data == expected
+
+
+def test_datasource_update_invalidates_the_cache(datalab, students):
+    previous = datalab.fingerprint()
+    assert datalab.data[0]["name"] == "Ada"
+
+    students.store_data(
+        [
+            {"zid": "z1", "name": "Grace", "mark": 7.0},
+            {"zid": "z2", "name": "Alan", "mark": 4.5},
+        ]
+    )
+
+    datalab = Datalab.objects.get(id=datalab.id)
+    assert datalab.fingerprint() != previous
+    assert datalab.data[0]["name"] == "Grace"
+
+
+def test_step_change_invalidates_the_cache(datalab):
+    previous = datalab.fingerprint()
+
+    datalab.steps[0].datasource.labels["name"] = "Name"
+    assert datalab.fingerprint() != previous
+
+
+def test_rows_are_read_from_the_cache(datalab):
+    datalab.data
+    assert Datalab.objects.get(id=datalab.id).load_rows([1]) == [
+        {"zid": "z2", "name": "Alan", "mark": 4.5}
+    ]
+
+
+def test_datalab_without_steps_is_empty(container):
+    datalab = Datalab(container=container, name="Empty").save()
+    assert datalab.data == []
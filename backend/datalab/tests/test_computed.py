@@ -0,0 +1,146 @@
+import math
+
+import pandas as pd
+import pytest
+
+from datalab.utils import calculate_computed_field
+
+# Columns of the combined table contributed by each step, as passed to the
+# computed fields when a DataLab is built
+BUILD_FIELDS = [["zid", "mark", "bonus", "grade"], ["attendance"]]
+
+
+def table():
+    return pd.DataFrame(
+        [
+            {
+                "zid": "z1",
+                "mark": 1,
+                "bonus": 2.5,
+                "grade": "x",
+                "attendance__w1": True,
+                "attendance__w2": False,
+            },
+            {
+                "zid": "z2",
+                "mark": None,
+                "bonus": "3",
+                "grade": None,
+                "attendance__w1": True,
+                "attendance__w2": True,
+            },
+            {
+                "zid": "z3",
+                "mark": 4,
+                "bonus": "n/a",
+                "grade": "y",
+                "attendance__w1": None,
+                "attendance__w2": False,
+            },
+        ]
+    )
+
+
+def formula(*nodes):
+    # Slate documents always start with a paragraph block
+    return {"document": {"nodes": [{"type": "paragraph"}, *nodes]}}
+
+
+def field(name):
+    return {"type": "field", "data": {"name": name}}
+
+
+def constant(value):
+    return {"type": "constant", "data": {"value": value}}
+
+
+def operator(type):
+    return {"type": "operator", "data": {"type": type}}
+
+
+def aggregation(type, columns, **data):
+    return {"type": "aggregation", "data": {"type": type, "columns": columns, **data}}
+
+
+OPEN, CLOSE = {"type": "open-bracket"}, {"type": "close-bracket"}
+
+# Expected values are those of the baseline, which evaluated the formula for
+# each record in turn
+CASES = {
+    "field_plus_constant": (
+        formula(field("mark"), operator("+"), constant("2")),
+        [3.0, 2.0, 6.0],
+    ),
+    "text_is_zero": (
+        formula(field("mark"), operator("*"), field("bonus")),
+        [2.5, 0.0, 0.0],
+    ),
+    "division_by_zero": (
+        formula(field("mark"), operator("/"), constant("0")),
+        [None, None, None],
+    ),
+    "brackets": (
+        formula(
+            OPEN,
+            field("mark"),
+            operator("+"),
+            constant("1"),
+            CLOSE,
+            operator("*"),
+            constant("3"),
+        ),
+        [6.0, 3.0, 15.0],
+    ),
+    "missing_field": (
+        formula(field("missing"), operator("+"), constant("1")),
+        [1.0, 1.0, 1.0],
+    ),
+    "constants_only": (
+        formula(constant("5"), operator("-"), constant("2")),
+        [3.0, 3.0, 3.0],
+    ),
+    "sum": (formula(aggregation("sum", ["0_1", "0_2"])), [3.5, 3.0, 4.0]),
+    "average": (formula(aggregation("average", ["0_1", "0_2"])), [1.75, 1.5, 2.0]),
+    "last": (formula(aggregation("last", ["0_1", "0_3"])), ["x", None, "y"]),
+    "last_in_formula": (
+        formula(aggregation("last", ["0_1", "0_2"]), operator("+"), constant("1")),
+        [3.5, 4.0, 1.0],
+    ),
+    "concat": (
+        formula(aggregation("concat", ["0_1", "0_3"], delimiter=";")),
+        ["1.0;x", "nan;", "4.0;y"],
+    ),
+    "sum_checkbox_group": (
+        formula(aggregation("sum_checkbox_group", ["1"])),
+        [1.0, 2.0, 0.0],
+    ),
+    "step_out_of_range": (formula(aggregation("sum", ["5_0"])), [0.0, 0.0, 0.0]),
+}
+
+
+@pytest.mark.parametrize("name", CASES)
+def test_formula(name):
+    document, expected = CASES[name]
+    assert calculate_computed_field(document, table(), BUILD_FIELDS, {}) == expected
+
+
+def test_list_aggregation():
+    values = calculate_computed_field(
+        formula(aggregation("list", ["0_1", "0_3"])), table(), BUILD_FIELDS, {}
+    )
+
+    assert values[0] == [1.0, "x"]
+    assert math.isnan(values[1][0]) and values[1][1] is None
+    assert values[2] == [4.0, "y"]
+
+
+@pytest.mark.parametrize("name", [*CASES, "list"])
+def test_empty_table(name):
+    document = (
+        formula(aggregation("list", ["0_1", "0_3"]))
+        if name == "list"
+        else CASES[name][0]
+    )
+    empty = table().iloc[0:0]
+
+    assert calculate_computed_field(document, empty, BUILD_FIELDS, {}) == []
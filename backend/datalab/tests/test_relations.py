@@ -0,0 +1,211 @@
+import pytest
+
+from datalab.utils import diff_records, get_relations, patch_relations
+from datasource.models import Datasource
+
+STUDENTS = [
+    {"zid": "z1", "email": "ada@ontask.org", "name": "Ada"},
+    {"zid": "z2", "email": "alan@ontask.org", "name": "Alan"},
+    {"zid": "z3", "email": "grace@ontask.org", "name": "Grace"},
+]
+
+TUTORS = [
+    {"student": "z1", "tutor": "barbara@ontask.org"},
+    {"student": "z2", "tutor": "edsger@ontask.org"},
+]
+
+
+def store(container, name, data):
+    datasource = Datasource(container=container, name=name, fields=list(data[0]))
+    datasource.save()
+    datasource.store_data(data)
+    return datasource
+
+
+def datasource_step(datasource, primary, matching=None, how="left"):
+    return {
+        "type": "datasource",
+        "datasource": {
+            "id": str(datasource.id),
+            "primary": primary,
+            "matching": matching,
+            "fields": datasource.fields,
+            "labels": {field: field for field in datasource.fields},
+            "types": {},
+            "discrepencies": {
+                "primary": how in ["right", "outer"],
+                "matching": how in ["left", "outer"],
+            },
+        },
+    }
+
+
+def rows(relations):
+    return sorted(relations, key=lambda row: row["zid"])
+
+
+def test_get_relations_left_join(container):
+    students = store(container, "Students", STUDENTS)
+    tutors = store(container, "Tutors", TUTORS)
+    steps = [
+        datasource_step(students, "zid"),
+        datasource_step(tutors, "student", matching="zid", how="left"),
+    ]
+
+    # Only the primary key and the fields in use are kept
+    assert get_relations(steps, permission="tutor") == [
+        {"zid": "z1", "tutor": "barbara@ontask.org"},
+        {"zid": "z2", "tutor": "edsger@ontask.org"},
+        {"zid": "z3", "tutor": None},
+    ]
+
+
+def test_diff_records():
+    current = [
+        {"zid": "z1", "email": "ADA@ontask.org", "name": "Ada"},
+        {"zid": "z2", "email": "alan@ontask.org", "name": "Alan Turing"},
+        {"zid": "z4", "email": "tim@ontask.org", "name": "Tim"},
+    ]
+
+    diff = diff_records(STUDENTS, current, "zid", ["email"])
+
+    assert diff["added"] == {"z4"}
+    assert diff["removed"] == {"z3"}
+    # Only the given fields are compared
+    assert diff["changed"] == {"z1"}
+    assert diff["records"]["z4"] == current[2]
+
+
+def test_diff_records_with_duplicate_keys():
+    assert diff_records(STUDENTS, [*STUDENTS, STUDENTS[0]], "zid", ["email"]) is None
+
+
+@pytest.mark.parametrize(
+    "current",
+    [
+        # Changed
+        [{**STUDENTS[0], "email": "lovelace@ontask.org"}, *STUDENTS[1:]],
+        # Added
+        [*STUDENTS, {"zid": "z4", "email": "tim@ontask.org", "name": "Tim"}],
+        # Removed
+        STUDENTS[:2],
+        # Unchanged
+        STUDENTS,
+    ],
+)
+def test_patch_base_step(container, current):
+    students = store(container, "Students", STUDENTS)
+    steps = [datasource_step(students, "zid")]
+    relations = get_relations(steps, permission="email")
+
+    students.store_data(current)
+    patched = patch_relations(
+        steps,
+        relations,
+        source_id=students.id,
+        previous_data=STUDENTS,
+        current_data=current,
+        permission="email",
+    )
+
+    assert rows(patched) == rows(get_relations(steps, permission="email"))
+
+
+@pytest.mark.parametrize(
+    "current",
+    [
+        # Changed
+        [{"student": "z1", "tutor": "john@ontask.org"}, TUTORS[1]],
+        # Added, for a student already in the table
+        [*TUTORS, {"student": "z3", "tutor": "john@ontask.org"}],
+        # Added, for a student who isn't in the table
+        [*TUTORS, {"student": "z9", "tutor": "john@ontask.org"}],
+        # Removed
+        TUTORS[:1],
+    ],
+)
+def test_patch_left_join(container, current):
+    students = store(container, "Students", STUDENTS)
+    tutors = store(container, "Tutors", TUTORS)
+    steps = [
+        datasource_step(students, "zid"),
+        datasource_step(tutors, "student", matching="zid", how="left"),
+    ]
+    relations = get_relations(steps, permission="tutor")
+
+    tutors.store_data(current)
+    patched = patch_relations(
+        steps,
+        relations,
+        source_id=tutors.id,
+        previous_data=TUTORS,
+        current_data=current,
+        permission="tutor",
+    )
+
+    assert rows(patched) == rows(get_relations(steps, permission="tutor"))
+
+
+def test_patch_inner_join_with_new_records_is_rebuilt(container):
+    students = store(container, "Students", STUDENTS)
+    tutors = store(container, "Tutors", TUTORS)
+    steps = [
+        datasource_step(students, "zid"),
+        datasource_step(tutors, "student", matching="zid", how="inner"),
+    ]
+    relations = get_relations(steps, permission="tutor")
+
+    current = [*TUTORS, {"student": "z3", "tutor": "john@ontask.org"}]
+    patched = patch_relations(
+        steps,
+        relations,
+        source_id=tutors.id,
+        previous_data=TUTORS,
+        current_data=current,
+        permission="tutor",
+    )
+
+    assert patched is None
+
+
+def test_patch_schema_change_is_rebuilt(container):
+    students = store(container, "Students", STUDENTS)
+    steps = [datasource_step(students, "zid")]
+    relations = get_relations(steps, permission="email")
+
+    current = [{**student, "phone": None} for student in STUDENTS]
+    patched = patch_relations(
+        steps,
+        relations,
+        source_id=students.id,
+        previous_data=STUDENTS,
+        current_data=current,
+        permission="email",
+    )
+
+    assert patched is None
+
+
+def test_patch_source_used_twice_is_rebuilt(container):
+    students = store(container, "Students", STUDENTS)
+    steps = [
+        datasource_step(students, "zid"),
+        datasource_step(students, "zid", matching="zid"),
+    ]
+
+    patched = patch_relations(
+        steps, [], source_id=students.id, previous_data=STUDENTS, current_data=STUDENTS
+    )
+
+    assert patched is None
+
+
+def test_patch_empty_datasource(container):
+    students = store(container, "Students", STUDENTS)
+    steps = [datasource_step(students, "zid")]
+
+    patched = patch_relations(
+        steps, [], source_id=students.id, previous_data=[], current_data=[]
+    )
+
+    assert patched == []
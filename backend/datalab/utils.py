@@ -1,5 +1,6 @@
 from rest_framework_mongoengine.validators import ValidationError
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import numexpr as ne
 import pandas as pd
@@ -10,43 +11,53 @@ from datasource.models import Datasource
 from workflow.models import Workflow
 from form.models import Form
 from datalab.serializers import OtherDatalabSerializer
+from datalab.resolver import get_resolver
+from datalab.profiler import profile, stage
+
+from ontask.settings import DATALAB_REFRESH_WORKERS
+
+import logging
+
+logger = logging.getLogger("ontask")
 
 
 def bind_column_types(steps):
+    resolver = get_resolver()
+    resolver.prefetch(steps)
+
     for step in steps:
         if step["type"] == "datasource":
             step = step["datasource"]
-            datasource = None
-            datalab = None
+            source = resolver.get_source(step)
             datalab_fields = None
 
+            # Record where the source lives, so that later lookups go straight
+            # to the right collection
+            if source:
+                step["source_type"] = (
+                    "datalab" if isinstance(source, Datalab) else "datasource"
+                )
+
             fields = step["fields"]
             types = step["types"] if "types" in step else {}
 
             for field in fields:
                 if field not in types:
-                    if not datasource:
-                        try:
-                            datasource = Datasource.objects.get(id=step["id"])
-                        except:
-                            pass
-
-                    if datasource:
-                        if field in datasource["types"]:
-                            types[field] = datasource["types"][field]
-                        else: 
-                            print("Field: ", field, " does not exist")
-
-                    if not datalab:
-                        try:
-                            datalab = Datalab.objects.get(id=step["id"])
-                            datalab_fields = OtherDatalabSerializer(datalab).data[
+                    if isinstance(source, Datasource):
+                        if field in source["types"]:
+                            types[field] = source["types"][field]
+                        else:
+                            logger.debug(
+                                "datalab.missing_field",
+                                extra={"field": field, "datasource": str(source.id)},
+                            )
+
+                    elif isinstance(source, Datalab):
+                        if datalab_fields is None:
+                            datalab_fields = OtherDatalabSerializer(source).data[
                                 "columns"
                             ]
-                        except:
-                            pass
 
-                    if datalab and datalab_fields:
                         for datalab_field in datalab_fields:
                             if datalab_field["details"]["label"] == field:
                                 types[field] = datalab_field["details"]["field_type"]
@@ -73,28 +84,64 @@ def bind_column_types(steps):
     return steps
 
 
-def calculate_computed_field(formula, record, build_fields, tracking_feedback_data):
-    calculated_value = 0
-
-    populated_formula = []
+def cast_float(value):
+    try:
+        return float(value) if not pd.isna(value) else 0
+    except (ValueError, TypeError) as Error:
+        return 0
 
-    def cast_float(value):
-        try:
-            return float(value) if not pd.isna(value) else 0
-        except (ValueError, TypeError) as Error:
-            return 0
 
-    def tracking_feedback_value(action_id, job_id, data_type, record):
+def cast_float_column(column):
+    """Column-wise equivalent of cast_float, i.e. NaN and non-numeric values become 0"""
+    try:
+        values = column.astype(float)
+    except (ValueError, TypeError):
+        # Only fall back to casting value by value if the column contains text
+        values = column.map(cast_float).astype(float)
+    return values.fillna(0).values
+
+
+def is_true_column(column):
+    return np.array(
+        [isinstance(value, (bool, np.bool_)) and bool(value) for value in column.values],
+        dtype=float,
+    )
+
+
+def calculate_computed_field(formula, data, build_fields, tracking_feedback_data):
+    """
+    Compiles the formula of a computed field into a single column-wise expression
+    over the combined table, rather than evaluating the formula for each record.
+
+    Returns the list of values of the computed field, in the order of the rows
+    of the combined table.
+    """
+    nodes = formula["document"]["nodes"]
+    row_count = len(data)
+
+    def raw_column(field):
+        if field in data:
+            return data[field].astype(object).values
+        return np.full(row_count, None, dtype=object)
+
+    def numeric_column(field):
+        if field in data:
+            return cast_float_column(data[field])
+        return np.zeros(row_count)
+
+    def tracking_feedback_column(action_id, job_id, data_type):
         email_field = tracking_feedback_data[action_id]["email_field"]
-        data = tracking_feedback_data[action_id]["jobs"][job_id][data_type]
-        return (
-            data[record[email_field]]
-            if email_field in record and record[email_field] in data
-            else 0
-        )
+        values = tracking_feedback_data[action_id]["jobs"][job_id][data_type]
+        if email_field not in data:
+            return np.zeros(row_count)
+        return data[email_field].map(lambda recipient: values.get(recipient, 0)).values
+
+    def iterate_aggregation(columns, is_numerical=True, is_checkbox_group=False):
+        # Each operand is a whole column of the table
+        operands = []
 
-    def iterate_aggregation(columns, is_numerical=True, is_checkbox_group=False, average=False):
-        values = []
+        def add_field(field):
+            operands.append(numeric_column(field) if is_numerical else raw_column(field))
 
         for column in columns:
             split_column = column.split("_")
@@ -105,90 +152,77 @@ def calculate_computed_field(formula, record, build_fields, tracking_feedback_da
                 if len(split_column) == 1:
                     for action in tracking_feedback_data:
                         for email_job in tracking_feedback_data[action]["jobs"]:
-                            values.append(
-                                tracking_feedback_value(
-                                    action, email_job, data_type, record
-                                )
+                            operands.append(
+                                tracking_feedback_column(action, email_job, data_type)
                             )
 
                 if len(split_column) == 2:
                     action_id = split_column[1]
                     for email_job in tracking_feedback_data[action_id]["jobs"]:
-                        values.append(
-                            tracking_feedback_value(
-                                action_id, email_job, data_type, record
-                            )
+                        operands.append(
+                            tracking_feedback_column(action_id, email_job, data_type)
                         )
 
                 if len(split_column) == 3:
                     action_id = split_column[1]
                     job_id = split_column[2]
-                    values.append(
-                        tracking_feedback_value(action_id, job_id, data_type, record)
+                    operands.append(
+                        tracking_feedback_column(action_id, job_id, data_type)
                     )
 
             else:
                 if len(split_column) == 1:
                     step_index = int(split_column[0])
                     if is_checkbox_group is True:
+                        # Count the ticked columns of the checkbox group
                         prefix = build_fields[step_index][0]
-                        # get all fields with this title in its name
-                        # for field in record:
-                            # print(record[field])
-                        for field in list(record.keys()):
-                            if prefix in field and record[field] is True:
-                                values.append(1)
+                        for field in list(data):
+                            if prefix in field:
+                                operands.append(is_true_column(data[field]))
 
                     for field in build_fields[step_index]:
-                        value = record[field] if field in record else None
-                        if value is None and average is True:
-                            values.append(cast_float(0))
-                        else:
-                            values.append(cast_float(value) if is_numerical else value)
+                        add_field(field)
 
                 elif len(split_column) == 2:
                     step_index, field_index = [int(i) for i in split_column]
-                    if step_index in build_fields:
-                        if field_index in build_fields[step_index]:
-                            field = build_fields[step_index][field_index]
-                            value = record[field] if field in record else None
-                            if value is None and average is True:
-                                values.append(cast_float(0))
-                            else:
-                                values.append(cast_float(value) if is_numerical else value)
-                    else: 
-                        if step_index < len(build_fields):
-                            if field_index < len(build_fields[step_index]):
-                                field = build_fields[step_index][field_index]
-                                value = record[field] if field in record else None
-                                if value is None and average is True:
-                                    values.append(cast_float(0))
-                                else:
-                                    values.append(cast_float(value) if is_numerical else value)
-
-        return values
-
-    # Populate values on first pass-through
-    for node in formula["document"]["nodes"]:
+                    if step_index < len(build_fields):
+                        if field_index < len(build_fields[step_index]):
+                            add_field(build_fields[step_index][field_index])
+
+        return operands
+
+    def total(operands):
+        return sum(operands) if len(operands) else np.zeros(row_count)
+
+    # Operands are bound to variables in the expression, so that numexpr
+    # evaluates the formula once over the full columns
+    expression = []
+    variables = {}
+
+    def add_operand(value):
+        name = f"v{len(variables)}"
+        variables[name] = value
+        expression.append(name)
+
+    for node in nodes:
         node_type = node["type"]
 
         if node_type == "open-bracket":
-            populated_formula.append("(")
+            expression.append("(")
 
         if node_type == "close-bracket":
-            populated_formula.append(")")
+            expression.append(")")
 
         if node_type == "operator":
-            populated_formula.append(node["data"]["type"])
+            expression.append(node["data"]["type"])
 
         if node_type == "field":
             field = node["data"]["name"]
-            if field in record:
-                populated_formula.append(cast_float(record[field]))
+            if field in data:
+                add_operand(numeric_column(field))
 
         if node_type == "constant":
-            value = node["data"]["value"]
-            populated_formula.append(cast_float(value))
+            add_operand(cast_float(node["data"]["value"]))
 
         if node_type == "aggregation":
             aggregation_type = node["data"]["type"]
@@ -196,52 +230,71 @@ def calculate_computed_field(formula, record, build_fields, tracking_feedback_da
             aggregation_value = 0
 
             if aggregation_type == "sum_checkbox_group":
-                aggregation_value = sum(iterate_aggregation(columns, is_checkbox_group=True))
+                aggregation_value = total(
+                    iterate_aggregation(columns, is_checkbox_group=True)
+                )
 
             if aggregation_type == "sum":
-                aggregation_value = sum(iterate_aggregation(columns))
-                 
+                aggregation_value = total(iterate_aggregation(columns))
+
             if aggregation_type == "average":
-                values = iterate_aggregation(columns)
-                aggregation_value = sum(values) / len(values) if len(values) else 0
+                operands = iterate_aggregation(columns)
+                aggregation_value = (
+                    total(operands) / len(operands) if len(operands) else 0
+                )
 
             if aggregation_type == "last":
                 # If the "last" aggregation is part of a larger formula, then treat
                 # it as numerical, since it must be part of a computation
-                values = iterate_aggregation(columns, is_numerical=False)
+                operands = iterate_aggregation(columns, is_numerical=False)
                 # If the number of nodes is 2, then the aggregation is standalone
                 # It's 2 and not 1, because Slate.js blockmap always starts with a paragraph block
-                if len(formula["document"]["nodes"]) > 2:
-                    aggregation_value = cast_float(values[-1]) if len(values) else 0
+                if len(nodes) > 2:
+                    aggregation_value = (
+                        cast_float_column(pd.Series(operands[-1]))
+                        if len(operands)
+                        else 0
+                    )
                 else:
-                    return values[-1] if len(values) else None
+                    return (
+                        list(operands[-1]) if len(operands) else [None] * row_count
+                    )
 
             if aggregation_type == "list":
-                return iterate_aggregation(columns, is_numerical=False)
+                operands = iterate_aggregation(columns, is_numerical=False)
+                return [list(values) for values in zip(*operands)] or [
+                    [] for _ in range(row_count)
+                ]
 
             if aggregation_type == "concat":
                 delimiter = node["data"]["delimiter"]
-                aggregation_value = iterate_aggregation(columns, is_numerical=False)
+                operands = iterate_aggregation(columns, is_numerical=False)
                 # Join values even if they are null, as this would be the expected
                 # functionality if the user is trying to construct a .csv
                 # I.e. the number of delimiters should be constant for all rows
                 # Regardless of whether a given column has a value or not
-                return delimiter.join(
-                    [str(x) if x is not None else "" for x in aggregation_value]
-                )
-
-            populated_formula.append(cast_float(aggregation_value))
-            
-    populated_formula = "".join([str(x) for x in populated_formula])
+                return [
+                    delimiter.join([str(x) if x is not None else "" for x in values])
+                    for values in zip(*operands)
+                ] or ["" for _ in range(row_count)]
 
+            add_operand(aggregation_value)
 
     try:
-        return ne.evaluate(populated_formula).item()
-    except (ZeroDivisionError, AttributeError, TypeError, KeyError, SyntaxError):
-        return None
+        result = ne.evaluate("".join(expression), local_dict=variables)
+    except (ZeroDivisionError, AttributeError, TypeError, KeyError, SyntaxError, ValueError):
+        return [None] * row_count
 
+    # Formulas made up of only constants evaluate to a single value
+    result = np.broadcast_to(result, (row_count,)).astype(float)
 
-def get_relations(steps, datalab_id=None, skip_last=False, permission=None):
+    # Evaluating the formula of a single record raised a ZeroDivisionError
+    # (i.e. None), whereas division by zero over a column gives inf or NaN
+    return [value if np.isfinite(value) else None for value in result.tolist()]
+
+
+def get_required_fields(steps, datalab_id=None, permission=None):
+    """Labels of the fields which must be included in the relations table"""
     required_fields = set()
 
     if permission:
@@ -267,20 +320,46 @@ def get_relations(steps, datalab_id=None, skip_last=False, permission=None):
         else:
             required_fields.add(step["matching"])
 
+    return required_fields
+
+
+def get_join_type(step):
+    if step["discrepencies"]["primary"] and step["discrepencies"]["matching"]:
+        # Full outer join
+        return "outer"
+    elif step["discrepencies"]["primary"]:
+        return "right"
+    elif step["discrepencies"]["matching"]:
+        return "left"
+    else:
+        return "inner"
+
+
+def get_relations(steps, datalab_id=None, skip_last=False, permission=None):
+    with profile("datalab.relations", datalab=datalab_id and str(datalab_id)):
+        return _build_relations(steps, datalab_id, skip_last, permission)
+
+
+def _build_relations(steps, datalab_id, skip_last, permission):
+    required_fields = get_required_fields(steps, datalab_id, permission)
+
+    datasource_steps = [
+        step["datasource"] for step in steps if step["type"] == "datasource"
+    ]
+
     if skip_last:
         datasource_steps = datasource_steps[:-1]
 
+    resolver = get_resolver()
+    with stage("source_fetch"):
+        resolver.prefetch(
+            [{"type": "datasource", "datasource": step} for step in datasource_steps]
+        )
+
     relations = pd.DataFrame()
     for step_index, step in enumerate(datasource_steps):
-        try:
-            datasource = Datasource.objects.get(id=step["id"])
-        except:
-            pass
-
-        try:
-            datasource = Datalab.objects.get(id=step["id"])
-        except:
-            pass
+        with stage("source_fetch", step=step_index):
+            datasource = resolver.get_source(step)
 
         # If this datasource has fields that are used by forms, actions, or datasources,
         # then ensure that these fields are included in the relation table
@@ -289,12 +368,14 @@ def get_relations(steps, datalab_id=None, skip_last=False, permission=None):
             if label in required_fields:
                 used_fields.append(field)
 
-        data = (
-            pd.DataFrame(data=datasource.data)
-            .set_index(step["primary"])
-            .filter(items=used_fields)  # Only include required fields
-            .rename(columns={field: step["labels"][field] for field in used_fields})
-        )
+        with stage("frame", step=step_index) as current:
+            data = (
+                datasource.load_data(fields=[step["primary"], *used_fields])
+                .set_index(step["primary"])
+                .filter(items=used_fields)  # Only include required fields
+                .rename(columns={field: step["labels"][field] for field in used_fields})
+            )
+            current.details["rows"] = len(data)
 
         # Ensure that there are no duplicate values
         if any(data.index.duplicated()):
@@ -312,21 +393,299 @@ def get_relations(steps, datalab_id=None, skip_last=False, permission=None):
                 }  # Rename the primary key if it has a label
             )
         else:
-            if step["discrepencies"]["primary"] and step["discrepencies"]["matching"]:
-                # Full outer join
-                how = "outer"
-            elif step["discrepencies"]["primary"]:
-                how = "right"
-            elif step["discrepencies"]["matching"]:
-                how = "left"
-            else:
-                how = "inner"
+            how = get_join_type(step)
 
-            relations = relations.merge(
-                data, how=how, left_on=step["matching"], right_index=True
-            ).reset_index(drop=True)
+            with stage(
+                "join", step=step_index, how=how, rows_in=len(relations)
+            ) as current:
+                relations = relations.merge(
+                    data, how=how, left_on=step["matching"], right_index=True
+                ).reset_index(drop=True)
+                current.details["rows_out"] = len(relations)
 
     # Replace NaN values with None to make it storable in MongoDB
-    relations.replace({pd.np.nan: None}, inplace=True)
+    with stage("nan_replace"):
+        relations.replace({pd.np.nan: None}, inplace=True)
+
+    with stage("to_dict", rows=len(relations)):
+        return relations.to_dict("records")
+
+
+def diff_records(previous, current, primary, fields):
+    """
+    Row-level diff of two versions of a datasource, keyed on the primary key
+    and only considering the given fields
+
+    Returns a dict of the added, removed and changed primary keys, or None if
+    either version has duplicate primary keys
+    """
+    previous = {record.get(primary): record for record in previous}
+    current_records = {record.get(primary): record for record in current}
+    if len(current_records) != len(current):
+        return None
+
+    added = set(current_records) - set(previous)
+    removed = set(previous) - set(current_records)
+    changed = {
+        key
+        for key in set(current_records) & set(previous)
+        if any(
+            previous[key].get(field) != current_records[key].get(field)
+            for field in fields
+        )
+    }
+
+    return {
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+        "records": current_records,
+    }
+
+
+def patch_relations(
+    steps, relations, source_id, previous_data, current_data, datalab_id=None, permission=None
+):
+    """
+    Incrementally maintains a relations table when the data of one of its
+    datasource steps has changed, rather than re-joining every step
+
+    Returns the patched relations, or None if the change cannot be applied in
+    place and the relations table must be rebuilt with get_relations
+    """
+    datasource_steps = [
+        step["datasource"] for step in steps if step["type"] == "datasource"
+    ]
+
+    # Only patch if the source is used by exactly one step
+    step_indexes = [
+        step_index
+        for step_index, step in enumerate(datasource_steps)
+        if str(step["id"]) == str(source_id)
+    ]
+    if len(step_indexes) != 1:
+        return None
+
+    step_index = step_indexes[0]
+    step = datasource_steps[step_index]
+    primary = step["primary"]
+
+    required_fields = get_required_fields(steps, datalab_id, permission)
+    columns = {
+        field: label
+        for field, label in step["labels"].items()
+        if label in required_fields and field != primary
+    }
+
+    # The columns of this step must not be used as the matching key of a later
+    # step, as the later joins would then also have to be re-evaluated
+    later_steps = datasource_steps[step_index + 1 :]
+    if any(later_step["matching"] in columns.values() for later_step in later_steps):
+        return None
+
+    # Changes to the schema of the datasource require a full rebuild
+    previous_fields = set(previous_data[0]) if len(previous_data) else set()
+    current_fields = set(current_data[0]) if len(current_data) else set()
+    if previous_fields != current_fields:
+        return None
+
+    diff = diff_records(previous_data, current_data, primary, list(columns))
+    if diff is None:
+        return None
+
+    if not (diff["added"] or diff["removed"] or diff["changed"]):
+        return relations
+
+    how = "base" if step_index == 0 else get_join_type(step)
+    key = step["labels"].get(primary, primary) if step_index == 0 else step["matching"]
+
+    if diff["added"] and how not in ["base", "left"]:
+        # Inner, right and outer joins would need rows from the other steps
+        # that are not present in the relations table
+        return None
+
+    if diff["removed"] and how in ["right", "outer"]:
+        return None
+
+    if how == "base":
+        if diff["added"] and len(datasource_steps) > 1:
+            return None
+        if diff["removed"] and any(
+            get_join_type(later_step) in ["right", "outer"] for later_step in later_steps
+        ):
+            return None
+
+    rows_by_key = defaultdict(list)
+    for row_index, row in enumerate(relations):
+        rows_by_key[row.get(key)].append(row_index)
+
+    relations = [dict(row) for row in relations]
+    removed_rows = set()
+
+    for primary_key in diff["changed"] | diff["added"]:
+        record = diff["records"][primary_key]
+        for row_index in rows_by_key.get(primary_key, []):
+            for field, label in columns.items():
+                relations[row_index][label] = record.get(field)
+
+    for primary_key in diff["removed"]:
+        for row_index in rows_by_key.get(primary_key, []):
+            if how == "left":
+                for label in columns.values():
+                    relations[row_index][label] = None
+            else:
+                removed_rows.add(row_index)
+
+    relations = [
+        row for row_index, row in enumerate(relations) if row_index not in removed_rows
+    ]
+
+    if how == "base":
+        # The datalab only consists of this step, so new records become new rows
+        for primary_key in diff["added"]:
+            record = diff["records"][primary_key]
+            relations.append(
+                {
+                    key: primary_key,
+                    **{label: record.get(field) for field, label in columns.items()},
+                }
+            )
+
+    return relations
+
+
+def get_dependency_graph(source_id, is_affected=None):
+    """
+    Walks the DataLabs downstream of a datasource or DataLab, one level of
+    dependency at a time
+
+    Arguments:
+        source_id -- ID of the datasource or DataLab that has changed
+        is_affected -- Optional predicate deciding whether a DataLab which
+            directly uses the source must be refreshed
+
+    Returns:
+        dict -- DataLab ID mapped to the set of IDs of its changed sources
+    """
+    parents = defaultdict(set)
+    visited = {str(source_id)}
+    frontier = [str(source_id)]
+
+    while frontier:
+        datalabs = Datalab.objects(steps__datasource__id__in=frontier).only(
+            *(["id", "steps", "relations"] if is_affected else ["id", "steps"])
+        )
+
+        next_frontier = []
+        for datalab in datalabs:
+            datalab_id = str(datalab.id)
+            sources = {
+                str(step.datasource.id)
+                for step in datalab.steps
+                if step.type == "datasource"
+            }
+
+            for parent in sources.intersection(frontier):
+                if parent == str(source_id) and is_affected and not is_affected(datalab):
+                    continue
+                parents[datalab_id].add(parent)
+
+            if datalab_id in parents and datalab_id not in visited:
+                visited.add(datalab_id)
+                next_frontier.append(datalab_id)
+
+        # Only the first level needs to be checked against the predicate
+        is_affected = None
+        frontier = next_frontier
+
+    return parents
+
+
+def plan_refresh(parents):
+    """
+    Topologically orders the DataLabs of a dependency graph into levels, such
+    that each DataLab is refreshed exactly once, after all of its changed
+    sources. DataLabs within the same level are independent of each other.
+    """
+    remaining = {
+        datalab_id: {parent for parent in datalab_parents if parent in parents}
+        for datalab_id, datalab_parents in parents.items()
+    }
+
+    levels = []
+    while remaining:
+        level = sorted(
+            datalab_id for datalab_id, pending in remaining.items() if not pending
+        )
+        if not level:
+            # DataLabs which depend on each other, refresh them in a single pass
+            logger.warning(
+                "datalab.cyclic_dependency", extra={"datalabs": sorted(remaining)}
+            )
+            level = sorted(remaining)
+
+        levels.append(level)
+        for datalab_id in level:
+            remaining.pop(datalab_id)
+        for pending in remaining.values():
+            pending.difference_update(level)
+
+    return levels
+
+
+def refresh_datalab(datalab_id, patch=None):
+    """
+    Rebuild the relations table of a DataLab and the access lists of the
+    DataLab and its forms
+
+    Arguments:
+        patch -- Optional dict of the arguments to patch_relations, which is
+            attempted before falling back to rebuilding the relations
+    """
+    datalab = Datalab.objects.get(id=datalab_id)
+
+    relations = None
+    if patch is not None:
+        relations = patch_relations(
+            datalab.steps,
+            datalab.relations,
+            datalab_id=datalab.id,
+            permission=datalab.permission,
+            **patch,
+        )
 
-    return relations.to_dict("records")
+    datalab.relations = (
+        relations
+        if relations is not None
+        else get_relations(datalab.steps, datalab.id, permission=datalab.permission)
+    )
+    datalab.save()
+    datalab.refresh_access()
+
+    # Update the permissions values of any forms that use this datalab
+    for form in Form.objects.filter(datalab=datalab):
+        form.refresh_access()
+
+
+def refresh_dependents(source_id, is_affected=None, patch=None):
+    """
+    Refresh every DataLab downstream of a datasource or DataLab, at any depth,
+    running the independent DataLabs of each level in parallel
+
+    Arguments:
+        patch -- Optional arguments to patch_relations, used for the DataLabs
+            whose only changed source is source_id itself
+    """
+    parents = get_dependency_graph(source_id, is_affected)
+    levels = plan_refresh(parents)
+
+    def refresh(datalab_id):
+        can_patch = patch is not None and parents[datalab_id] == {str(source_id)}
+        refresh_datalab(datalab_id, patch if can_patch else None)
+
+    with ThreadPoolExecutor(max_workers=DATALAB_REFRESH_WORKERS) as executor:
+        for level in levels:
+            # Consume the results so that any exception is raised
+            list(executor.map(refresh, level))
+
+    return levels
@@ -24,9 +24,12 @@ from .serializers import (
     FilteredDatalabSerializer
 )
 from .permissions import DatalabPermissions
-from .models import Datalab
-from .utils import bind_column_types, get_relations
+from .models import Datalab, DatalabCache
+from .profiler import explain, stage
+from .resolver import source_scope
+from .utils import bind_column_types, get_relations, refresh_dependents
 
+from accounts.models import lti
 from container.models import Container
 from datasource.models import Datasource
 from form.models import Form
@@ -145,6 +148,9 @@ class DatalabViewSet(viewsets.ModelViewSet):
         datalab = serializer.save(steps=steps, order=order, relations=relations)
         datalab.refresh_access()
 
+        # DataLabs which use this DataLab as a source must also be refreshed
+        refresh_dependents(datalab.id)
+
         logger.info(
             "datalab.update",
             extra={"user": self.request.user.email, "payload": self.request.data},
@@ -172,24 +178,23 @@ class DatalabViewSet(viewsets.ModelViewSet):
 
         steps = request.data.get("partial", [])
 
-        # Use all steps to calculate the required_fields, but skip the last step
-        # when actually constructing the relations table. This is only done when
-        # checking for discrepencies, as we want to compare the joined table
-        # against this step's primary key.
-        data = get_relations(steps, datalab_id=datalab_id, skip_last=True)
+        with source_scope() as resolver:
+            # Use all steps to calculate the required_fields, but skip the last step
+            # when actually constructing the relations table. This is only done when
+            # checking for discrepencies, as we want to compare the joined table
+            # against this step's primary key.
+            data = get_relations(steps, datalab_id=datalab_id, skip_last=True)
 
-        check_module = steps[-1]["datasource"]
-        try:
-            datasource = Datasource.objects.get(id=check_module["id"])
-        except:
-            pass
+            check_module = steps[-1]["datasource"]
+            datasource = resolver.get_source(check_module)
 
-        try:
-            datasource = Datalab.objects.get(id=check_module["id"])
-        except:
-            pass
+            primary_data = datasource.load_data(fields=[check_module["primary"]])[
+                check_module["primary"]
+            ]
 
-        primary_records = {item[check_module["primary"]] for item in datasource.data}
+        primary_records = set(
+            primary_data.astype(object).where(primary_data.notna(), None)
+        )
         matching_records = {
             item[check_module["matching"]]
             for item in data
@@ -247,6 +252,31 @@ class DatalabViewSet(viewsets.ModelViewSet):
                 }
             )
 
+    @detail_route(methods=["get"])
+    def explain(self, request, id=None):
+        datalab = self.get_object()
+        self.check_object_permissions(self.request, datalab)
+
+        fingerprint = datalab.fingerprint()
+        cached = DatalabCache.objects(datalab=datalab.id, fingerprint=fingerprint)
+
+        # Profile a complete rebuild which bypasses the materialized table,
+        # without storing any of the results
+        with explain("datalab.explain", datalab=str(datalab.id)) as current:
+            get_relations(
+                datalab.to_mongo()["steps"],
+                datalab_id=datalab.id,
+                permission=datalab.permission,
+            )
+
+            with stage("datalab.build"):
+                data = datalab.build_data()
+
+            datalab._materialized = (fingerprint, data)
+            datalab.filter_details({})
+
+        return JsonResponse({"cached": bool(cached.only("id").first()), **current.as_dict()})
+
     @detail_route(methods=["patch"])
     def change_column_order(self, request, id=None):
         datalab = self.get_object()
@@ -443,24 +473,21 @@ def AccessDataLab(request, id):
         except:
             pass
 
-    data = pd.DataFrame(data=datalab.data)
-    accessible_records = data[data[datalab.permission].str.lower().isin(user_values)]
+    # Only the rows of the user are fetched, rather than the whole DataLab
+    accessible_records = datalab.accessible_data(datalab.permission, user_values)
 
     if not len(accessible_records):
         # User does not have access to any records, so return a 403
         raise PermissionDenied()
 
-    if datalab.restriction == "private":
-        data = accessible_records
+    data = accessible_records if datalab.restriction == "private" else datalab.data
 
     default_group = (
-        accessible_records[datalab.groupBy].iloc[0] if datalab.groupBy else None
+        accessible_records[0].get(datalab.groupBy) if datalab.groupBy else None
     )
 
-    data.replace({pd.np.nan: None}, inplace=True)
     serializer = RestrictedDatalabSerializer(
-        datalab,
-        context={"data": data.to_dict("records"), "default_group": default_group},
+        datalab, context={"data": data, "default_group": default_group}
     )
 
     logger.info(
@@ -11,8 +11,10 @@ from mongoengine.fields import (
 )
 from datetime import datetime as dt
 import pandas as pd
+import bson
 
 from container.models import Container
+from ontask.settings import DATASOURCE_CHUNK_CELLS, DATASOURCE_CHUNK_BYTES
 
 from .utils import (
     retrieve_csv_data,
@@ -63,19 +65,151 @@ class Schedule(EmbeddedDocument):
     task_name = StringField()  # The name of the celery task
 
 
+def chunk_bounds(data, fields):
+    """
+    Start and end of the rows stored in each chunk of a datasource
+
+    A chunk holds at most DATASOURCE_CHUNK_CELLS cells, and is closed early if
+    its encoded size would exceed DATASOURCE_CHUNK_BYTES, so that wide or long
+    text values never push a chunk over the document size limit of MongoDB
+    """
+    max_rows = max(1, DATASOURCE_CHUNK_CELLS // max(1, len(fields)))
+    # Each value in a column array is also stored with its type and index
+    cell_overhead = 2 + len(str(max_rows))
+
+    start = 0
+    size = 0
+    for position, row in enumerate(data):
+        row_size = len(bson.BSON.encode(row)) + cell_overhead * len(fields)
+        if position > start and (
+            position - start >= max_rows or size + row_size > DATASOURCE_CHUNK_BYTES
+        ):
+            yield start, position
+            start = position
+            size = 0
+        size += row_size
+
+    if start < len(data):
+        yield start, len(data)
+
+
 class Datasource(Document):
     # Owner of the datasource can be determined from container.owner
     # Cascade delete if container is deleted
     container = ReferenceField(Container, required=True, reverse_delete_rule=2)
     name = StringField(required=True)
     connection = EmbeddedDocumentField(Connection)
-    data = ListField(DictField())
+    # Rows are stored in column-oriented chunks (see DatasourceChunk)
+    # Datasources created before chunked storage keep their rows inline
+    inline_data = ListField(DictField(), db_field="data")
+    # Generation of the chunks holding the current data, 0 if stored inline
+    generation = IntField(default=0)
     schedule = EmbeddedDocumentField(Schedule, null=True)
     # Last time the data was updated
     lastUpdated = DateTimeField(default=dt.utcnow)
     fields = ListField(StringField())
     types = DictField()
 
+    @property
+    def data(self):
+        """Rows of the datasource as a list of dicts"""
+        if getattr(self, "_records", None) is None:
+            if self.generation:
+                data = self.load_data()
+                self._records = data.astype(object).where(data.notna(), None).to_dict(
+                    "records"
+                )
+            else:
+                self._records = self._load_inline_data()
+
+        return self._records
+
+    def _load_inline_data(self, fields=None):
+        """
+        Rows stored on the document itself, by datasources that predate chunked storage
+
+        These are read from the collection rather than the document, as the field
+        is excluded when datasources are resolved in bulk
+        """
+        if self.id is None:
+            return list(self.inline_data)
+
+        projection = {f"data.{field}": 1 for field in fields} if fields else {"data": 1}
+        document = Datasource._get_collection().find_one({"_id": self.id}, projection)
+        return (document or {}).get("data", [])
+
+    def load_data(self, fields=None):
+        """
+        Rows of the datasource as a DataFrame, built directly from the column chunks
+
+        If fields are provided, then only those columns are read from storage
+        """
+        if fields is not None:
+            fields = [field for field in self.fields if field in set(fields)]
+        else:
+            fields = list(self.fields)
+
+        if not self.generation:
+            return pd.DataFrame(data=self._load_inline_data(fields)).filter(items=fields)
+
+        chunks = (
+            DatasourceChunk._get_collection()
+            .find(
+                {"datasource": self.id, "generation": self.generation},
+                {f"columns.{field}": 1 for field in fields} if fields else {"index": 1},
+            )
+            .sort("index", 1)
+        )
+        data = [
+            pd.DataFrame(chunk.get("columns", {}), columns=fields) for chunk in chunks
+        ]
+        if not len(data):
+            return pd.DataFrame(columns=fields)
+
+        return pd.concat(data, ignore_index=True)
+
+    def store_data(self, data):
+        """
+        Write the rows of the datasource as a new generation of column chunks
+
+        The new generation only becomes visible once every chunk has been
+        written, after which the chunks of the previous generation are removed
+        """
+        fields = list(data[0].keys()) if len(data) else list(self.fields)
+        generation = self.generation + 1
+
+        chunks = [
+            {
+                "datasource": self.id,
+                "generation": generation,
+                "index": chunk_index,
+                "columns": {
+                    field: [row.get(field) for row in data[start:end]]
+                    for field in fields
+                },
+            }
+            for chunk_index, (start, end) in enumerate(chunk_bounds(data, fields))
+        ]
+
+        collection = DatasourceChunk._get_collection()
+        if len(chunks):
+            collection.insert_many(chunks)
+
+        # The generation and lastUpdated are switched in a single write, so that
+        # DataLabs never cache the previous chunks under the new version
+        last_updated = dt.utcnow()
+        self.update(
+            set__generation=generation,
+            set__inline_data=[],
+            set__lastUpdated=last_updated,
+        )
+        self.generation = generation
+        self.inline_data = []
+        self.lastUpdated = last_updated
+        self._records = data
+
+        collection.delete_many({"datasource": self.id, "generation": {"$lt": generation}})
+
     def retrieve_data(self, connection=None, file=None):
         if not connection:
             connection = self.connection
@@ -107,45 +241,54 @@ class Datasource(Document):
             "sqlite",
             "mssql",
         ]:
-            self.data = self.retrieve_data()
-            self.fields = [field for field in self.data[0]]
-            self.lastUpdated = dt.utcnow()
+            previous_data = self.data
 
+            data = self.retrieve_data()
+            self.fields = [field for field in data[0]]
+
+            # lastUpdated is set along with the new generation by store_data
             self.save()
-            self.update_associated_datalabs()
+            self.store_data(data)
+            self.update_associated_datalabs(previous_data)
+
+    def update_associated_datalabs(self, previous_data=None):
+        """
+        Update the relations table of any datalabs downstream of this datasource
 
-    def update_associated_datalabs(self):
-        from datalab.models import Datalab
-        from datalab.utils import get_relations
-        from form.models import Form
+        If the previous version of the data is provided, then the relations are
+        patched in place where possible rather than being rebuilt from scratch
+        """
+        from datalab.utils import refresh_dependents
 
-        # Find any datalabs that use this datasource and update their relations table
-        # But only if any of the datasource's fields actually appears in the relations table
-        for datalab in Datalab.objects.filter(steps__datasource__id=str(self.id)):
+        # Only refresh the datalabs that use this datasource if any of the
+        # datasource's fields actually appears in their relations table
+        def is_affected(datalab):
             relations = pd.DataFrame(datalab.relations)
-            if any([field in relations for field in self.fields]):
-                datalab.relations = get_relations(
-                    datalab.steps, datalab.id, permission=datalab.permission
-                )
-                datalab.save()
-                datalab.refresh_access()
-
-                # Find any other datalabs that use this datalab and update their relations table
-                for other_datalab in Datalab.objects.filter(
-                    steps__datasource__id=str(datalab.id)
-                ):
-                    other_datalab.relations = get_relations(
-                        other_datalab.steps,
-                        other_datalab.id,
-                        permission=other_datalab.permission,
-                    )
-                    other_datalab.save()
-                    other_datalab.refresh_access()
-
-                    # Find any forms that use the other datalab and update their permissions values
-                    for form in Form.objects.filter(datalab=other_datalab):
-                        form.refresh_access()
-
-                # Find any forms that use this datalab and update their permissions values
-                for form in Form.objects.filter(datalab=datalab):
-                    form.refresh_access()
+            return any([field in relations for field in self.fields])
+
+        patch = None
+        if previous_data is not None:
+            patch = {
+                "source_id": self.id,
+                "previous_data": previous_data,
+                "current_data": self.data,
+            }
+
+        refresh_dependents(self.id, is_affected=is_affected, patch=patch)
+
+
+class DatasourceChunk(Document):
+    """
+    Consecutive rows of a datasource, stored column-wise as a mapping of field
+    name to the list of values of that field. Column names are therefore only
+    stored once per chunk, and a datasource is not bound by the document size
+    limit.
+    """
+
+    # Cascade delete if datasource is deleted
+    datasource = ReferenceField(Datasource, required=True, reverse_delete_rule=2)
+    generation = IntField(required=True)
+    index = IntField(required=True)
+    columns = DictField()
+
+    meta = {"indexes": [("datasource", "generation", "index")]}
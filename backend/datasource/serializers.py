@@ -1,9 +1,16 @@
-from rest_framework_mongoengine import serializers
+from rest_framework import serializers
+from rest_framework_mongoengine.serializers import DocumentSerializer
 
 from .models import Datasource
 
 
-class DatasourceSerializer(serializers.DocumentSerializer):
+class DatasourceSerializer(DocumentSerializer):
+    # The rows are read from the column chunks (or inline for older datasources)
+    data = serializers.SerializerMethodField()
+
+    def get_data(self, datasource):
+        return datasource.data
+
     class Meta:
         model = Datasource
-        fields = '__all__'
+        exclude = ['inline_data']
@@ -0,0 +1,330 @@
+"""
+Import of form data from a CSV
+
+The CSV is read a chunk of rows at a time. Each cell is validated against the
+field of its column, and the valid rows of a chunk are written to the form in
+place: existing records only have the imported columns set, and new records are
+appended. Only the primary keys of the form and of its DataLab are held in
+memory, rather than several copies of the whole dataset.
+
+An import is not atomic: the chunks written before a failure are kept. The
+error of a failed import reports the rows of the CSV which were imported
+before it, so that the remaining rows can be imported again.
+"""
+from rest_framework.exceptions import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from datetime import datetime as dt
+import pandas as pd
+import numpy as np
+import ast
+import logging
+
+from .models import Form
+
+from ontask.settings import FORM_IMPORT_CHUNK_ROWS, FORM_IMPORT_MAX_ERRORS
+
+logger = logging.getLogger("ontask")
+
+TRUE_VALUES = {"true", "1", "yes", "y"}
+FALSE_VALUES = {"false", "0", "no", "n"}
+
+# Number of times that the new records of a chunk are appended again, if other
+# edits added some of the same records in the meantime
+MAX_PUSH_ATTEMPTS = 3
+
+
+class InvalidCell(Exception):
+    """A cell which doesn't satisfy its field"""
+
+
+def parse_boolean(value):
+    if value.lower() in TRUE_VALUES:
+        return True
+    if value.lower() in FALSE_VALUES:
+        return False
+    raise InvalidCell(f'"{value}" is not true or false')
+
+
+def parse_number(field, value):
+    try:
+        number = float(value)
+    except ValueError:
+        raise InvalidCell(f'"{value}" is not a number')
+    if not np.isfinite(number):
+        raise InvalidCell(f'"{value}" is not a number')
+
+    if field.minimum is not None and number < field.minimum:
+        raise InvalidCell(f"{value} is less than the minimum of {field.minimum}")
+    if field.maximum is not None and number > field.maximum:
+        raise InvalidCell(f"{value} is greater than the maximum of {field.maximum}")
+
+    return int(number) if number.is_integer() else number
+
+
+def parse_date(value):
+    try:
+        date = pd.Timestamp(value)
+    except (TypeError, ValueError, OverflowError):
+        raise InvalidCell(f'"{value}" is not a date')
+    if date is pd.NaT:
+        raise InvalidCell(f'"{value}" is not a date')
+
+    # Stored the same way as the dates entered in the form
+    if date.tzinfo is not None:
+        date = date.tz_convert("UTC").tz_localize(None)
+    return date.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_list(field, value):
+    options = [option.value for option in field.options]
+
+    if field.multiSelect:
+        # Lists are exported either as Python lists or comma separated values
+        if value.startswith("["):
+            try:
+                values = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                raise InvalidCell(f'"{value}" is not a list')
+            if not isinstance(values, list):
+                raise InvalidCell(f'"{value}" is not a list')
+            values = [str(item) for item in values]
+        else:
+            values = [item.strip() for item in value.split(",") if item.strip()]
+    else:
+        values = [value]
+
+    invalid = [item for item in values if item not in options]
+    if invalid:
+        raise InvalidCell(f'"{invalid[0]}" is not one of the options of the field')
+
+    return values if field.multiSelect else values[0]
+
+
+def parse_cell(field, value):
+    """Value of a cell as stored in the form, or None if the cell is empty"""
+    if value is None or value.strip() == "":
+        return None
+    value = value.strip()
+
+    if field.type == "number":
+        return parse_number(field, value)
+    elif field.type == "date":
+        return parse_date(value)
+    elif field.type in ["checkbox", "checkbox-group"]:
+        return parse_boolean(value)
+    elif field.type == "list":
+        return parse_list(field, value)
+
+    if field.maxLength and len(value) > field.maxLength:
+        raise InvalidCell(f"Longer than the maximum of {field.maxLength} characters")
+    return value
+
+
+def import_columns(form, header):
+    """
+    Field of each column of the CSV (after the primary key) which is imported,
+    and the columns which aren't fields of the form
+    """
+    columns = {}
+    for field in form.fields:
+        if field.type == "checkbox-group":
+            for column in field.columns:
+                columns[f"{field.name}__{column}"] = field
+        else:
+            columns[field.name] = field
+
+    imported = {column: columns[column] for column in header if column in columns}
+    ignored = [column for column in header if column not in columns]
+    return imported, ignored
+
+
+def record_positions(form):
+    """Position of each record of the form data, by primary key"""
+    document = Form._get_collection().find_one(
+        {"_id": form.id}, {f"data.{form.primary}": True}
+    )
+    return {
+        record.get(form.primary): position
+        for position, record in enumerate(document.get("data", []))
+        if form.primary in record
+    }
+
+
+def write_records(form, records):
+    """
+    Set the imported values of the existing records, and append the new
+    records, in a single bulk write
+    """
+    collection = Form._get_collection()
+
+    for attempt in range(MAX_PUSH_ATTEMPTS):
+        positions = record_positions(form)
+        last_updated = dt.utcnow()
+
+        updates = {
+            f"data.{positions[primary]}.{column}": value
+            for primary, values in records.items()
+            if primary in positions
+            for column, value in values.items()
+        }
+        new_records = [
+            {form.primary: primary, **values}
+            for primary, values in records.items()
+            if primary not in positions
+        ]
+
+        requests = [
+            UpdateOne(
+                {"_id": form.id},
+                {"$set": {**updates, "lastUpdated": last_updated}},
+            )
+        ]
+        if new_records:
+            # The records are only appended if they still don't exist
+            requests.append(
+                UpdateOne(
+                    {
+                        "_id": form.id,
+                        f"data.{form.primary}": {
+                            "$nin": [record[form.primary] for record in new_records]
+                        },
+                    },
+                    {"$push": {"data": {"$each": new_records}}},
+                )
+            )
+
+        result = collection.bulk_write(requests, ordered=True)
+        if not new_records or result.matched_count == len(requests):
+            return {"created": len(new_records), "updated": len(records) - len(new_records)}
+
+    raise ValidationError("The form data changed during the import, please try again")
+
+
+def interrupted_import(form, error, result, committed_rows):
+    """
+    Raise the error of an import which failed part way through, reporting the
+    rows which were imported before the failure
+    """
+    if isinstance(error, ValidationError):
+        message = " ".join(str(detail) for detail in error.detail).rstrip(".") + "."
+    else:
+        logger.warning(
+            "form.import_failed", extra={"id": str(form.id), "error": str(error)}
+        )
+        message = "The form data could not be saved."
+
+    raise ValidationError(
+        {
+            "detail": (
+                f"{message} The first {committed_rows} rows of the file were "
+                f"processed ({result['created']} records added, "
+                f"{result['updated']} records updated), and the existing "
+                "records of the rows after them may also have been updated."
+            ),
+            "committedRows": committed_rows,
+            "created": result["created"],
+            "updated": result["updated"],
+        }
+    )
+
+
+def read_chunks(file):
+    """Chunks of the rows of a CSV, with every cell read as a string"""
+    try:
+        yield from pd.read_csv(
+            file,
+            dtype=str,
+            keep_default_na=False,
+            skip_blank_lines=True,
+            chunksize=FORM_IMPORT_CHUNK_ROWS,
+        )
+    except pd.errors.EmptyDataError:
+        raise ValidationError("The file is empty")
+    except pd.errors.ParserError as error:
+        raise ValidationError(f"The file could not be read as a CSV: {error}")
+
+
+def import_data(form, file):
+    """
+    Import the rows of a CSV into the data of a form, where the first column of
+    the CSV is the primary key of the form
+
+    Returns the number of records created and updated, the columns which were
+    ignored, and the invalid cells by row number (the rows of which are not
+    imported). If writing a chunk fails, then a ValidationError reports the
+    number of rows which were already imported
+    """
+    # The primary keys of the DataLab are matched as strings, since every cell
+    # of the CSV is read as a string
+    keys = {}
+    primaries = form.datalab.load_data(fields=[form.primary]).get(
+        form.primary, pd.Series(dtype=object)
+    )
+    for key in primaries.dropna().tolist():
+        keys[str(key)] = key
+        if isinstance(key, float) and key.is_integer():
+            # Integers are read as floats if some records don't have a key
+            keys.setdefault(str(int(key)), key)
+
+    result = {"created": 0, "updated": 0, "ignoredColumns": [], "errors": []}
+    error_count = 0
+
+    row = 0
+    # Rows of the CSV up to which every chunk has been written
+    committed_rows = 0
+    columns = None
+    for chunk in read_chunks(file):
+        if columns is None:
+            primary_column = chunk.columns[0]
+            columns, result["ignoredColumns"] = import_columns(
+                form, list(chunk.columns[1:])
+            )
+
+        records = {}
+        for values in chunk.to_dict("records"):
+            row += 1
+            primary = keys.get(values[primary_column].strip())
+
+            errors = []
+            if primary is None:
+                errors.append(
+                    {
+                        "field": primary_column,
+                        "message": f'"{values[primary_column]}" is not a record of the DataLab',
+                    }
+                )
+
+            record = {}
+            for column, field in columns.items():
+                try:
+                    record[column] = parse_cell(field, values[column])
+                except InvalidCell as error:
+                    errors.append({"field": column, "message": str(error)})
+
+            if errors:
+                error_count += len(errors)
+                remaining = FORM_IMPORT_MAX_ERRORS - len(result["errors"])
+                result["errors"].extend(
+                    [
+                        {"row": row, "primary": values[primary_column], **error}
+                        for error in errors[:remaining]
+                    ]
+                )
+                continue
+
+            # Later rows of the same record take precedence
+            records.setdefault(primary, {}).update(record)
+
+        if records:
+            try:
+                written = write_records(form, records)
+            except (ValidationError, PyMongoError) as error:
+                interrupted_import(form, error, result, committed_rows)
+            result["created"] += written["created"]
+            result["updated"] += written["updated"]
+
+        committed_rows = row
+
+    result["errorCount"] = error_count
+    return result
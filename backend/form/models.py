@@ -12,7 +12,7 @@ from mongoengine.fields import (
 )
 
 from container.models import Container
-from datalab.models import Datalab
+from datalab.models import Datalab, access_value
 
 
 class Option(EmbeddedDocument):
@@ -62,11 +62,16 @@ class Form(Document):
     data = ListField(DictField())
     permitted_users = ListField(StringField())
     restriction = StringField(choices=("private", "limited", "open"), default="private")
+    # Last time the data or design of the form was updated
+    # Deliberately without a default, so that forms created before this field
+    # existed keep a stable value until their next edit
+    lastUpdated = DateTimeField(null=True)
 
     # Flat representation of which users should see this form when they load the dashboard
     def refresh_access(self):
         users = set(
-            record.get(self.permission, "").lower() for record in self.datalab.relations
+            access_value(record.get(self.permission))
+            for record in self.datalab.relations
         )
         for invalid_value in [None, ""]:
             if invalid_value in users:
@@ -0,0 +1,215 @@
+from io import StringIO
+
+from pymongo.errors import PyMongoError
+from rest_framework.exceptions import ValidationError
+import pytest
+
+from form import importer
+from form.importer import InvalidCell, import_data, parse_cell
+from form.models import Field, Form, Option
+
+FIELDS = {
+    "mark": Field(name="mark", type="number", minimum=0, maximum=100),
+    "done": Field(name="done", type="checkbox"),
+    "due": Field(name="due", type="date"),
+    "grade": Field(
+        name="grade",
+        type="list",
+        options=[Option(label=value, value=value) for value in ["A", "B"]],
+    ),
+    "tags": Field(
+        name="tags",
+        type="list",
+        multiSelect=True,
+        options=[Option(label=value, value=value) for value in ["x", "y"]],
+    ),
+    "comment": Field(name="comment", type="text", maxLength=5),
+    "attendance": Field(name="attendance", type="checkbox-group", columns=["w1"]),
+}
+
+
+@pytest.fixture
+def form(container, make_datalab):
+    datalab = make_datalab([{"zid": f"z{i}"} for i in range(1, 5)])
+    return Form(
+        container=container,
+        datalab=datalab,
+        name="Feedback",
+        primary="zid",
+        fields=list(FIELDS.values()),
+        data=[{"zid": "z1", "mark": 10, "comment": "old"}],
+    ).save()
+
+
+def csv(*rows):
+    return StringIO("".join(f"{row}\n" for row in rows))
+
+
+def form_data(form):
+    return Form.objects.get(id=form.id).data
+
+
+@pytest.mark.parametrize(
+    "field,value,expected",
+    [
+        ("mark", " 80 ", 80),
+        ("mark", "12.5", 12.5),
+        ("mark", "", None),
+        ("done", "Yes", True),
+        ("done", "0", False),
+        ("due", "2020-03-02", "2020-03-02T00:00:00Z"),
+        ("due", "2020-03-02T10:00:00+10:00", "2020-03-02T00:00:00Z"),
+        ("grade", "B", "B"),
+        ("tags", "x, y", ["x", "y"]),
+        ("tags", "['y']", ["y"]),
+        ("comment", "short", "short"),
+        ("attendance", "true", True),
+    ],
+)
+def test_parse_cell(field, value, expected):
+    assert parse_cell(FIELDS[field], value) == expected
+
+
+@pytest.mark.parametrize(
+    "field,value",
+    [
+        ("mark", "abc"),
+        ("mark", "nan"),
+        ("mark", "-1"),
+        ("mark", "101"),
+        ("done", "maybe"),
+        ("due", "soon"),
+        ("grade", "C"),
+        ("tags", "x, z"),
+        ("tags", "[x"),
+        ("comment", "too long"),
+    ],
+)
+def test_parse_invalid_cell(field, value):
+    with pytest.raises(InvalidCell):
+        parse_cell(FIELDS[field], value)
+
+
+def test_import_data(form):
+    result = import_data(
+        form,
+        csv(
+            "zid,mark,done,attendance__w1,unknown",
+            "z1,80,yes,true,a",
+            "z2,,no,,b",
+            "z9,5,,,c",
+            "z3,abc,true,,d",
+        ),
+    )
+
+    assert result == {
+        "created": 1,
+        "updated": 1,
+        "ignoredColumns": ["unknown"],
+        "errors": [
+            {
+                "row": 3,
+                "primary": "z9",
+                "field": "zid",
+                "message": '"z9" is not a record of the DataLab',
+            },
+            {
+                "row": 4,
+                "primary": "z3",
+                "field": "mark",
+                "message": '"abc" is not a number',
+            },
+        ],
+        "errorCount": 2,
+    }
+    # Only the imported columns of existing records are set
+    assert form_data(form) == [
+        {
+            "zid": "z1",
+            "mark": 80,
+            "comment": "old",
+            "done": True,
+            "attendance__w1": True,
+        },
+        {"zid": "z2", "mark": None, "done": False, "attendance__w1": None},
+    ]
+
+
+def test_later_rows_take_precedence(form):
+    result = import_data(form, csv("zid,mark", "z2,1", "z2,2"))
+
+    assert (result["created"], result["updated"]) == (1, 0)
+    assert form_data(form)[1] == {"zid": "z2", "mark": 2}
+
+
+def test_number_primary_keys(container, make_datalab):
+    datalab = make_datalab([{"zid": 1}, {"zid": 2}, {"zid": None}])
+    form = Form(
+        container=container,
+        datalab=datalab,
+        name="Feedback",
+        primary="zid",
+        fields=[FIELDS["mark"]],
+    ).save()
+
+    result = import_data(form, csv("zid,mark", "1,80", "3,20"))
+
+    assert result["created"] == 1
+    assert [error["primary"] for error in result["errors"]] == ["3"]
+    assert form_data(form) == [{"zid": 1.0, "mark": 80}]
+
+
+def test_errors_are_capped(form, monkeypatch):
+    monkeypatch.setattr(importer, "FORM_IMPORT_MAX_ERRORS", 1)
+
+    result = import_data(form, csv("zid,mark", "z1,abc", "z2,-1"))
+
+    assert len(result["errors"]) == 1
+    assert result["errorCount"] == 2
+
+
+def test_empty_file(form):
+    with pytest.raises(ValidationError, match="The file is empty"):
+        import_data(form, csv())
+
+
+def test_file_without_rows(form):
+    result = import_data(form, csv("zid,mark"))
+
+    assert (result["created"], result["updated"], result["errors"]) == (0, 0, [])
+    assert form_data(form) == [{"zid": "z1", "mark": 10, "comment": "old"}]
+
+
+@pytest.mark.parametrize(
+    "error,message",
+    [
+        (PyMongoError("Connection lost"), "The form data could not be saved."),
+        (ValidationError("The form data changed"), "The form data changed."),
+    ],
+)
+def test_interrupted_import(form, monkeypatch, error, message):
+    monkeypatch.setattr(importer, "FORM_IMPORT_CHUNK_ROWS", 2)
+    write_records = importer.write_records
+
+    def fail_second_chunk(form, records):
+        if "z3" in records:
+            raise error
+        return write_records(form, records)
+
+    monkeypatch.setattr(importer, "write_records", fail_second_chunk)
+
+    with pytest.raises(ValidationError) as raised:
+        import_data(form, csv("zid,mark", "z1,80", "z2,20", "z3,30", "z4,40"))
+
+    detail = raised.value.detail
+    assert detail["detail"].startswith(f"{message} The first 2 rows")
+    assert [str(detail[key]) for key in ["committedRows", "created", "updated"]] == [
+        "2",
+        "1",
+        "1",
+    ]
+    # The first chunk is kept
+    assert form_data(form) == [
+        {"zid": "z1", "mark": 80, "comment": "old"},
+        {"zid": "z2", "mark": 20},
+    ]
@@ -0,0 +1,158 @@
+import pytest
+
+from form.utils import get_filtered_data
+
+FIELDS = ["zid", "mark", "grade", "ok", "when", "tags", "topics__a", "topics__b"]
+
+DATA = [
+    dict(zip(FIELDS, row))
+    for row in [
+        ("z1", 80, "HD", True, "2020-01-02", ["a", "b"], True, False),
+        ("z2", None, "CR", False, None, None, True, True),
+        ("z3", "7", None, None, "2020-01-01T10:00:00", ["b"], None, True),
+        ("z4", "", "", True, "nope", [], False, False),
+        ("z5", 3.5, "HD", False, "2020-01-03", ["a"], True, None),
+    ]
+]
+
+COLUMNS = [
+    {"details": {"label": "zid", "field_type": "text"}},
+    {"details": {"label": "mark", "field_type": "number"}},
+    {"details": {"label": "grade", "field_type": "text"}},
+    {"details": {"label": "ok", "field_type": "checkbox"}},
+    {"details": {"label": "when", "field_type": "date"}},
+    {"details": {"label": "tags", "field_type": "list"}},
+    {
+        "details": {
+            "label": "topics",
+            "field_type": "checkbox-group",
+            "fields": ["a", "b"],
+        }
+    },
+]
+
+PAGE = {"current": 1, "pageSize": 10}
+
+# Table filters as sent by the frontend, along with the zids of the rows on
+# the page and the total number of rows, as returned by the baseline (which
+# filtered the table one row at a time)
+CASES = {
+    "no_filters": ({}, None, ["z1", "z2", "z3", "z4", "z5"], 5),
+    "text": ({"filters": {"grade": ["HD"]}}, None, ["z1", "z5"], 2),
+    "number": ({"filters": {"mark": [7, "80"]}}, None, ["z1", "z3"], 2),
+    "checkbox": ({"filters": {"ok": [False]}}, None, ["z2", "z5"], 2),
+    "date": (
+        {"filters": {"when": ["2020-01-01", "2020-01-03"]}},
+        None,
+        ["z3", "z5"],
+        2,
+    ),
+    "list": ({"filters": {"tags": ["a"]}}, None, ["z1", "z5"], 2),
+    "checkbox_group_or": (
+        {"checkboxFilters": {"topics": ["a", "b"]}},
+        None,
+        ["z1", "z2", "z3", "z5"],
+        4,
+    ),
+    "checkbox_group_and": (
+        {
+            "checkboxFilters": {"topics": ["a", "b"]},
+            "checkboxFilterModes": {"topics": True},
+        },
+        None,
+        ["z2"],
+        1,
+    ),
+    "search": ({"search": "HD"}, None, ["z1", "z5"], 2),
+    "grouping": ({"grouping": "HD"}, "grade", ["z1", "z5"], 2),
+    "sort_number_ascend": (
+        {"sorter": {"field": "mark", "order": "ascend"}},
+        None,
+        ["z2", "z4", "z5", "z3", "z1"],
+        5,
+    ),
+    "sort_number_descend": (
+        {"sorter": {"field": "mark", "order": "descend"}},
+        None,
+        ["z1", "z3", "z5", "z2", "z4"],
+        5,
+    ),
+    "sort_text": (
+        {"sorter": {"field": "grade", "order": "ascend"}},
+        None,
+        ["z3", "z4", "z2", "z1", "z5"],
+        5,
+    ),
+    "sort_date": (
+        {"sorter": {"field": "when", "order": "descend"}},
+        None,
+        ["z5", "z1", "z3", "z2", "z4"],
+        5,
+    ),
+    "sort_checkbox_group": (
+        {"sorter": {"field": "topics", "order": "descend"}},
+        None,
+        ["z2", "z1", "z3", "z5", "z4"],
+        5,
+    ),
+    "page": (
+        {
+            "sorter": {"field": "zid", "order": "descend"},
+            "pagination": {"current": 2, "pageSize": 2},
+        },
+        None,
+        ["z3", "z2"],
+        5,
+    ),
+    "page_past_the_end": (
+        {"pagination": {"current": 9, "pageSize": 2}},
+        None,
+        ["z5"],
+        5,
+    ),
+}
+
+
+def table_filters(**filters):
+    return {
+        "filters": {},
+        "checkboxFilters": {"topics": []},
+        "checkboxFilterModes": {"topics": False},
+        "search": "",
+        "sorter": {},
+        "pagination": PAGE,
+        **filters,
+    }
+
+
+@pytest.mark.parametrize("name", CASES)
+def test_filtered_data(name):
+    filters, group_by, zids, total = CASES[name]
+
+    data, pagination_total = get_filtered_data(
+        DATA, COLUMNS, table_filters(**filters), group_by
+    )
+
+    assert [row["zid"] for row in data] == zids
+    assert pagination_total == total
+
+
+@pytest.mark.parametrize("field_type", ["text", "number", "date", "checkbox-group"])
+def test_sorted_empty_table(field_type):
+    columns = [{"details": {"label": "n", "field_type": field_type, "fields": ["a"]}}]
+    filters = table_filters(sorter={"field": "n", "order": "ascend"})
+
+    assert get_filtered_data([], columns, filters, None) == ([], 0)
+
+
+def test_sort_after_filtering_out_every_row():
+    filters = table_filters(
+        filters={"grade": ["PS"]}, sorter={"field": "mark", "order": "ascend"}
+    )
+
+    assert get_filtered_data(DATA, COLUMNS, filters, None) == ([], 0)
+
+
+def test_missing_filters():
+    assert get_filtered_data(DATA, COLUMNS, None, None) == (DATA, 5)
+    assert get_filtered_data(DATA, COLUMNS, {}, None) == (DATA, 5)
@@ -45,130 +45,205 @@ def get_filtered_data(data, columns, filters, groupby):
     if filters is None: return (data, len(data))
     if len(filters.keys()) == 0: return (data, len(data))
 
-    filtered_data = data.copy()
+    table = TypedTable(data)
+    mask = np.ones(len(data), dtype=bool)
 
     # Group
     if 'grouping' in filters and groupby is not None:
         group_column = next(column for column in columns if column['details']['label'] == groupby)
-        filtered_data = list(filter(lambda row: not remove_row_filter(row, filters, [group_column], mode='group'), filtered_data))
-    # filtered_data = list(filter(lambda row: not remove_row_filter(row, filters, [group]), data))
-    filtered_data = list(filter(lambda row: not remove_row_filter(row, filters, columns, mode='filter'), filtered_data))
+        mask &= column_filter_mask(table, group_column, [filters['grouping']], mode_and=False)
+
+    # Filter
+    for column in columns:
+        column_name = column['details']['label']
+        if column['details']['field_type'] == 'checkbox-group':
+            filter_list = filters.get('checkboxFilters', {}).get(column_name, [])
+            mode_and = filters.get('checkboxFilterModes', {}).get(column_name, False)
+        else:
+            filter_list = filters.get('filters', {}).get(column_name, [])
+            mode_and = False
+
+        if len(filter_list) == 0: continue
+        mask &= column_filter_mask(table, column, filter_list, mode_and)
 
     # Search
-    if filters['search'] != '':
-        filtered_data = list(filter(lambda row: not remove_row_search(row, filters, columns), filtered_data))
+    if filters.get('search', '') != '':
+        mask &= table.search(filters['search'])
 
-    # Sort
-    if not len(filters['sorter']) == 0:
-        sort_field = filters['sorter']['field']
-        sort_order = filters['sorter']['order']
-        if sort_field is not None and sort_order is not None:
-            column = next((item for item in columns if item['details']['label'] == sort_field), None)
-            filtered_data.sort(key=lambda x: sort_column_key(x, sort_field, column), reverse=sort_order=='descend')
+    positions = np.flatnonzero(mask).tolist()
 
-    pagination_total = len(filtered_data)
+    # Sort
+    sorter = filters.get('sorter') or {}
+    if not len(sorter) == 0:
+        sort_field = sorter['field']
+        sort_order = sorter['order']
+        column = next((item for item in columns if item['details']['label'] == sort_field), None)
+        # Rows are only sorted if there are any left after filtering
+        if sort_field is not None and sort_order is not None and column is not None and len(positions) > 0:
+            keys = sort_column_keys(table, sort_field, column)
+            positions.sort(key=keys.__getitem__, reverse=sort_order=='descend')
+
+    pagination_total = len(positions)
 
     # Pagination
-    filtered_data = paginate_data(filtered_data, filters['pagination'])
-    return filtered_data, pagination_total
+    return [data[position] for position in paginate_data(positions, filters['pagination'])], pagination_total
+
 
-def remove_row_filter(row, filters, columns, mode='filter'):
+class TypedTable:
     """
-    Utility function for get_filtered_data.
-    Filtering algorithm.
-    Returns True to remove row; False to keep row of dataset
+    Column-wise view of the rows of a table, which converts each column to the
+    type needed by a filter or sort at most once
     """
-    res = False
-    for item in columns:
-        column_name = item['details']['label']
-        field_type = item['details']['field_type']
-
-        if field_type == 'checkbox-group':
-            if mode == 'filter':
-                mode_and = filters['checkboxFilterModes'][column_name]
-                filter_list = filters['checkboxFilters'][column_name]
-            else:
-                # Occurs in the rare case when a checkbox-group field was selected in groupby
-                mode_and = False
-                filter_list = [filters['grouping']]
-            if len(filter_list) == 0:
-                continue
-            else:
-                # Check if remove row
-                if mode_and:
-                    # AND
-                    if not all(row[f'{column_name}__{item}'] for item in filter_list): return True
-                else:
-                    # OR
-                    if not any(row[f'{column_name}__{item}'] for item in filter_list): return True
-        else:
-            if mode == 'filter':
-                if column_name not in filters['filters']: continue
-                filter_list = filters['filters'][column_name]
-            else:
-                # Handle group-by filtering
-                filter_list = [filters['grouping']]
-
-            if len(filter_list) == 0: continue
-            if field_type == 'list':
-                if row[column_name] is None: return True
-                if not any(item in row[column_name] for item in filter_list): return True
-            elif field_type == 'checkbox':
-                if not any(row[column_name] == item for item in filter_list): return True
-            elif field_type == 'date':
-                # Convert row field and filters to %Y-%m-%d and check for equality
-                try:
-                    row_date = pd.to_datetime(row[column_name], errors='raise')
-                    if row_date is None: return True # Applies to 'None'
-                    row_date = row_date.strftime("%Y-%m-%d")
-                except ValueError as e: # Applies to cells which are not of date format
-                    return True
-                filter_dates = pd.to_datetime(pd.Series(filter_list)).apply(lambda x: x.strftime("%Y-%m-%d"))
-                if not any(row_date == item for item in filter_dates): return True
-            elif field_type == 'number':
-                if row[column_name] is None: return True
-                if row[column_name] == '': return True
-                if not any(float(row[column_name]) == float(item) for item in filter_list): return True
+
+    def __init__(self, data):
+        self.data = data
+        # Keep the values of the rows as they are (e.g. ints are not cast to
+        # floats if a column has missing values)
+        self.frame = pd.DataFrame(data, dtype=object) if len(data) else pd.DataFrame()
+        self.cache = {}
+
+    def typed(self, kind, column_name, convert):
+        if (kind, column_name) not in self.cache:
+            if column_name in self.frame:
+                values = convert(self.frame[column_name])
             else:
-                if not any(str(row[column_name]) == str(item) for item in filter_list): return True
-    return False
+                values = convert(pd.Series([None] * len(self.data), dtype=object))
+            self.cache[(kind, column_name)] = values
+        return self.cache[(kind, column_name)]
 
-def remove_row_search(row, filters, columns):
-    """
-    Utility function for get_filtered_data.
-    Searching algorithm.
-    """
-    return not (filters['search'].lower() in str(row).lower())
+    def values(self, column_name):
+        return self.typed('values', column_name, lambda column: column)
+
+    def truthy(self, column_name):
+        return self.typed('truthy', column_name, lambda column: (column.notna() & column.astype(bool)).values)
+
+    def strings(self, column_name):
+        return self.typed('strings', column_name, lambda column: column.map(str))
+
+    def dates(self, column_name):
+        """Values as %Y-%m-%d strings, or None if they aren't dates"""
+        return self.typed('dates', column_name, to_date_strings)
+
+    def numbers(self, column_name):
+        """Values as floats, or NaN if they aren't numbers"""
+        # Always a float array, including for an empty table (where the mapped
+        # column would otherwise be an object array)
+        return self.typed('numbers', column_name, lambda column: np.asarray(column.map(to_float).values, dtype=float))
+
+    def search(self, term):
+        """Rows whose string representation contains the search term"""
+        # Equivalent to searching str(row) for each row, but built column-wise
+        row = None
+        for column_name in self.frame.columns:
+            cell = repr(column_name) + ': ' + self.frame[column_name].map(repr)
+            row = cell if row is None else row + ', ' + cell
+
+        if row is None:
+            return np.zeros(len(self.data), dtype=bool)
+
+        return ('{' + row + '}').str.lower().str.contains(term.lower(), regex=False).values
+
+
+def is_missing(value):
+    # Rows without a value for a column are filled with NaN by the DataFrame
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def list_contains(value, filter_list):
+    if is_missing(value): return False
+    try:
+        return any(item in value for item in filter_list)
+    except TypeError:
+        return False
 
-def sort_column_key(x, sort_field, column):
+
+def to_float(value):
+    if value is None or value == '':
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def to_date_strings(column):
+    try:
+        dates = pd.to_datetime(column, errors='coerce')
+    except (TypeError, ValueError, OverflowError):
+        # Mixed values (e.g. timezones) are parsed one at a time instead
+        dates = pd.to_datetime(column.map(to_date), errors='coerce')
+
+    return dates.dt.strftime("%Y-%m-%d").where(dates.notna(), None).values
+
+
+def to_date(value):
+    try:
+        date = pd.to_datetime(value, errors='raise')
+        return None if date is None else date.tz_localize(None) if date.tzinfo else date
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def column_filter_mask(table, column, filter_list, mode_and):
     """
-    Utility function for get_filtered_data.
-    Sorting algorithm by column field type.
+    Mask of the rows which pass the filter of a column
+    I.e. the rows which match any of the filter values, or all of them for
+    checkbox-groups in AND mode
     """
+    column_name = column['details']['label']
+    field_type = column['details']['field_type']
+
+    if field_type == 'checkbox-group':
+        masks = [table.truthy(f'{column_name}__{item}') for item in filter_list]
+        return np.logical_and.reduce(masks) if mode_and else np.logical_or.reduce(masks)
+
+    if field_type == 'list':
+        return np.array([
+            list_contains(value, filter_list) for value in table.values(column_name)
+        ], dtype=bool)
+
+    elif field_type == 'checkbox':
+        values = table.values(column_name)
+        return np.logical_or.reduce([
+            (values.isna() if item is None else values == item).values
+            for item in filter_list
+        ])
+
+    elif field_type == 'date':
+        filter_dates = pd.to_datetime(pd.Series(filter_list)).apply(lambda x: x.strftime("%Y-%m-%d"))
+        return np.isin(table.dates(column_name), list(filter_dates))
+
+    elif field_type == 'number':
+        return np.isin(table.numbers(column_name), [float(item) for item in filter_list])
+
+    else:
+        return table.strings(column_name).isin([str(item) for item in filter_list]).values
+
+
+def sort_column_keys(table, sort_field, column):
+    """Sort key of each row, by the field type of the sorted column"""
     if column['details']['field_type'] == 'checkbox-group':
+        # Number of ticked checkboxes
         checkbox_fields = column['details']['fields']
-        return len(list(filter(lambda field: f'{sort_field}__{field}' in x and x[f'{sort_field}__{field}'], checkbox_fields)))
+        counts = np.zeros(len(table.data), dtype=int)
+        for field in checkbox_fields:
+            if f'{sort_field}__{field}' in table.frame:
+                counts += table.truthy(f'{sort_field}__{field}')
+        return counts.tolist()
+
     elif column['details']['field_type'] == 'date':
         # Date Form Field + Standard Date
-        if sort_field not in x: return ''
-        if x[sort_field] is None: return ''
-        try:
-            return pd.to_datetime(x[sort_field], errors='raise').strftime("%Y-%m-%d")
-        except ValueError as e: return ''
+        return ['' if date is None else date for date in table.dates(sort_field)]
+
     elif column['details']['field_type'] == 'number':
-        # Number Form Field + Standard Number
-        if sort_field not in x: return float('-inf')
-        if x[sort_field] is None: return float('-inf') # Missing Values
-        try:
-            return float(x[sort_field])
-        except ValueError as e:
-            # Usually '' values would fall here
-            return float('-inf')
+        # Number Form Field + Standard Number (missing values come first)
+        numbers = table.numbers(sort_field)
+        return np.where(np.isnan(numbers), -np.inf, numbers).tolist()
+
     else:
         # Text Form Field + Standard Text
-        if sort_field not in x: return ''
-        if x[sort_field] is None: return ''
-        return str(x[sort_field])
+        values = table.values(sort_field)
+        return ['' if is_missing(value) else str(value) for value in values]
 
 def paginate_data(data, pagination):
     """Utility function for get_filtered_data"""
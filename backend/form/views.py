@@ -3,7 +3,7 @@ from rest_framework.response import Response
 from rest_framework.status import HTTP_201_CREATED, HTTP_200_OK
 from rest_framework.views import APIView
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 from rest_framework.permissions import AllowAny, IsAdminUser
 
 import pandas as pd
@@ -13,6 +13,7 @@ import csv
 from .serializers import FormSerializer, RestrictedFormSerializer
 from .models import Form
 from .utils import get_filters, get_column_filter, get_filtered_data
+from .importer import import_data
 
 from accounts.models import lti
 from datalab.utils import get_relations
@@ -20,7 +21,7 @@ from datalab.models import Datalab, Column
 from datalab.serializers import DatalabSerializer
 
 from jwt import decode
-from ontask.settings import SECRET_KEY
+from ontask.settings import SECRET_KEY, PAGE_SIZE, MAX_PAGE_SIZE
 
 import logging
 
@@ -45,7 +46,7 @@ class ListForms(APIView):
         datalab.relations = get_relations(
             datalab.steps, datalab_id=datalab.id, permission=datalab.permission
         )
-        datalab.save()
+        datalab.refresh_access()
 
         form.refresh_access()
 
@@ -112,7 +113,7 @@ class DetailForm(APIView):
 
         serializer = FormSerializer(form, data=request.data, partial=True)
         serializer.is_valid()
-        serializer.save()
+        serializer.save(lastUpdated=dt.utcnow())
 
         logger.info(
             "form.edit",
@@ -122,7 +123,7 @@ class DetailForm(APIView):
         datalab.relations = get_relations(
             datalab.steps, datalab_id=datalab.id, permission=datalab.permission
         )
-        datalab.save()
+        datalab.refresh_access()
 
         form.refresh_access()
 
@@ -146,6 +147,66 @@ class DetailForm(APIView):
         return Response(status=HTTP_200_OK)
 
 
+def form_field_names(form):
+    """Names of the fields in which the form stores data"""
+    names = []
+    for field in form.fields:
+        if field.type == "checkbox-group":
+            names.extend([f"{field.name}__{column}" for column in field.columns])
+        else:
+            names.append(field.name)
+    return names
+
+
+def write_cell(form, primary, field, value):
+    """
+    Write a single value of the form data in place, so that concurrent edits
+    of other cells (or records) are not overwritten
+    """
+    collection = Form._get_collection()
+    last_updated = dt.utcnow()
+
+    record_query = {"_id": form.id, "data": {"$elemMatch": {form.primary: primary}}}
+    record_update = {"$set": {f"data.$.{field}": value, "lastUpdated": last_updated}}
+
+    if collection.update_one(record_query, record_update).matched_count:
+        return
+
+    # The record is only added if it still doesn't exist
+    added = collection.update_one(
+        {"_id": form.id, f"data.{form.primary}": {"$ne": primary}},
+        {
+            "$push": {"data": {form.primary: primary, field: value}},
+            "$set": {"lastUpdated": last_updated},
+        },
+    )
+    if not added.matched_count:
+        # Another edit added the record in the meantime
+        collection.update_one(record_query, record_update)
+
+
+def is_lazy(request):
+    """Whether the column filters of the form are fetched separately"""
+    return request.query_params.get("lazy") in ("1", "true")
+
+
+def first_page_parameters(request):
+    """
+    Current page and page size of the first page of a lazily loaded form, in
+    the format of the pagination of the table (see page_parameters of the
+    action views for the offset and limit of the other paginated endpoints)
+    """
+    try:
+        current = int(request.query_params.get("current", 1))
+        page_size = int(request.query_params.get("pageSize", PAGE_SIZE))
+    except ValueError:
+        raise ValidationError("The current page and page size must be integers")
+    if current < 1 or page_size < 1:
+        raise ValidationError("The current page and page size must be positive")
+
+    return {"current": current, "pageSize": min(page_size, MAX_PAGE_SIZE)}
+
+
 class AccessForm(APIView):
     permission_classes = (AllowAny,)
 
@@ -155,10 +216,6 @@ class AccessForm(APIView):
         except:
             raise NotFound()
 
-        accessible_records = pd.DataFrame(data=form.datalab.data).set_index(
-            form.primary
-        )
-
         user_values = []
 
         # Get User Email from logged in user or jwt token
@@ -175,10 +232,15 @@ class AccessForm(APIView):
         else:
             raise PermissionDenied()
 
+        datalab = form.datalab
+
         if has_full_permission:
-            editable_records = accessible_records.index.values
+            accessible_records = datalab.data
+            editable_records = [record.get(form.primary) for record in accessible_records]
             default_group = (
-                accessible_records[form.groupBy].iloc[0] if form.groupBy else None
+                accessible_records[0].get(form.groupBy)
+                if form.groupBy and len(accessible_records)
+                else None
             )
         else:
             if form.emailAccess:
@@ -192,30 +254,28 @@ class AccessForm(APIView):
                 except:
                     pass
 
-            if form.primary == form.permission:
-                editable_records = accessible_records[
-                    accessible_records.index.str.lower().isin(user_values)
-                ]
-            else:
-                editable_records = accessible_records[
-                    accessible_records[form.permission].str.lower().isin(user_values)
-                ]
+            # Only the rows of the user are fetched, rather than the whole DataLab
+            editable = datalab.accessible_data(form.permission, user_values)
 
-            if not len(editable_records):
+            if not len(editable):
                 # User does not have access to any records, so return a 403
                 raise PermissionDenied()
 
-            default_group = (
-                editable_records[form.groupBy].iloc[0] if form.groupBy else None
-            )
+            default_group = editable[0].get(form.groupBy) if form.groupBy else None
 
-            if form.restriction == "open":
-                editable_records = accessible_records.index.values
-            else:
-                editable_records = editable_records.index.values
+            # Limit the records to only those which the user has permission against
+            accessible_records = (
+                editable if form.restriction == "private" else datalab.data
+            )
+            editable_records = [
+                record.get(form.primary)
+                for record in (
+                    accessible_records if form.restriction == "open" else editable
+                )
+            ]
 
         datalab_data = (
-            pd.DataFrame(data=form.datalab.data)
+            pd.DataFrame(data=accessible_records)
             .set_index(form.primary)
             .filter(items=[form.primary, *form.visibleFields])
         )
@@ -223,12 +283,7 @@ class AccessForm(APIView):
         form_data = pd.DataFrame(data=form.data)
         # Only include fields that are in the form design
         # (Some fields may have data, but were removed)
-        form_fields = [form.primary]
-        for field in form.fields:
-            if field.type == "checkbox-group":
-                form_fields.extend([f"{field.name}__{column}" for column in field.columns])
-            else:
-                form_fields.append(field.name)
+        form_fields = [form.primary, *form_field_names(form)]
 
         form_data = form_data.reindex(columns=form_fields)
 
@@ -237,10 +292,6 @@ class AccessForm(APIView):
 
         data = datalab_data.join(form_data).reset_index()
 
-        if form.restriction == "private":
-            # Limit the records to only those which the user has permission against
-            data = data[data[form.primary].isin(editable_records)]
-
         # Replace NaN values with None
         data.replace({pd.np.nan: None}, inplace=True)
 
@@ -254,9 +305,7 @@ class AccessForm(APIView):
 
         return [form, data, editable_records, default_group, email]
 
-    def get_filter_details(self, form, data, filters={}):
-        # Create Columns
-
+    def get_columns(self, form):
         # Add Primary Field
         columns = [
             {
@@ -297,6 +346,16 @@ class AccessForm(APIView):
                 }
             )
 
+        return columns
+
+    def get_filter_details(self, form, data, filters={}, lazy=False):
+        """
+        Page of the data, along with the options of the column filters. If lazy,
+        the options of each column are omitted and are instead fetched when the
+        filter of the column is opened (see column_filter)
+        """
+        columns = self.get_columns(form)
+
         df = pd.DataFrame.from_dict(data)
         group_column = next(column for column in columns if column['details']['label'] == form.groupBy) if form.groupBy is not None else None
 
@@ -306,7 +365,7 @@ class AccessForm(APIView):
             {
                 'dataNum': len(data),
                 'paginationTotal': pagination_total,
-                'filters': get_filters(df, columns),
+                'filters': {} if lazy else get_filters(df, columns),
                 'filteredData': filtered_data,
                 'groups': get_column_filter(df, group_column)
             }
@@ -316,10 +375,24 @@ class AccessForm(APIView):
     def get(self, request, id, token=None):
         [form, data, editable_records, default_group, email] = self.get_data(id, token)
 
+        column_name = request.query_params.get("column")
+        if column_name is not None:
+            return Response(self.column_filter(form, data, column_name))
+
+        # Tables of a lazily loaded form are only sent their first page, whereas
+        # the vertical layout chooses between all of the records
+        lazy = is_lazy(request)
+        filters = (
+            {"pagination": first_page_parameters(request)}
+            if lazy and form.layout == "table"
+            else {}
+        )
+        filter_details = self.get_filter_details(form, data, filters, lazy=lazy)
+
         serializer = RestrictedFormSerializer(
             form,
             context={
-                "data": data,
+                "data": filter_details["filteredData"] if filters else data,
                 "editable_records": editable_records,
                 "default_group": default_group,
             },
@@ -329,13 +402,30 @@ class AccessForm(APIView):
 
         result = {
             **serializer.data,
-            'filter_details': self.get_filter_details(form, data)
+            'filter_details': filter_details
         }
         return Response(result)
 
+    def column_filter(self, form, data, column_name):
+        """Options of the filter of a single column"""
+        column = next(
+            (
+                column
+                for column in self.get_columns(form)
+                if column['details']['label'] == column_name
+            ),
+            None,
+        )
+        if column is None:
+            raise ValidationError(f"{column_name} is not a column of this form")
+
+        return {
+            'column': column_name,
+            'filters': get_column_filter(pd.DataFrame.from_dict(data), column)
+        }
 
     def patch(self, request, id, token=None):
-        # Data is cleaned up version of form.data
+        # Data is the joined view of the DataLab and the form data
         [form, data, editable_records, default_group, email] = self.get_data(id, token)
 
         primary = request.data.get("primary")
@@ -345,44 +435,43 @@ class AccessForm(APIView):
         field = request.data.get("field")
         value = request.data.get("value")
 
-        data = pd.DataFrame(data=form.data)
-        if form.primary in data.columns:
-            # Sort dataframe by form.primary
-            data.set_index(form.primary, inplace=True)
-            data = data.T.to_dict()
-            if primary in data:
-                data[primary][field] = value
-            else:
-                data[primary] = {field: value}
-            data = (
-                pd.DataFrame.from_dict(data, orient="index")
-                .rename_axis(form.primary)
-                .reset_index()
-            )
-        else:
-            data = pd.DataFrame(data=[{form.primary: primary, field: value}])
+        if field not in form_field_names(form):
+            raise ValidationError(f"{field} is not a field of this form")
 
-        # Replace NaN values with None
-        data.replace({pd.np.nan: None}, inplace=True)
-        data = data.to_dict("records")
-        form.data = data
-        form.save()
+        write_cell(form, primary, field, value)
 
         logger.info(
             "form.input",
             extra={"id": id, "user": email, "payload": request.data},
         )
 
-        # Get & Return New Filter Details
-        [form, data, editable_records, default_group, email] = self.get_data(id, token)
+        # The edit is applied to the view that was already built, rather than
+        # building it again from the updated form
+        record = next(
+            (record for record in data if record.get(form.primary) == primary), None
+        )
+        if record is not None:
+            record[field] = value
+        else:
+            [form, data, editable_records, default_group, email] = self.get_data(
+                id, token
+            )
 
-        return Response(self.get_filter_details(form, data, request.data.get("filterOptions")), status=HTTP_200_OK)
+        return Response(
+            self.get_filter_details(
+                form, data, request.data.get("filterOptions"), lazy=is_lazy(request)
+            ),
+            status=HTTP_200_OK,
+        )
 
     def post(self, request, id, token=None):
         """Apply Filter"""
         [form, data, editable_records, default_group, email] = self.get_data(id, token)
 
-        return Response(self.get_filter_details(form, data, request.data), status=HTTP_200_OK)
+        return Response(
+            self.get_filter_details(form, data, request.data, lazy=is_lazy(request)),
+            status=HTTP_200_OK,
+        )
 
 @api_view(["POST"])
 @permission_classes([IsAdminUser])
@@ -416,12 +505,7 @@ def ExportStructure(request, id):
     form_data = pd.DataFrame(data=form.data)
     # Only include fields that are in the form design
     # (Some fields may have data, but were removed)
-    form_fields = [form.primary]
-    for field in form.fields:
-        if field.type == "checkbox-group":
-            form_fields.extend([f"{field.name}__{column}" for column in field.columns])
-        else:
-            form_fields.append(field.name)
+    form_fields = [form.primary, *form_field_names(form)]
 
     form_data = form_data.reindex(columns=form_fields)
 
@@ -447,55 +531,22 @@ def ExportStructure(request, id):
 @permission_classes([IsAdminUser])
 def ImportData(request, id):
     try:
-        form = Form.objects.get(id=id)
+        # The data of the form is written in place by the import, so it isn't loaded
+        form = Form.objects.exclude("data").get(id=id)
     except:
         raise NotFound()
 
-    original_columns = [form.primary]
-    
-    for col in form.fields:
-        original_columns.append(col.name)
-
-    data = pd.DataFrame(form.data)
-
-    form_data = pd.DataFrame(form.data).set_index(form.primary).T.to_dict()
-    imported_data = (
-        pd.read_csv(request.data["file"])
-    )
-
-    imported_data = (
-        imported_data
-        .replace({pd.np.nan: None})
-        .set_index(imported_data.columns[0])
-        .T.to_dict()
-    )
-    for primary, values in imported_data.items():
-        form_data[primary] = values
-
-    form_data = (
-        pd.DataFrame.from_dict(form_data, orient="index")
-        .rename_axis(form.primary)
-        .reset_index()
-    )
-
-    # remove the data that isn't included?
-    for col in form_data.columns:
-        if col not in original_columns:
-            form_data.drop([col], axis=1, inplace=True)
-
-    # Replace NaN values with None
-    form_data.replace({pd.np.nan: None}, inplace=True)
-
-    form.data = form_data.to_dict("records")
-    form.save()
+    result = import_data(form, request.data["file"])
 
     logger.info(
         "form.import",
         extra={
             "id": id,
             "user": request.user.email,
-            "payload": imported_data
+            "created": result["created"],
+            "updated": result["updated"],
+            "errors": result["errorCount"],
         },
     )
 
-    return Response(status=HTTP_200_OK)
+    return Response(result, status=HTTP_200_OK)
@@ -89,6 +89,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "datalab.resolver.SourceScopeMiddleware",
 ]
 
 CORS_ORIGIN_WHITELIST = FRONTEND_DOMAIN  # Domain specified in the config file
@@ -165,6 +166,44 @@ BROKER_POOL_LIMIT = None
 
 DB_DRIVER_MAPPING = {"postgresql": "postgresql", "mysql": "mysql+pymysql"}
 
+# Maximum number of cells (rows x columns) stored in each chunk of a datasource
+DATASOURCE_CHUNK_CELLS = 250000
+
+# Maximum encoded size (in bytes) of each chunk of a datasource, well under the
+# 16MB document limit of MongoDB
+DATASOURCE_CHUNK_BYTES = 8 * 1024 * 1024
+
+# Maximum number of DataLabs refreshed in parallel when a shared source changes
+DATALAB_REFRESH_WORKERS = 4
+
+# Number of recipients between each write of the progress of an email job
+EMAIL_PROGRESS_INTERVAL = 50
+
+# Number of threads sending the emails of a job, each with its own SMTP connection
+EMAIL_SEND_WORKERS = 4
+
+# Maximum number of emails sent per second by each worker process (across all of
+# its jobs). If not set, the rate is derived from EMAIL_BATCH_SIZE and EMAIL_BATCH_PAUSE
+EMAIL_RATE_LIMIT = None
+
+# Seconds between each write of the buffered email tracking events of a process. If
+# not set, each read receipt and link click is written as it is received
+TRACKING_FLUSH_INTERVAL = 5
+
+# Number of buffered tracking events which triggers a write before the interval
+TRACKING_BUFFER_SIZE = 1000
+
+# Number of rows of an imported CSV which are validated and written to a form at once
+FORM_IMPORT_CHUNK_ROWS = 500
+
+# Maximum number of invalid cells reported back by an import of form data
+FORM_IMPORT_MAX_ERRORS = 100
+
+# Number of rows on each page of a paginated table (unless another page size is
+# requested), and the largest page size which can be requested
+PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -1,4 +1,3 @@
-from django.core.mail import get_connection
 from celery import shared_task
 from celery.execute import send_task
 from django_celery_beat.models import PeriodicTask
@@ -6,20 +5,27 @@ from django_celery_beat.models import PeriodicTask
 from bson.objectid import ObjectId
 import jwt
 import uuid
-from time import sleep
 from datetime import datetime as dt
 import boto3
 import pandas as pd
 from io import StringIO
 import os
-from contextlib import ExitStack
+import smtplib
+from concurrent.futures import ThreadPoolExecutor
 
 from datasource.models import Datasource
 from administration.models import Dump
 from datalab.models import Datalab
-
-from .utils import create_crontab, send_email, should_run
-from workflow.utils import parse_link
+from datalab.resolver import source_scope
+
+from .utils import (
+    create_crontab,
+    send_email,
+    should_run,
+    RateLimiter,
+    SMTPConnectionPool,
+)
+from workflow.template import tracking_link
 
 from ontask.settings import (
     SECRET_KEY,
@@ -27,6 +33,9 @@ from ontask.settings import (
     FRONTEND_DOMAIN,
     EMAIL_BATCH_SIZE,
     EMAIL_BATCH_PAUSE,
+    EMAIL_PROGRESS_INTERVAL,
+    EMAIL_SEND_WORKERS,
+    EMAIL_RATE_LIMIT,
     AWS_PROFILE,
     DATALAB_DUMP_BUCKET,
 )
@@ -35,6 +44,18 @@ import logging
 
 logger = logging.getLogger("emails")
 
+# Shared by every email job of this worker process, so that the provider's send
+# limit is respected. Without an explicit limit, the batch size and pause give the
+# same average rate, with bursts of up to a batch of emails
+if EMAIL_RATE_LIMIT:
+    email_rate_limiter = RateLimiter(EMAIL_RATE_LIMIT)
+elif EMAIL_BATCH_SIZE and EMAIL_BATCH_PAUSE:
+    email_rate_limiter = RateLimiter(
+        EMAIL_BATCH_SIZE / EMAIL_BATCH_PAUSE, capacity=EMAIL_BATCH_SIZE
+    )
+else:
+    email_rate_limiter = RateLimiter(None)
+
 
 @shared_task
 @should_run
@@ -69,24 +90,26 @@ def dump_datalab_data(**kwargs):
     else:
         s3 = boto3.resource("s3")
 
-    for datalab in dump.datalabs:
-        datalab = Datalab.objects.get(id=datalab.id)
-        data = pd.DataFrame(datalab.data)
-        csv_buffer = StringIO()
+    # DataLabs that are dumped together share their sources
+    with source_scope():
+        for datalab in dump.datalabs:
+            datalab = Datalab.objects.get(id=datalab.id)
+            data = pd.DataFrame(datalab.data)
+            csv_buffer = StringIO()
 
-        # Re-order the columns to match the original datasource data
-        order = OrderItemSerializer(
-            datalab.order, many=True, context={"steps": datalab.steps}
-        )
-        reordered_columns = [
-            item.get("details", {}).get("label") for item in order.data
-        ]
-        data = data.reindex(columns=reordered_columns)
+            # Re-order the columns to match the original datasource data
+            order = OrderItemSerializer(
+                datalab.order, many=True, context={"steps": datalab.steps}
+            )
+            reordered_columns = [
+                item.get("details", {}).get("label") for item in order.data
+            ]
+            data = data.reindex(columns=reordered_columns)
 
-        data.to_csv(csv_buffer, index=False)
-        s3.Object(
-            DATALAB_DUMP_BUCKET, f"{datalab.container.code}_{datalab.name}.csv"
-        ).put(Body=csv_buffer.getvalue())
+            data.to_csv(csv_buffer, index=False)
+            s3.Object(
+                DATALAB_DUMP_BUCKET, f"{datalab.container.code}_{datalab.name}.csv"
+            ).put(Body=csv_buffer.getvalue())
 
     return "DataLab data dumped successfully"
 
@@ -101,148 +124,196 @@ def workflow_send_email(action_id=None, job_type="Scheduled", **kwargs):
     from workflow.models import Workflow, EmailJob, Email
     action = Workflow.objects.get(id=ObjectId(action_id))
 
-    populated_content = action.populate_content(email=True)
+    # Records, column order, types and rule assignments are resolved once for
+    # the whole job, and every email is rendered from this snapshot
+    with source_scope():
+        snapshot = action.render_snapshot()
+        template = action.compile_content(snapshot)
+    messages = snapshot["records"]
+
     email_settings = action.emailSettings
 
     job_id = ObjectId()
-    job = EmailJob(
+
+    successes = []
+    failures = []
+    null_recipients = 0
+
+    # Position in the snapshot of each record with an email address
+    recipients = []
+    for index, item in enumerate(messages):
+        recipient = item.get(email_settings.field)
+        if recipient == "" or recipient is None:
+            null_recipients += 1
+        else:
+            recipients.append((index, recipient))
+
+    # The job is recorded up front, and its emails are inserted as they are
+    # sent, rather than saving the whole action for every recipient
+    EmailJob(
         job_id=job_id,
+        action=action,
         subject=email_settings.subject,
         type=job_type,
         included_feedback=email_settings.include_feedback and True,
-        emails=[],
+    ).save(force_insert=True)
+    action.update(
+        set__currentEmailJob={
+            "successes": 0,
+            "failures": 0,
+            "totalEmails": len(recipients),
+        }
     )
 
-    successes = []
-    failures = []
-    null_recipients = 0
+    # Emails which have been sent, but not yet recorded against the job
+    pending_emails = []
+
+    def record_progress():
+        if pending_emails:
+            Email._get_collection().insert_many(
+                [email.to_mongo() for email in pending_emails], ordered=False
+            )
+            pending_emails.clear()
+
+        action.update(
+            set__currentEmailJob={
+                "successes": len(successes),
+                "failures": len(failures),
+                "totalEmails": len(recipients),
+            }
+        )
+
+    def deliver(recipient_details):
+        """Render and send the email of a single recipient, from a pool thread"""
+        index, recipient = recipient_details
 
-    messages = action.data["records"]
-    batch_size = EMAIL_BATCH_SIZE if EMAIL_BATCH_SIZE else len(messages)
-    batch_pause = EMAIL_BATCH_PAUSE if EMAIL_BATCH_PAUSE else 0
-
-    email_batches = [
-        messages[i: i + batch_size] for i in range(0, len(messages), batch_size)
-    ]
-
-    action.currentEmailJob = {
-        "successes": 0,
-        "failures": 0,
-        "totalEmails": len(email_batches),
-    }
-    action.save()
-
-    recipient_count = 0
-    for batch_index, batch in enumerate(email_batches):
-        logger.info(
-            "email.batch",
-            extra={
-                "action": action_id,
-                "current": batch_index + 1,
-                "total": len(email_batches),
+        email_id = uuid.uuid4().hex
+        email_content = template.render(
+            index,
+            messages[index],
+            snapshot["rules"],
+            links=tracking_link(action.id, job_id, email_id),
+        )
+        tracking_token = jwt.encode(
+            {
+                "action_id": str(action.id),
+                "job_id": str(job_id),
+                "email_id": str(email_id),
             },
+            SECRET_KEY,
+            algorithm="HS256",
+        ).decode("utf-8")
+
+        read_receipt_link = f"{BACKEND_DOMAIN}/workflow/read_receipt/?email={tracking_token}"
+        tracking_pixel = f"<img src='{read_receipt_link}'/>"
+        email_content += tracking_pixel
+
+        if email_settings.include_feedback:
+            feedback_link = f"{FRONTEND_DOMAIN}/feedback/{action.id}/?job={job_id}&email={email_id}"
+            email_content += (
+                "<p>Did you find this correspondence useful? Please provide your "
+                f"feedback by <a href='{feedback_link}'>clicking here</a>.</p>"
+            )
+
+        if os.environ.get("ONTASK_DEVELOPMENT"):
+            print("********* EMAIL CONTENT *************************")
+            print(email_content)
+            print("********* EMAIL CONTENT *************************")
+            email_sent = True
+        else:
+            email_sent = send(recipient, email_content)
+
+        # The content is stored without the tracking pixel and links
+        stored_content = (
+            template.render(index, messages[index], snapshot["rules"])
+            if email_sent
+            else None
         )
-        # Conditionally use get_connection() based on ENV variables
-        with ExitStack() as stack:
-            if not os.environ.get("ONTASK_DEVELOPMENT"):
-                # Open a connection to the SMTP server, which will be used for every email sent in this batch
-                # It is done per batch to avoid the risk of the connection timing out if the batch_delay is long
-                connection = stack.enter_context(get_connection())
-            for index, item in enumerate(batch):
-                recipient = item.get(email_settings.field)
-                if recipient == "" or recipient is None:
-                    null_recipients += 1
-                else:
-                    # email_content = populated_content[recipient_count]
-                    # print('email content here***************************************************', email_content)
-                    email_id = uuid.uuid4().hex
-                    email_content = parse_link(populated_content[recipient_count], action.data['records'][recipient_count], recipient_count, action.id, job_id, email_id)
-                    tracking_token = jwt.encode(
-                        {
-                            "action_id": str(action.id),
-                            "job_id": str(job_id),
-                            "email_id": str(email_id),
-                        },
-                        SECRET_KEY,
-                        algorithm="HS256",
-                    ).decode("utf-8")
-
-                    tracking_link = f"{BACKEND_DOMAIN}/workflow/read_receipt/?email={tracking_token}"
-                    tracking_pixel = f"<img src='{tracking_link}'/>"
-                    email_content += tracking_pixel
-
-                    if email_settings.include_feedback:
-                        feedback_link = f"{FRONTEND_DOMAIN}/feedback/{action.id}/?job={job_id}&email={email_id}"
-                        email_content += (
-                            "<p>Did you find this correspondence useful? Please provide your "
-                            f"feedback by <a href='{feedback_link}'>clicking here</a>.</p>"
-                        )
-
-                    if os.environ.get("ONTASK_DEVELOPMENT"):
-                        print("********* EMAIL CONTENT *************************")
-                        print(email_content)
-                        print("********* EMAIL CONTENT *************************")
-                        email_sent = True
-                        # email_sent = send_email(
-                        #     recipient,
-                        #     email_settings.subject,
-                        #     email_content,
-                        #     from_name=email_settings.fromName,
-                        #     reply_to=email_settings.replyTo,
-                        #     connection=connection,
-                        # )
-                    else:
-                        email_sent = send_email(
-                            recipient,
-                            email_settings.subject,
-                            email_content,
-                            from_name=email_settings.fromName,
-                            reply_to=email_settings.replyTo,
-                            connection=connection,
-                        )
-
-                    if email_sent:
-                        job.emails.append(
-                            Email(
-                                email_id=email_id,
-                                recipient=recipient,
-                                # Content without the tracking pixel
-                                content=populated_content[index],
-                            )
-                        )
-
-                        successes.append(recipient)
-                    else:
-                        failures.append(recipient)
-
-                    logger.info(
-                        f"email.{'success' if email_sent else 'fail'}",
-                        extra={
-                            "action": action_id,
-                            "batch": batch_index + 1,
-                            "recipient": recipient,
-                            "from": email_settings.fromName,
-                            "reply-to": email_settings.replyTo,
-                            "subject": email_settings.subject,
-                            "content": email_content,
-                        },
-                    )
-                action.currentEmailJob = {
-                    "successes": len(successes),
-                    "failures": len(failures),
-                    "totalEmails": len(email_batches),
-                }
-                action.save()
-                recipient_count += 1
+        return (recipient, email_id, email_content, stored_content, email_sent)
+
+    def send(recipient, email_content):
+        """Send an email over the connection of this pool thread"""
+        email_rate_limiter.acquire()
+
+        # The connection of this thread may have timed out while it was idle, in
+        # which case the email is retried once over a new connection
+        for attempt in range(1, 3):
+            try:
+                return send_email(
+                    recipient,
+                    email_settings.subject,
+                    email_content,
+                    from_name=email_settings.fromName,
+                    reply_to=email_settings.replyTo,
+                    connection=connections.connection(),
+                )
+            except (smtplib.SMTPException, OSError) as error:
+                connections.reset()
+                logger.warning(
+                    "email.send_failed",
+                    extra={
+                        "action": action_id,
+                        "recipient": recipient,
+                        "attempt": attempt,
+                        "error": repr(error),
+                    },
+                )
+
+        return False
+
+    logger.info(
+        "email.start",
+        extra={
+            "action": action_id,
+            "recipients": len(recipients),
+            "workers": EMAIL_SEND_WORKERS,
+        },
+    )
 
-            if batch_index + 1 != len(email_batches) and batch_pause > 0:
-                sleep(batch_pause)
+    with SMTPConnectionPool() as connections, ThreadPoolExecutor(
+        max_workers=EMAIL_SEND_WORKERS
+    ) as executor:
+        # Results are consumed in the order of the recipients
+        for count, (
+            recipient,
+            email_id,
+            email_content,
+            stored_content,
+            email_sent,
+        ) in enumerate(executor.map(deliver, recipients), 1):
+            if email_sent:
+                pending_emails.append(
+                    Email(
+                        action=action,
+                        job_id=job_id,
+                        email_id=email_id,
+                        recipient=recipient,
+                        content=stored_content,
+                    )
+                )
+
+                successes.append(recipient)
+            else:
+                failures.append(recipient)
+
+            logger.info(
+                f"email.{'success' if email_sent else 'fail'}",
+                extra={
+                    "action": action_id,
+                    "recipient": recipient,
+                    "from": email_settings.fromName,
+                    "reply-to": email_settings.replyTo,
+                    "subject": email_settings.subject,
+                    "content": email_content,
+                },
+            )
 
-    action.emailLocked = False
+            if count % EMAIL_PROGRESS_INTERVAL == 0:
+                record_progress()
 
-    action.emailJobs.append(job)
+    record_progress()
 
-    action.save()
+    action.update(set__emailLocked=False)
 
     if not os.environ.get("ONTASK_DEVELOPMENT"):
         if len(failures) == 0 and null_recipients == 0:
@@ -1,8 +1,10 @@
 from django_celery_beat.models import CrontabSchedule, PeriodicTask
-from django.core.mail import EmailMessage
+from django.core.mail import EmailMessage, get_connection
 
 import os
 import json
+import threading
+from time import monotonic, sleep
 from dateutil import parser
 from uuid import uuid4
 from datetime import datetime as dt
@@ -125,3 +127,77 @@ def send_email(
 
     email.send()
     return True
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every thread sending emails, which allows bursts of
+    up to capacity emails and then a steady rate of emails per second
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity else max(1, rate or 1)
+        self.tokens = self.capacity
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            sleep(wait)
+
+
+class SMTPConnectionPool:
+    """SMTP connections for a pool of threads, with one connection per thread"""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = get_connection()
+            connection.open()
+            self.local.connection = connection
+            with self.lock:
+                self.connections.append(connection)
+
+        return connection
+
+    def reset(self):
+        """Discard the connection of the current thread, e.g. if it timed out"""
+        connection = getattr(self.local, "connection", None)
+        self.local.connection = None
+        if connection is not None:
+            try:
+                connection.close()
+            except:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        for connection in self.connections:
+            try:
+                connection.close()
+            except:
+                pass
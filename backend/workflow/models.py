@@ -14,30 +14,20 @@ from mongoengine.fields import (
     BaseField,
 )
 from datetime import datetime
-from collections import defaultdict
 from bson.objectid import ObjectId
 import jwt
 
 from container.models import Container
 from datalab.models import Datalab
-from datasource.models import Datasource
+from datalab.resolver import get_resolver
 from form.models import Form
 
-from .utils import (
-    did_pass_test,
-    parse_attribute,
-    parse_link,
-    simple_parse_link,
-    generate_condition_tag_locations,
-    replace_tags,
-    strip_tags,
-    delete_html_by_indexes
-)
+from .rules import RuleEngine
+from .template import Template, simple_link
 from scheduler.tasks import workflow_send_email
 
 from ontask.settings import SECRET_KEY, BACKEND_DOMAIN, FRONTEND_DOMAIN
 
-import re
 
 class Formula(EmbeddedDocument):
     comparator = BaseField()
@@ -95,28 +85,6 @@ class EmailSettings(EmbeddedDocument):
     textbox_question = StringField()
 
 
-class Email(EmbeddedDocument):
-    email_id = StringField()
-    recipient = StringField()
-    content = StringField()
-    list_feedback = StringField()
-    textbox_feedback = StringField()
-    feedback_datetime = DateTimeField()
-    track_count = IntField(default=0)
-    first_tracked = DateTimeField()
-    last_tracked = DateTimeField()
-    link_clicks = DictField()
-
-
-class EmailJob(EmbeddedDocument):
-    job_id = ObjectIdField()
-    subject = StringField()
-    emails = EmbeddedDocumentListField(Email)
-    type = StringField(choices=["Manual", "Scheduled"])
-    initiated_at = DateTimeField(default=datetime.utcnow)
-    included_feedback = BooleanField()
-
-
 class Workflow(Document):
     container = ReferenceField(
         Container, required=True, reverse_delete_rule=2
@@ -132,10 +100,13 @@ class Workflow(Document):
     emailSettings = EmbeddedDocumentField(EmailSettings)
     schedule = EmbeddedDocumentField(Schedule, null=True, required=False)
     linkId = StringField(null=True)  # link_id is unique across workflow objects
-    emailJobs = EmbeddedDocumentListField(EmailJob)
     emailLocked = BooleanField(default=False)
     currentEmailJob = DictField(default={})
 
+    # The email jobs of actions which haven't been migrated to their own
+    # collection are still embedded in the action (see migrate_email_jobs)
+    meta = {"strict": False}
+
     @property
     def datalab_name(self):
         return self.datalab.name
@@ -157,22 +128,16 @@ class Workflow(Document):
         # Create a "pseudo" module to hold the computed fields
         computed = {"type": "computed", "fields": []}
 
+        resolver = get_resolver()
+        resolver.prefetch(self.datalab.steps)
+
         # Iterate over the modules of the datalab
         for step in self.datalab.steps:
             module = {"type": step.type, "fields": []}
             module_labels = {}
 
             if step.type == "datasource":
-                datasource = None
-                try:
-                    datasource = Datasource.objects.get(id=step.datasource.id)
-                except:
-                    pass
-
-                try:
-                    datasource = Datalab.objects.get(id=step.datasource.id)
-                except:
-                    pass
+                datasource = resolver.get_source(step.datasource)
                 if datasource:
 
                     # try:
@@ -202,7 +167,7 @@ class Workflow(Document):
                         # print(e, e.args)
 
             if step.type == "form":
-                form = Form.objects.get(id=step.form)
+                form = resolver.get_form(step.form)
                 module["name"] = form.name
                 for field in form.fields:
                     if field.type == "checkbox-group":
@@ -229,38 +194,41 @@ class Workflow(Document):
 
     @property
     def data(self):
+        snapshot = self.render_snapshot(assign_rules=False)
+
+        return {
+            "records": snapshot["records"],
+            "order": snapshot["order"],
+            "unfilteredLength": snapshot["unfilteredLength"],
+            "filteredLength": len(snapshot["records"]),
+        }
+
+    def render_snapshot(self, assign_rules=True):
+        """
+        Everything needed to render the content of the action, computed once:
+        the filtered records, the column order, the types of the fields and
+        (optionally) the records assigned to each rule condition
+        """
         options = self.options
+        types = options["types"]
+        datalab_data = self.datalab.data
 
+        # Each parameter is transformed once for the filter and all the rules
+        engine = RuleEngine(datalab_data, types)
         if self.filter:
-            filtered_data = []
-
-            types = options["types"]
-            parameters = self.filter.parameters
-            condition = self.filter.conditions[0]
-
-            for item in self.datalab.data:
-                if all(
-                    [
-                        did_pass_test(
-                            condition.formulas[parameter_index],
-                            item.get(parameter),
-                            types.get(parameter),
-                        )
-                        for parameter_index, parameter in enumerate(parameters)
-                    ]
-                ):
-                    filtered_data.append(item)
-
+            indexes = engine.filter(self.filter)
+            filtered_data = [datalab_data[index] for index in indexes]
         else:
-            filtered_data = self.datalab.data
+            indexes = None
+            filtered_data = datalab_data
 
         column_order = []
         from datalab.serializers import OrderItemSerializer
-        order = OrderItemSerializer(
+        columns = OrderItemSerializer(
             self.datalab.order, many=True, context={"steps": self.datalab.steps}
         ).data
 
-        for item in order:
+        for item in columns:
             if item["details"]["field_type"] == "checkbox-group":
                 column_order.extend(item["details"]["fields"])
             else:
@@ -269,85 +237,129 @@ class Workflow(Document):
         return {
             "records": filtered_data,
             "order": column_order,
-            "unfilteredLength": len(self.datalab.data),
-            "filteredLength": len(filtered_data),
+            "columns": columns,
+            "types": types,
+            "rules": engine.assign_rules(self.rules, indexes) if assign_rules else None,
+            "unfilteredLength": len(datalab_data),
         }
 
+    def compile_content(self, snapshot, content=None):
+        """Template of the content of the action (or of the given content)"""
+        return Template(
+            content if content else self.content or "",
+            snapshot["columns"],
+            Form.objects.filter(datalab=self.datalab),
+        )
+
     # email is a field so it populates content depending on when the function is used (normally vs before sending an email).
     # this is important for parsing links, as normally we don't need to generate a complex tracking link, where we do have to do that in an email.
 
-    def populate_content(self, content=None, email=False):
+    def populate_content(self, content=None, email=False, snapshot=None):
+        """
+        Generate HTML string for each student based on conditions and attributes
+        The content is compiled once, and then rendered for each record
+        """
         if not content and not self.content:
             return []
-        elif not content:
-            content = self.content
-
-        filtered_data = self.data["records"]
-        types = self.options["types"]
-
-        # Assign each student record to the rule groups
-        populated_rules = defaultdict(set)
-        for item_index, item in enumerate(filtered_data):
-            for rule in self.rules:
-                parameters = rule.parameters
-                did_match = False
-
-                for condition in rule.conditions:
-                    if all(
-                        [
-                            did_pass_test(
-                                condition.formulas[parameter_index],
-                                item.get(parameter),
-                                types.get(parameter),
-                            )
-                            for parameter_index, parameter in enumerate(parameters)
-                        ]
-                    ):
-                        did_match = True
-                        populated_rules[condition.conditionId].add(item_index)
-                        break
-
-                if not did_match:
-                    populated_rules[rule.catchAll].add(item_index)
-
-        result = []
-        from datalab.serializers import OrderItemSerializer
-        order = OrderItemSerializer(
-            self.datalab.order, many=True, context={"steps": self.datalab.steps}
-        ).data
 
-        condition_ids = list(set(re.findall(r"conditionid=\"(.*?)\"", content)))
-        condition_tag_locations = generate_condition_tag_locations(content)
-        forms = Form.objects.filter(datalab=self.datalab)
+        if snapshot is None:
+            snapshot = self.render_snapshot()
+
+        template = self.compile_content(snapshot, content)
+        # Links are only rewritten once the email is sent, as they are tracked
+        links = None if email else simple_link
+
+        return [
+            template.render(item_index, item, snapshot["rules"], links=links)
+            for item_index, item in enumerate(snapshot["records"])
+        ]
+
+    def preview_content(self, content=None, offset=0, limit=10, search=None, field=None):
         """
-        Generate HTML string for each student based on conditions and attributes
-        Algo:
-        1. Delete condition blocks that do not match the student attributes
-            - Get a list of deleteIndexes of (start,stop) slices of condition tags to delete
-            - Perform the iterative deletion
-        2. Clean the HTML (replace <attribute>, <condition>, <rule>) to actual HTML tags
+        Content of a page of the records, optionally only those whose value of
+        the given field contains the search term. Only the records on the page
+        are rendered, whereas the number of records which satisfy each rule
+        condition is counted from the rule assignment
         """
-        for item_index, item in enumerate(filtered_data):
-            html = content
-
-            # 1
-            deleteIndexes = []
-            for condition_id in condition_ids:
-                if not item_index in populated_rules.get(ObjectId(condition_id), {}):
-                    deleteIndexes += condition_tag_locations[condition_id]
-            html = delete_html_by_indexes(html, deleteIndexes)
-
-            # 2
-            html = strip_tags(html, "condition")
-            html = strip_tags(html, "rule")
-            html = parse_attribute(html, item, order, forms)
-            # html = parse_link(html, item, order, self.id, job_id)
-            if email is False:
-                # normal case: parse the link to a simple <a> </a>
-                html = simple_parse_link(html, item, order)
-
-            result.append(html)
-        return result
+        snapshot = self.render_snapshot()
+        records = snapshot["records"]
+
+        if search:
+            search = search.lower()
+            positions = [
+                item_index
+                for item_index, item in enumerate(records)
+                if item.get(field) is not None
+                and search in str(item.get(field)).lower()
+            ]
+        else:
+            positions = range(len(records))
+
+        template = self.compile_content(snapshot, content)
+        recipient_field = self.emailSettings.field if self.emailSettings else None
+
+        items = [
+            {
+                "index": item_index,
+                "recipient": records[item_index].get(recipient_field)
+                if recipient_field
+                else None,
+                "content": template.render(
+                    item_index, records[item_index], snapshot["rules"], links=simple_link
+                ),
+            }
+            for item_index in positions[offset : offset + limit]
+        ]
+
+        conditions = {}
+        for rule in self.rules:
+            for condition in rule.conditions:
+                conditions[str(condition.conditionId)] = len(
+                    snapshot["rules"].get(condition.conditionId, ())
+                )
+            conditions[str(rule.catchAll)] = len(snapshot["rules"].get(rule.catchAll, ()))
+
+        return {
+            "items": items,
+            "offset": offset,
+            "limit": limit,
+            "total": len(positions),
+            "filteredLength": len(records),
+            "unfilteredLength": snapshot["unfilteredLength"],
+            "conditions": conditions,
+        }
 
     def send_email(self):
         workflow_send_email.delay(action_id=str(self.id), job_type="Manual")
+
+
+class EmailJob(Document):
+    """A job of an action, of which each email is stored separately"""
+
+    job_id = ObjectIdField(primary_key=True, default=ObjectId)
+    # Cascade delete if action is deleted
+    action = ReferenceField(Workflow, required=True, reverse_delete_rule=2)
+    subject = StringField()
+    type = StringField(choices=["Manual", "Scheduled"])
+    initiated_at = DateTimeField(default=datetime.utcnow)
+    included_feedback = BooleanField()
+
+    meta = {"indexes": [("action", "initiated_at")]}
+
+
+class Email(Document):
+    # Cascade delete if action is deleted
+    action = ReferenceField(Workflow, required=True, reverse_delete_rule=2)
+    job_id = ObjectIdField(required=True)
+    email_id = StringField(required=True)
+    recipient = StringField()
+    content = StringField()
+    list_feedback = StringField()
+    textbox_feedback = StringField()
+    feedback_datetime = DateTimeField()
+    track_count = IntField(default=0)
+    first_tracked = DateTimeField()
+    last_tracked = DateTimeField()
+    link_clicks = DictField()
+
+    meta = {"indexes": [("job_id", "id"), ("job_id", "email_id"), "action"]}
@@ -0,0 +1,206 @@
+"""
+Evaluation of the filter and rules of an action over all records at once
+
+Each parameter column is transformed to its type once, and each formula is
+parsed once, so that a condition is evaluated as a boolean mask over every
+record rather than by calling did_pass_test for each record. Numbers and dates
+are compared as arrays; any other column is compared once per distinct value.
+"""
+from collections import defaultdict
+from numbers import Number
+
+import numpy as np
+
+from .utils import transform, parse_formula, compare
+
+NUMERIC_TYPES = {"number", "date"}
+
+
+def value_key(value):
+    """Hashable key of a value, or None if it can't be hashed"""
+    try:
+        key = (type(value), value)
+        hash(key)
+        return key
+    except TypeError:
+        pass
+
+    try:
+        key = (type(value), tuple(value))
+        hash(key)
+        return key
+    except TypeError:
+        return None
+
+
+def is_real(value):
+    return isinstance(value, Number) and not isinstance(value, complex)
+
+
+class TypedColumn:
+    def __init__(self, values, param_type):
+        self.param_type = param_type
+
+        # The distinct values of the column, and the position of each record's
+        # value amongst them
+        positions = {}
+        uniques = []
+        codes = np.empty(len(values), dtype=np.intp)
+        for index, value in enumerate(values):
+            key = value_key(value)
+            if key is None or key not in positions:
+                uniques.append(transform(value, param_type))
+                if key is not None:
+                    positions[key] = len(uniques) - 1
+                codes[index] = len(uniques) - 1
+            else:
+                codes[index] = positions[key]
+
+        self.codes = codes
+        self.uniques = uniques
+
+        if param_type in NUMERIC_TYPES:
+            # Transformed values are floats (or timestamps for dates), or None
+            # if they couldn't be transformed
+            missing = np.array([value is None for value in uniques], dtype=bool)
+            numbers = np.array(
+                [np.nan if value is None else value for value in uniques], dtype=float
+            )
+            self.missing = missing[codes]
+            self.numbers = numbers[codes]
+
+    def mask(self, formula):
+        """Whether the value of each record passes the parsed formula"""
+        if self.param_type in NUMERIC_TYPES:
+            mask = self.numeric_mask(formula)
+            if mask is not None:
+                return mask
+
+        passes = np.array([compare(formula, value) for value in self.uniques], dtype=bool)
+        return passes[self.codes]
+
+    def numeric_mask(self, formula):
+        """
+        Mask of a formula over numbers, or None if its operands can't be
+        compared as arrays
+        """
+        operator = formula["operator"]
+        comparator = formula["comparator"]
+        numbers = self.numbers
+
+        if operator == "IS_NULL":
+            return self.missing.copy()
+        elif operator == "IS_NOT_NULL":
+            return ~self.missing
+        elif operator == "IS_TRUE" or operator == "IS_FALSE":
+            # NaN is truthy, whereas values which couldn't be transformed aren't
+            return ~self.missing & (numbers != 0)
+
+        if not formula["has_comparator"] and operator != "between":
+            return np.zeros(len(numbers), dtype=bool)
+
+        if operator in {"==", "!="} and comparator is None:
+            # None is only equal to the values which couldn't be transformed
+            return self.missing.copy() if operator == "==" else ~self.missing
+
+        if operator == "between":
+            range_from, range_to = formula["rangeFrom"], formula["rangeTo"]
+            if range_from is None:
+                return np.zeros(len(numbers), dtype=bool)
+            if not is_real(range_from) or not (is_real(range_to) or range_to is None):
+                return None
+            if range_to is None:
+                return np.zeros(len(numbers), dtype=bool)
+            return (numbers >= range_from) & (numbers <= range_to)
+
+        if comparator is None:
+            return np.zeros(len(numbers), dtype=bool)
+        if not is_real(comparator):
+            return None
+
+        if operator == "==":
+            return numbers == comparator
+        elif operator == "!=":
+            return numbers != comparator
+        elif operator == "<":
+            return numbers < comparator
+        elif operator == "<=":
+            return numbers <= comparator
+        elif operator == ">":
+            return numbers > comparator
+        elif operator == ">=":
+            return numbers >= comparator
+
+        return None
+
+
+class RuleEngine:
+    """
+    Column-wise view of the records of an action, which transforms each
+    parameter of its filter and rules at most once
+    """
+
+    def __init__(self, records, types):
+        self.records = records
+        self.types = types
+        self.columns = {}
+
+    def column(self, parameter):
+        if parameter not in self.columns:
+            self.columns[parameter] = TypedColumn(
+                [item.get(parameter) for item in self.records],
+                self.types.get(parameter),
+            )
+        return self.columns[parameter]
+
+    def condition_mask(self, parameters, condition):
+        """Records which pass every formula of a condition"""
+        mask = np.ones(len(self.records), dtype=bool)
+        if not self.records:
+            return mask
+
+        for parameter_index, parameter in enumerate(parameters):
+            column = self.column(parameter)
+            formula = parse_formula(
+                condition.formulas[parameter_index], column.param_type
+            )
+            mask &= column.mask(formula)
+        return mask
+
+    def filter(self, action_filter):
+        """Indexes of the records which pass the filter of an action"""
+        mask = self.condition_mask(
+            action_filter.parameters, action_filter.conditions[0]
+        )
+        return np.flatnonzero(mask)
+
+    def assign_rules(self, rules, indexes=None):
+        """
+        Indexes of the records which satisfy each rule condition, i.e. the
+        first condition of the rule that they pass, or its catch-all otherwise.
+        If the indexes of a subset of the records are given, the assignment
+        refers to positions within that subset
+        """
+        if indexes is None:
+            indexes = np.arange(len(self.records))
+
+        populated_rules = defaultdict(set)
+        if not len(indexes):
+            return populated_rules
+
+        for rule in rules:
+            unassigned = np.ones(len(indexes), dtype=bool)
+
+            for condition in rule.conditions:
+                mask = self.condition_mask(rule.parameters, condition)
+                matched = unassigned & mask[indexes]
+                if matched.any():
+                    populated_rules[condition.conditionId].update(
+                        np.flatnonzero(matched).tolist()
+                    )
+                unassigned &= ~matched
+
+            if unassigned.any():
+                populated_rules[rule.catchAll].update(np.flatnonzero(unassigned).tolist())
+
+        return populated_rules
@@ -1,7 +1,48 @@
 from rest_framework import serializers
 from rest_framework_mongoengine.serializers import DocumentSerializer
 
-from .models import Workflow
+from bson.objectid import ObjectId
+
+from .models import Workflow, EmailJob, Email
+from .tracking import tracking_totals
+
+
+def add_tracking(emails):
+    """
+    Add the totals of the tracking events of each email to serialized emails.
+    Emails which were tracked before the events were recorded separately also
+    keep the totals stored on the email itself
+    """
+    totals = tracking_totals({ObjectId(email["job_id"]) for email in emails})
+    if not totals:
+        return emails
+
+    date_field = serializers.DateTimeField()
+    for email in emails:
+        total = totals.get(email.get("email_id"))
+        if not total:
+            continue
+
+        track_count = total.get("track_count", 0)
+        if track_count:
+            previous_count = email.get("track_count") or 0
+            if not email.get("first_tracked"):
+                email["first_tracked"] = date_field.to_representation(
+                    total["first_tracked"]
+                )
+            # Only opens after the first one are recorded as the last open
+            if previous_count + track_count > 1:
+                email["last_tracked"] = date_field.to_representation(
+                    total["last_tracked"]
+                )
+            email["track_count"] = previous_count + track_count
+
+        link_clicks = dict(email.get("link_clicks") or {})
+        for link, clicks in total.get("link_clicks", {}).items():
+            link_clicks[link] = link_clicks.get(link, 0) + clicks
+        email["link_clicks"] = link_clicks
+
+    return emails
 
 
 class ActionSerializer(DocumentSerializer):
@@ -13,3 +54,15 @@ class ActionSerializer(DocumentSerializer):
     class Meta:
         model = Workflow
         fields = "__all__"
+
+
+class EmailJobSerializer(DocumentSerializer):
+    class Meta:
+        model = EmailJob
+        exclude = ["action"]
+
+
+class EmailSerializer(DocumentSerializer):
+    class Meta:
+        model = Email
+        exclude = ["action", "content"]
@@ -0,0 +1,265 @@
+"""
+Compiled action content
+
+The content of an action is parsed once into a tree of nodes (static text,
+condition blocks, attribute slots and hyperlinks), with the field lookups of
+each attribute resolved up front. Each record is then rendered by walking the
+tree, rather than running the regex passes of workflow.utils over the whole
+content for every record.
+"""
+from bson.objectid import ObjectId
+from datetime import datetime, timedelta
+import re
+
+import jwt
+
+from ontask.settings import SECRET_KEY, BACKEND_DOMAIN, FRONTEND_DOMAIN
+
+CONDITION_TAG = re.compile(
+    r"<condition conditionid=\"(.*?)\" ruleid=\"(.*?)\"(?: label=\"else\")?>|<\/condition>"
+)
+ATTRIBUTE = re.compile(
+    r"<attribute>((?:<(?:strong|em|u|pre|code|span.*?)>)*)(.*?)((?:</(?:strong|em|u|pre|code|span)>)*)</attribute>"
+)
+# Both the old style of link (a single param and field) and the new style
+# (a list of params) are matched, so each link is parsed by its own style
+HYPERLINK = re.compile(
+    r"<hyperlink href=\"(.*?)\"(?: param=\"(.*?)\" field=\"(.*?)\"| params=\"(.*?)\")>((?:<(?:strong|em|u|pre|code|span.*?)>)*)(.*?)((?:</(?:strong|em|u|pre|code|span)>)*)</hyperlink>"
+)
+LABEL = re.compile(
+    r"((?:<(?:strong|em|u|pre|code|span.*?)>)*)(.*?)((?:</(?:strong|em|u|pre|code|span)>)*)$"
+)
+STRIPPED_TAGS = re.compile(r"(<\s*\/?\s*)(?:condition|rule)(\s*([^>]*)?\s*>)")
+
+TEXT, CONDITION, FIELD, FORM_LINK, HYPERLINK_NODE = range(5)
+
+
+def simple_link(href, label):
+    return f'<a href="{href}">{label}</a>'
+
+
+def tracking_link(action_id, job_id, email_id):
+    """Renders links which redirect through the link click tracking endpoint"""
+
+    def render(href, label):
+        tracking_token = jwt.encode(
+            {
+                "action_id": str(action_id),
+                "job_id": str(job_id),
+                "email_id": str(email_id),
+                "href": str(href),
+            },
+            SECRET_KEY,
+            algorithm="HS256",
+        ).decode("utf-8")
+        tracking_link = f"{BACKEND_DOMAIN}/workflow/link_click/?token={tracking_token}"
+
+        return f'<a href="{tracking_link}">{label}</a>'
+
+    return render
+
+
+class Template:
+    def __init__(self, content, order, forms):
+        self.order = order
+        self.forms = {}
+        for form in forms:
+            self.forms.setdefault(form.name, form)
+
+        self.nodes = self.compile_conditions(content)
+
+    def compile_conditions(self, content):
+        root = []
+        # Open condition blocks, as (condition id, children, parent)
+        stack = []
+        children = root
+        position = 0
+
+        for match in CONDITION_TAG.finditer(content):
+            children.extend(self.compile_text(content[position : match.start()]))
+            position = match.end()
+
+            if match.group(1) is not None:
+                block = []
+                stack.append((match.group(1), block, children))
+                children = block
+            elif stack:
+                condition_id, block, children = stack.pop()
+                try:
+                    condition_id = ObjectId(condition_id)
+                except:
+                    condition_id = None
+                children.append((CONDITION, condition_id, block))
+
+        children.extend(self.compile_text(content[position:]))
+
+        # Blocks which are never closed are shown unconditionally
+        while stack:
+            _, block, children = stack.pop()
+            children.extend(block)
+
+        return root
+
+    def compile_text(self, text):
+        text = STRIPPED_TAGS.sub("", text)
+
+        nodes = []
+        position = 0
+        for match in HYPERLINK.finditer(text):
+            nodes.extend(self.compile_attributes(text[position : match.start()]))
+            position = match.end()
+
+            href, param, field, params, _, label, _ = match.groups()
+            if params is None:
+                query = [("?", param, field)] if param and field else []
+            else:
+                query = []
+                for index, current_param in enumerate(re.split(r"\?", params)):
+                    if current_param == "":
+                        continue
+                    if current_param.count("=") != 1:
+                        continue
+                    param, field = current_param.split("=")
+                    if param and field:
+                        query.append(("?" if index == 1 else "&", param, field))
+
+            nodes.append(
+                (
+                    HYPERLINK_NODE,
+                    href,
+                    query,
+                    self.compile_attributes(label),
+                    # The link as written, for content which isn't sent yet
+                    self.compile_attributes(match.group(0)),
+                )
+            )
+
+        nodes.extend(self.compile_attributes(text[position:]))
+        return nodes
+
+    def compile_attributes(self, text):
+        nodes = []
+        position = 0
+        for match in ATTRIBUTE.finditer(text):
+            if match.start() > position:
+                nodes.append((TEXT, text[position : match.start()]))
+            position = match.end()
+
+            prefix, _, field = match.group(2).partition(":")
+            if prefix == "link":
+                # Anonymous Form Link
+                form = self.forms.get(field)
+                if form is not None and form.emailAccess:
+                    nodes.append((FORM_LINK, form))
+            elif prefix == "field":
+                nodes.append(
+                    (
+                        FIELD,
+                        field,
+                        self.field_formatters(field),
+                        match.group(1),
+                        match.group(3),
+                    )
+                )
+
+        if position < len(text):
+            nodes.append((TEXT, text[position:]))
+        return nodes
+
+    def field_formatters(self, field):
+        """Formatting applied to the value of a field, by its column types"""
+        formatters = []
+        for item in self.order:
+            if item["details"]["label"] == field:
+                if item["details"]["field_type"] == "checkbox":
+                    formatters.append(("checkbox", None))
+
+                elif item["details"]["field_type"] == "list":
+                    mapping = {
+                        option["value"]: option["label"]
+                        for option in item["details"]["options"]
+                    }
+                    formatters.append(("list", mapping))
+
+            elif field in item["details"].get("fields", []):
+                formatters.append(("checkbox", None))
+
+        return formatters
+
+    def render(self, item_index, item, rules, links=None):
+        """
+        Content for a single record, given the records assigned to each rule
+        condition. Hyperlinks are rendered by links(href, label), or kept as
+        they are written if no renderer is given
+        """
+        output = []
+        self.render_nodes(self.nodes, item_index, item, rules, links, output)
+        return "".join(output)
+
+    def render_nodes(self, nodes, item_index, item, rules, links, output):
+        for node in nodes:
+            node_type = node[0]
+
+            if node_type == TEXT:
+                output.append(node[1])
+
+            elif node_type == CONDITION:
+                if item_index in rules.get(node[1], ()):
+                    self.render_nodes(node[2], item_index, item, rules, links, output)
+
+            elif node_type == FIELD:
+                output.append(node[3] + self.format_field(item, node) + node[4])
+
+            elif node_type == FORM_LINK:
+                output.append(self.form_link(item, node[1]))
+
+            elif node_type == HYPERLINK_NODE:
+                _, href, query, label, raw = node
+                if links is None:
+                    self.render_nodes(raw, item_index, item, rules, links, output)
+                    continue
+
+                for separator, param, field in query:
+                    href += f"{separator}{param}={item.get(field)}"
+
+                label_output = []
+                self.render_nodes(label, item_index, item, rules, links, label_output)
+                label = "".join(label_output)
+
+                # Styles around the values of attributes aren't kept in links
+                styled = LABEL.match(label)
+                if styled:
+                    label = styled.group(2)
+
+                output.append(links(href, label))
+
+    def format_field(self, item, node):
+        _, field, formatters, _, _ = node
+        value = item.get(field)
+
+        for formatter, mapping in formatters:
+            if formatter == "checkbox":
+                value = value if value else "False"
+            else:
+                if not isinstance(value, list):
+                    value = [value]
+                value = [mapping.get(value, "") for value in value]
+
+        if isinstance(value, list):
+            value = ", ".join(value if value else "")
+        elif not isinstance(value, str):
+            value = str(value)
+
+        return value
+
+    def form_link(self, item, form):
+        email = item.get(form.permission)
+
+        iat = datetime.utcnow()
+        exp = iat + timedelta(days=90)
+        token = jwt.encode(
+            {"email": email, "iat": iat, "exp": exp}, SECRET_KEY, algorithm="HS256"
+        ).decode()
+        link = f"{FRONTEND_DOMAIN}/form/{form.id}/?token={token}"
+
+        return f"<a href={link}>{link}</a>"
@@ -0,0 +1,52 @@
+from bson import ObjectId
+import pytest
+
+from workflow.models import Condition, Formula, Rule, Workflow
+
+STUDENTS = [
+    {"zid": "z1", "name": "Ada", "mark": 80, "submitted": True, "due": "2020-03-02"},
+    {"zid": "z2", "name": "Alan", "mark": 20, "submitted": False, "due": "2020-03-09"},
+    {"zid": "z3", "name": "Grace", "mark": None, "submitted": None, "due": None},
+    {"zid": "z4", "name": "Edsger", "mark": "50", "submitted": True, "due": "bad"},
+]
+
+TYPES = {
+    "zid": "text",
+    "name": "text",
+    "mark": "number",
+    "submitted": "checkbox",
+    "due": "date",
+}
+
+
+@pytest.fixture
+def datalab(make_datalab):
+    return make_datalab(STUDENTS, types=TYPES)
+
+
+def rule(parameter, *conditions, catch_all=None):
+    return Rule(
+        name=parameter,
+        parameters=[parameter],
+        conditions=[
+            Condition(conditionId=condition_id, formulas=[Formula(**formula)])
+            for condition_id, formula in conditions
+        ],
+        catchAll=catch_all or ObjectId(),
+    )
+
+
+@pytest.fixture
+def action(container, datalab):
+    return Workflow(
+        container=container,
+        datalab=datalab,
+        name="Feedback",
+        rules=[
+            rule(
+                "mark",
+                (ObjectId(), {"operator": ">=", "comparator": "50"}),
+                (ObjectId(), {"operator": "<", "comparator": "50"}),
+            )
+        ],
+    ).save()
@@ -0,0 +1,187 @@
+from bson import ObjectId
+import pytest
+
+from workflow.models import Condition, Filter, Formula
+from workflow.rules import RuleEngine
+
+from .conftest import rule
+
+VALUES = {
+    "number": [80, 20, None, "50", "abc", 0, 50.5, ""],
+    "date": ["2020-03-02", "2020-03-09", None, "bad", "2020-03-05", ""],
+    "text": ["Ada", "ada", None, "", "Alan", 5],
+    "checkbox": [True, False, None],
+    # Fields without a type, such as the columns of a checkbox group
+    None: [["A", "b"], ["c"], None, [], "abc"],
+}
+
+# Expected values are those of the baseline, which called did_pass_test for
+# each record in turn
+CASES = [
+    ("number", {"operator": "==", "comparator": "50"}, [0, 0, 0, 1, 0, 0, 0, 0]),
+    ("number", {"operator": "!=", "comparator": "50"}, [1, 1, 1, 0, 1, 1, 1, 1]),
+    ("number", {"operator": "<", "comparator": "50"}, [0, 1, 0, 0, 0, 1, 0, 0]),
+    ("number", {"operator": "<=", "comparator": "50"}, [0, 1, 0, 1, 0, 1, 0, 0]),
+    ("number", {"operator": ">", "comparator": "50"}, [1, 0, 0, 0, 0, 0, 1, 0]),
+    ("number", {"operator": ">=", "comparator": "50"}, [1, 0, 0, 1, 0, 0, 1, 0]),
+    ("number", {"operator": ">", "comparator": "abc"}, [0, 0, 0, 0, 0, 0, 0, 0]),
+    # A comparator which isn't a number is only equal to the missing values
+    ("number", {"operator": "==", "comparator": "abc"}, [0, 0, 1, 0, 1, 0, 0, 1]),
+    ("number", {"operator": "!=", "comparator": "abc"}, [1, 1, 0, 1, 0, 1, 1, 0]),
+    (
+        "number",
+        {"operator": "between", "rangeFrom": "20", "rangeTo": "50"},
+        [0, 1, 0, 1, 0, 0, 0, 0],
+    ),
+    ("number", {"operator": "between", "rangeFrom": "20"}, [0, 0, 0, 0, 0, 0, 0, 0]),
+    ("number", {"operator": "IS_NULL"}, [0, 0, 1, 0, 1, 0, 0, 1]),
+    ("number", {"operator": "IS_NOT_NULL"}, [1, 1, 0, 1, 0, 1, 1, 0]),
+    ("number", {"operator": "IS_TRUE"}, [1, 1, 0, 1, 0, 0, 1, 0]),
+    ("number", {"operator": "<"}, [0, 0, 0, 0, 0, 0, 0, 0]),
+    ("date", {"operator": "==", "comparator": "2020-03-02"}, [1, 0, 0, 0, 0, 0]),
+    ("date", {"operator": "<", "comparator": "2020-03-05"}, [1, 0, 0, 0, 0, 0]),
+    ("date", {"operator": ">=", "comparator": "2020-03-05"}, [0, 1, 0, 0, 1, 0]),
+    ("date", {"operator": "!=", "comparator": "2020-03-05"}, [1, 1, 1, 1, 0, 1]),
+    # The baseline transformed the range in place, so that only the first
+    # record was compared against it; the range now applies to every record
+    (
+        "date",
+        {"operator": "between", "rangeFrom": "2020-03-01", "rangeTo": "2020-03-05"},
+        [1, 0, 0, 0, 1, 0],
+    ),
+    ("date", {"operator": "IS_NULL"}, [0, 0, 1, 1, 0, 1]),
+    ("date", {"operator": "IS_NOT_NULL"}, [1, 1, 0, 0, 1, 0]),
+    ("text", {"operator": "==", "comparator": "Ada"}, [1, 0, 0, 0, 0, 0]),
+    ("text", {"operator": "!=", "comparator": "Ada"}, [0, 1, 1, 1, 1, 1]),
+    ("text", {"operator": "<", "comparator": "B"}, [1, 0, 0, 1, 1, 0]),
+    ("text", {"operator": "contains", "comparator": "A"}, [1, 1, 0, 0, 1, 0]),
+    ("text", {"operator": "IS_NULL"}, [0, 0, 1, 1, 0, 0]),
+    ("text", {"operator": "IS_NOT_NULL"}, [1, 1, 0, 0, 1, 1]),
+    ("text", {"operator": "IS_TRUE"}, [1, 1, 0, 0, 1, 1]),
+    ("checkbox", {"operator": "IS_TRUE"}, [1, 0, 0]),
+    ("checkbox", {"operator": "IS_FALSE"}, [1, 0, 0]),
+    ("checkbox", {"operator": "==", "comparator": True}, [1, 0, 0]),
+    ("checkbox", {"operator": "IS_NULL"}, [0, 0, 1]),
+    (None, {"operator": "contains", "comparator": "a"}, [1, 0, 0, 0, 1]),
+    (None, {"operator": "contains", "comparator": "C"}, [0, 1, 0, 0, 1]),
+    (None, {"operator": "IS_NOT_NULL"}, [1, 1, 0, 1, 1]),
+]
+
+
+def condition(**formula):
+    return Condition(formulas=[Formula(**formula)])
+
+
+@pytest.mark.parametrize("param_type,formula,expected", CASES)
+def test_condition_mask(param_type, formula, expected):
+    engine = RuleEngine(
+        [{"value": value} for value in VALUES[param_type]], {"value": param_type}
+    )
+
+    mask = engine.condition_mask(["value"], condition(**formula))
+    assert mask.tolist() == [bool(passed) for passed in expected]
+
+
+def test_condition_with_several_parameters():
+    engine = RuleEngine(
+        [{"mark": 80, "name": "Ada"}, {"mark": 90, "name": "Alan"}, {"name": "Ada"}],
+        {"mark": "number", "name": "text"},
+    )
+    condition = Condition(
+        formulas=[
+            Formula(operator=">=", comparator="50"),
+            Formula(operator="==", comparator="Ada"),
+        ]
+    )
+
+    assert engine.condition_mask(["mark", "name"], condition).tolist() == [
+        True,
+        False,
+        False,
+    ]
+
+
+def test_missing_field_is_null():
+    engine = RuleEngine([{"zid": "z1"}, {"zid": "z2"}], {"mark": "number"})
+
+    assert engine.condition_mask(["mark"], condition(operator="IS_NULL")).all()
+    mask = engine.condition_mask(["mark"], condition(operator=">", comparator="0"))
+    assert not mask.any()
+
+
+def test_filter():
+    engine = RuleEngine(
+        [{"mark": mark} for mark in VALUES["number"]], {"mark": "number"}
+    )
+    action_filter = Filter(
+        parameters=["mark"], conditions=[condition(operator=">=", comparator="50")]
+    )
+
+    assert engine.filter(action_filter).tolist() == [0, 3, 6]
+
+
+def test_assign_rules():
+    passed, failed, catch_all = ObjectId(), ObjectId(), ObjectId()
+    engine = RuleEngine(
+        [{"mark": mark} for mark in VALUES["number"]], {"mark": "number"}
+    )
+
+    populated_rules = engine.assign_rules(
+        [
+            rule(
+                "mark",
+                # Records which pass several conditions are assigned the first
+                (passed, {"operator": ">=", "comparator": "20"}),
+                (failed, {"operator": "<", "comparator": "50"}),
+                catch_all=catch_all,
+            )
+        ]
+    )
+
+    assert populated_rules == {
+        passed: {0, 1, 3, 6},
+        failed: {5},
+        catch_all: {2, 4, 7},
+    }
+
+
+def test_assign_rules_to_filtered_records():
+    passed, catch_all = ObjectId(), ObjectId()
+    engine = RuleEngine(
+        [{"mark": mark} for mark in VALUES["number"]], {"mark": "number"}
+    )
+
+    # Records are assigned by their position amongst the filtered records
+    populated_rules = engine.assign_rules(
+        [
+            rule(
+                "mark",
+                (passed, {"operator": ">", "comparator": "50"}),
+                catch_all=catch_all,
+            )
+        ],
+        indexes=[3, 6, 0],
+    )
+
+    assert populated_rules == {passed: {1, 2}, catch_all: {0}}
+
+
+def test_empty_records():
+    engine = RuleEngine([], {"mark": "number"})
+    action_filter = Filter(
+        parameters=["mark"], conditions=[condition(operator=">=", comparator="50")]
+    )
+
+    assert engine.filter(action_filter).tolist() == []
+    rules = [rule("mark", (ObjectId(), {"operator": "IS_NULL"}))]
+    assert engine.assign_rules(rules) == {}
+
+
+def test_render_snapshot(action):
+    rule = action.rules[0]
+    passed, failed = [condition.conditionId for condition in rule.conditions]
+
+    snapshot = action.render_snapshot()
+
+    assert [record["zid"] for record in snapshot["records"]] == ["z1", "z2", "z3", "z4"]
+    assert snapshot["rules"] == {passed: {0, 3}, failed: {1}, rule.catchAll: {2}}
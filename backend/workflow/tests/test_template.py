@@ -0,0 +1,99 @@
+import pytest
+
+from workflow.models import Condition, Filter, Formula
+
+OLD_LINK = (
+    '<hyperlink href="https://ontask.org" param="id" field="zid">'
+    "<strong>Old link</strong></hyperlink>"
+)
+NEW_LINK = (
+    '<hyperlink href="https://ontask.org/a" params="?x=zid?y=name">'
+    "<em>New link</em></hyperlink>"
+)
+
+
+def content(action, link):
+    rule = action.rules[0]
+    passed, failed = [condition.conditionId for condition in rule.conditions]
+    return (
+        "<p>Hi <attribute><strong>field:name</strong></attribute>,</p>"
+        f'<condition conditionid="{passed}" ruleid="{rule.ruleId}">'
+        "<p>You passed with <attribute>field:mark</attribute></p></condition>"
+        f'<condition conditionid="{failed}" ruleid="{rule.ruleId}">'
+        "<p>You failed</p></condition>"
+        f'<condition conditionid="{rule.catchAll}" ruleid="{rule.ruleId}">'
+        "<p>No mark</p></condition>"
+        "<p>Submitted: <attribute>field:submitted</attribute>, "
+        "due <attribute><em>field:due</em></attribute></p>"
+        f"<p>{link}</p>"
+        "<p><attribute>field:missing</attribute></p>"
+    )
+
+
+# Expected values are those of the baseline, which ran the regex passes over
+# the content of each record in turn
+GREETINGS = [
+    "<p>Hi <strong>Ada</strong>,</p><p>You passed with 80</p>"
+    "<p>Submitted: True, due <em>2020-03-02</em></p>",
+    "<p>Hi <strong>Alan</strong>,</p><p>You failed</p>"
+    "<p>Submitted: False, due <em>2020-03-09</em></p>",
+    "<p>Hi <strong>Grace</strong>,</p><p>No mark</p>"
+    "<p>Submitted: False, due <em>None</em></p>",
+    "<p>Hi <strong>Edsger</strong>,</p><p>You passed with 50</p>"
+    "<p>Submitted: True, due <em>bad</em></p>",
+]
+
+LINKS = {
+    "old": [
+        '<a href="https://ontask.org?id=z1">Old link</a>',
+        '<a href="https://ontask.org?id=z2">Old link</a>',
+        '<a href="https://ontask.org?id=z3">Old link</a>',
+        '<a href="https://ontask.org?id=z4">Old link</a>',
+    ],
+    "new": [
+        '<a href="https://ontask.org/a?x=z1&y=Ada">New link</a>',
+        '<a href="https://ontask.org/a?x=z2&y=Alan">New link</a>',
+        '<a href="https://ontask.org/a?x=z3&y=Grace">New link</a>',
+        '<a href="https://ontask.org/a?x=z4&y=Edsger">New link</a>',
+    ],
+}
+
+
+@pytest.mark.parametrize("style", LINKS)
+def test_populate_content(action, style):
+    link = OLD_LINK if style == "old" else NEW_LINK
+
+    assert action.populate_content(content(action, link)) == [
+        f"{greeting}<p>{link}</p><p>None</p>"
+        for greeting, link in zip(GREETINGS, LINKS[style])
+    ]
+
+
+def test_links_are_kept_for_emails(action):
+    # The links are rewritten with tracking once each email is sent
+    assert action.populate_content(content(action, OLD_LINK), email=True) == [
+        f"{greeting}<p>{OLD_LINK}</p><p>None</p>" for greeting in GREETINGS
+    ]
+
+
+def test_saved_content_is_used_by_default(action):
+    action.content = content(action, NEW_LINK)
+
+    assert action.populate_content() == action.populate_content(
+        content(action, NEW_LINK)
+    )
+
+
+def test_action_without_content(action):
+    assert action.populate_content() == []
+
+
+def test_no_records_pass_the_filter(action):
+    action.filter = Filter(
+        parameters=["name"],
+        conditions=[
+            Condition(formulas=[Formula(operator="==", comparator="Barbara")])
+        ],
+    )
+
+    assert action.populate_content(content(action, OLD_LINK)) == []
@@ -0,0 +1,125 @@
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+import pytest
+
+from workflow import tracking
+from workflow.tracking import (
+    EmailTracking,
+    TrackingBuffer,
+    TrackingEvent,
+    link_key,
+    tracking_totals,
+    write_events,
+)
+
+ACTION, JOB = ObjectId(), ObjectId()
+
+
+def event(type, email_id="ada@ontask.org", link=None):
+    return {
+        "_id": ObjectId(),
+        "action": ACTION,
+        "job_id": JOB,
+        "email_id": email_id,
+        "type": type,
+        "timestamp": datetime(2020, 3, 2),
+        "link": link,
+    }
+
+
+EVENTS = [
+    event("read"),
+    event("read"),
+    event("click", link="https://ontask.org/a?x=1"),
+    event("read", email_id="alan@ontask.org"),
+]
+
+
+def totals():
+    return {
+        email_id: (total.get("track_count"), total.get("link_clicks"))
+        for email_id, total in tracking_totals([JOB]).items()
+    }
+
+
+@pytest.mark.parametrize(
+    "href,key",
+    [
+        ("https://ontask.org/a?x=1", "https://ontask(dot)org/a"),
+        ("$where", "(dollar)where"),
+        ("", "(empty)"),
+        ("?x=1", "(empty)"),
+        (None, "(empty)"),
+    ],
+)
+def test_link_key(href, key):
+    assert link_key(href) == key
+
+
+def test_write_events():
+    write_events(EVENTS, ObjectId())
+
+    assert TrackingEvent.objects.count() == 4
+    assert totals() == {
+        "ada@ontask.org": (2, {"https://ontask(dot)org/a": 1}),
+        "alan@ontask.org": (1, None),
+    }
+
+
+def test_batch_is_only_counted_once():
+    batch_id = ObjectId()
+    write_events(EVENTS, batch_id)
+    write_events(EVENTS, batch_id)
+    write_events([event("read")], ObjectId())
+
+    assert TrackingEvent.objects.count() == 5
+    assert totals()["ada@ontask.org"] == (3, {"https://ontask(dot)org/a": 1})
+
+
+def test_failed_batch_is_written_again(monkeypatch):
+    buffer = TrackingBuffer(interval=60, size=100)
+    buffer.events = list(EVENTS)
+    failures = iter([PyMongoError("Connection lost")])
+
+    def flaky_write_events(events, batch_id):
+        write_events(events, batch_id)
+        # The events were stored, but the failure is only noticed afterwards
+        error = next(failures, None)
+        if error:
+            raise error
+
+    monkeypatch.setattr(tracking, "write_events", flaky_write_events)
+
+    buffer.flush()
+    assert [attempts for _, _, attempts in buffer.failed] == [1]
+
+    buffer.events = [event("read", email_id="alan@ontask.org")]
+    buffer.flush()
+
+    assert buffer.failed == []
+    assert totals() == {
+        "ada@ontask.org": (2, {"https://ontask(dot)org/a": 1}),
+        "alan@ontask.org": (2, None),
+    }
+
+
+def test_failed_batch_is_dropped(monkeypatch):
+    buffer = TrackingBuffer(interval=60, size=100)
+    buffer.events = list(EVENTS)
+
+    def write_events(events, batch_id):
+        raise PyMongoError("Connection lost")
+
+    monkeypatch.setattr(tracking, "write_events", write_events)
+
+    for attempt in range(tracking.MAX_WRITE_ATTEMPTS - 1):
+        buffer.flush()
+    assert [attempts for _, _, attempts in buffer.failed] == [
+        tracking.MAX_WRITE_ATTEMPTS - 1
+    ]
+
+    buffer.flush()
+    assert buffer.failed == []
+    assert not EmailTracking.objects.count()
@@ -0,0 +1,309 @@
+"""
+Tracking of the emails sent by actions
+
+Read receipts and link clicks are appended to their own collection, and the
+totals of each email are kept up to date with atomic updates, instead of
+rewriting the whole action document for every event. Events are buffered by
+each process and written in bulk, so that the burst of opens after a job is
+sent only costs a few writes.
+"""
+from mongoengine import Document
+from mongoengine.fields import (
+    ReferenceField,
+    StringField,
+    DateTimeField,
+    IntField,
+    DictField,
+    ListField,
+    ObjectIdField,
+)
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from datetime import datetime
+from collections import defaultdict
+import threading
+import atexit
+import os
+
+from .models import Workflow, Email
+
+from ontask.settings import TRACKING_FLUSH_INTERVAL, TRACKING_BUFFER_SIZE
+
+import logging
+
+logger = logging.getLogger("ontask")
+
+DUPLICATE_KEY = 11000
+
+# Number of times that a batch of events is written, before it is dropped
+MAX_WRITE_ATTEMPTS = 3
+
+# Number of the latest batches added to the totals of an email which are kept,
+# so that a batch which is written again isn't counted twice
+APPLIED_BATCHES = 50
+
+
+class TrackingEvent(Document):
+    """A read receipt or link click of an email"""
+
+    # Cascade delete if action is deleted
+    action = ReferenceField(Workflow, required=True, reverse_delete_rule=2)
+    job_id = ObjectIdField(required=True)
+    email_id = StringField(required=True)
+    type = StringField(required=True, choices=("read", "click"))
+    timestamp = DateTimeField(default=datetime.utcnow)
+    link = StringField(null=True)
+
+    meta = {"indexes": [("job_id", "email_id"), "action"]}
+
+
+class EmailTracking(Document):
+    """Totals of the tracking events of an email"""
+
+    # Cascade delete if action is deleted
+    action = ReferenceField(Workflow, required=True, reverse_delete_rule=2)
+    job_id = ObjectIdField(required=True)
+    email_id = StringField(required=True)
+    track_count = IntField(default=0)
+    first_tracked = DateTimeField()
+    last_tracked = DateTimeField()
+    link_clicks = DictField()
+    # Batches of events which have been added to the totals (see write_events)
+    batches = ListField(ObjectIdField())
+
+    meta = {
+        "indexes": [
+            {"fields": ("job_id", "email_id"), "unique": True},
+            "action",
+        ]
+    }
+
+
+def link_key(href):
+    # Dots aren't allowed in the keys of documents, and neither are empty keys
+    # or keys starting with a dollar sign
+    key = str(href or "").split("?")[0].replace(".", "(dot)").replace("\0", "")
+    if key.startswith("$"):
+        key = "(dollar)" + key[1:]
+    return key or "(empty)"
+
+
+def duplicate_errors(error):
+    """Indexes of the writes of a bulk write which failed as duplicates"""
+    return [
+        write_error["index"]
+        for write_error in error.details["writeErrors"]
+        if write_error["code"] == DUPLICATE_KEY
+    ]
+
+
+def write_events(events, batch_id):
+    """
+    Store tracking events, and add them to the totals of their emails. The
+    events of the same email are coalesced into a single update
+
+    Writing the same batch again after a failure has no further effect: the
+    events keep their ids, and the totals of an email record the batches which
+    have been added to them
+    """
+    try:
+        TrackingEvent._get_collection().insert_many(
+            [dict(event) for event in events], ordered=False
+        )
+    except BulkWriteError as error:
+        # Some of the events were stored by an earlier attempt
+        if len(duplicate_errors(error)) < len(error.details["writeErrors"]):
+            raise
+
+    updates = {}
+    for event in events:
+        key = (event["job_id"], event["email_id"])
+        if key not in updates:
+            updates[key] = {
+                "$inc": {},
+                "$setOnInsert": {"action": event["action"]},
+                "$push": {
+                    "batches": {"$each": [batch_id], "$slice": -APPLIED_BATCHES}
+                },
+            }
+        update = updates[key]
+
+        if event["type"] == "read":
+            update["$inc"]["track_count"] = update["$inc"].get("track_count", 0) + 1
+            update.setdefault("$min", {"first_tracked": event["timestamp"]})
+            update["$max"] = {"last_tracked": event["timestamp"]}
+        else:
+            field = f"link_clicks.{link_key(event['link'])}"
+            update["$inc"][field] = update["$inc"].get(field, 0) + 1
+
+    queries = [
+        {"job_id": job_id, "email_id": email_id, "batches": {"$ne": batch_id}}
+        for job_id, email_id in updates
+    ]
+    updates = list(updates.values())
+
+    collection = EmailTracking._get_collection()
+    try:
+        collection.bulk_write(
+            [
+                UpdateOne(query, update, upsert=True)
+                for query, update in zip(queries, updates)
+            ],
+            ordered=False,
+        )
+    except BulkWriteError as error:
+        # Other events of the same emails created their totals in the meantime,
+        # or an earlier attempt already added this batch to them
+        duplicates = duplicate_errors(error)
+        if len(duplicates) < len(error.details["writeErrors"]):
+            raise
+        collection.bulk_write(
+            [UpdateOne(queries[index], updates[index]) for index in duplicates],
+            ordered=False,
+        )
+
+
+class TrackingBuffer:
+    """
+    Events received by this process which are yet to be written. A background
+    thread writes them every interval, or as soon as the buffer is full.
+    Batches which fail to be written are kept, and written again with the next
+    flush
+    """
+
+    def __init__(self, interval, size):
+        self.interval = interval
+        self.size = size
+        self.events = []
+        # (batch id, events, attempts) of the batches which failed to be written
+        self.failed = []
+        self.lock = threading.Lock()
+        self.full = threading.Event()
+        self.thread = None
+        self.pid = None
+
+    def add(self, event):
+        with self.lock:
+            self.events.append(event)
+            is_full = len(self.events) >= self.size
+
+            # Threads don't survive a fork, so each worker process starts its own
+            if self.pid != os.getpid() or not self.thread.is_alive():
+                if self.pid is None:
+                    atexit.register(self.flush)
+                self.pid = os.getpid()
+                self.thread = threading.Thread(
+                    target=self.run, name="tracking-buffer", daemon=True
+                )
+                self.thread.start()
+
+        if is_full:
+            self.full.set()
+
+    def run(self):
+        while True:
+            self.full.wait(self.interval)
+            self.full.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            batches, self.failed = self.failed, []
+            if self.events:
+                batches.append((ObjectId(), self.events, 0))
+                self.events = []
+
+        for batch_id, events, attempts in batches:
+            try:
+                write_events(events, batch_id)
+            except Exception as error:
+                attempts += 1
+                dropped = attempts >= MAX_WRITE_ATTEMPTS
+                logger.error(
+                    "tracking.write_failed",
+                    extra={
+                        "events": len(events),
+                        "attempts": attempts,
+                        "dropped": dropped,
+                        "error": str(error),
+                    },
+                )
+                if not dropped:
+                    with self.lock:
+                        self.failed.append((batch_id, events, attempts))
+
+
+tracking_buffer = (
+    TrackingBuffer(TRACKING_FLUSH_INTERVAL, TRACKING_BUFFER_SIZE)
+    if TRACKING_FLUSH_INTERVAL
+    else None
+)
+
+
+def record_event(token, event_type, link=None):
+    """
+    Record a tracking event, given the decoded token of the email. Unless
+    buffering is disabled, the event is only written in the background
+    """
+    try:
+        event = {
+            "_id": ObjectId(),
+            "action": ObjectId(token["action_id"]),
+            "job_id": ObjectId(token["job_id"]),
+            "email_id": str(token["email_id"]),
+            "type": event_type,
+            "timestamp": datetime.utcnow(),
+            "link": link,
+        }
+    except (KeyError, TypeError, InvalidId):
+        return
+
+    if tracking_buffer:
+        tracking_buffer.add(event)
+    else:
+        write_events([event], ObjectId())
+
+
+def tracking_totals(job_ids):
+    """Totals of the tracking events of the emails of the given jobs, by email"""
+    totals = EmailTracking._get_collection().find(
+        {"job_id": {"$in": list(job_ids)}},
+        {"_id": False, "action": False, "job_id": False, "batches": False},
+    )
+    return {total["email_id"]: total for total in totals}
+
+
+def job_statistics(job_ids):
+    """Number of emails of each job, and how many of them have been opened"""
+    job_ids = list(job_ids)
+    statistics = {job_id: {"emailCount": 0, "trackedCount": 0} for job_id in job_ids}
+
+    counts = Email._get_collection().aggregate(
+        [
+            {"$match": {"job_id": {"$in": job_ids}}},
+            {"$group": {"_id": "$job_id", "count": {"$sum": 1}}},
+        ]
+    )
+    for count in counts:
+        statistics[count["_id"]]["emailCount"] = count["count"]
+
+    # Emails may have been opened before and/or after the tracking events were
+    # recorded separately
+    tracked = defaultdict(set)
+    opened = Email._get_collection().find(
+        {"job_id": {"$in": job_ids}, "first_tracked": {"$ne": None}},
+        {"_id": False, "job_id": True, "email_id": True},
+    )
+    totals = EmailTracking._get_collection().find(
+        {"job_id": {"$in": job_ids}, "track_count": {"$gt": 0}},
+        {"_id": False, "job_id": True, "email_id": True},
+    )
+    for email in [*opened, *totals]:
+        tracked[email["job_id"]].add(email["email_id"])
+
+    for job_id, email_ids in tracked.items():
+        statistics[job_id]["trackedCount"] = len(email_ids)
+
+    return statistics
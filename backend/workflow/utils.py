@@ -28,15 +28,40 @@ def transform(value, param_type):
         return None
 
 
-def did_pass_test(test, value, param_type):
-    value = transform(value, param_type)
-    if "comparator" in test:
-        comparator = transform(test["comparator"], param_type)
-    else:
-        test["rangeFrom"] = transform(test["rangeFrom"], param_type)
-        test["rangeTo"] = transform(test["rangeTo"], param_type)
+# Operators which can't be evaluated without a comparator
+COMPARATOR_OPERATORS = {"==", "!=", "<", "<=", ">", ">=", "contains"}
 
-    operator = test["operator"]
+
+def parse_formula(test, param_type):
+    """
+    Operator and transformed operands of a formula, which can be compared
+    against any number of (transformed) values
+    """
+    if "comparator" in test:
+        return {
+            "operator": test["operator"],
+            "has_comparator": True,
+            "comparator": transform(test["comparator"], param_type),
+            "rangeFrom": test["rangeFrom"],
+            "rangeTo": test["rangeTo"],
+        }
+
+    return {
+        "operator": test["operator"],
+        "has_comparator": False,
+        "comparator": None,
+        "rangeFrom": transform(test["rangeFrom"], param_type),
+        "rangeTo": transform(test["rangeTo"], param_type),
+    }
+
+
+def compare(formula, value):
+    """Whether a transformed value passes a parsed formula"""
+    operator = formula["operator"]
+    comparator = formula["comparator"]
+
+    if operator in COMPARATOR_OPERATORS and not formula["has_comparator"]:
+        return False
 
     try:
         if operator == "==":
@@ -58,7 +83,7 @@ def did_pass_test(test, value, param_type):
         elif operator == ">=":
             return value >= comparator
         elif operator == "between":
-            return value >= test["rangeFrom"] and value <= test["rangeTo"]
+            return value >= formula["rangeFrom"] and value <= formula["rangeTo"]
         elif operator == "contains":
             return comparator.lower() in (item.lower() for item in value)
         else:
@@ -67,6 +92,10 @@ def did_pass_test(test, value, param_type):
         return False
 
 
+def did_pass_test(test, value, param_type):
+    return compare(parse_formula(test, param_type), transform(value, param_type))
+
+
 def replace_link(match, item, order, action_id, job_id, email_id, style="new"):
     """Generates new HTML replacement string for attribute with the attribute value and mark styles"""
 
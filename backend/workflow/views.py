@@ -1,39 +1,88 @@
 from rest_framework.views import APIView
 from rest_framework_mongoengine import viewsets
+from rest_framework_mongoengine.generics import get_object_or_404
 from rest_framework_mongoengine.validators import ValidationError
 from rest_framework.decorators import detail_route, list_route
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
-from django.http import HttpResponse, JsonResponse, HttpResponseRedirect
+from django.http import (
+    HttpResponse,
+    JsonResponse,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
+from rest_framework.exceptions import NotFound
 from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST
 from mongoengine.queryset.visitor import Q
+from mongoengine.errors import DoesNotExist
 
 import os
 from json import dumps
 from datetime import datetime
 from bson import ObjectId
+from bson.errors import InvalidId
+from hashlib import md5
 import base64
 import jwt
+import csv
 
-from .serializers import ActionSerializer
+from .serializers import (
+    ActionSerializer,
+    EmailJobSerializer,
+    EmailSerializer,
+    add_tracking,
+)
 from .models import Workflow, EmailSettings, EmailJob, Email, Rule, Filter, Schedule
 from .permissions import WorkflowPermissions
+from .tracking import record_event, job_statistics
 
 from container.models import Container
 
 from scheduler.utils import create_task, delete_task
 
-from ontask.settings import SECRET_KEY, BACKEND_DOMAIN
+from ontask.settings import SECRET_KEY, BACKEND_DOMAIN, PAGE_SIZE, MAX_PAGE_SIZE
 
 import logging
 
 logger = logging.getLogger("ontask")
 
+# Number of emails read at once when exporting the email history of an action
+EXPORT_BATCH_SIZE = 500
+
 PIXEL_GIF_DATA = base64.b64decode(
     b"R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7"
 )
 
 
+def page_parameters(request, default=PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Offset and limit of a page, from the query parameters of a request"""
+    try:
+        offset = int(request.query_params.get("offset", 0))
+        limit = int(request.query_params.get("limit", default))
+    except ValueError:
+        raise ValidationError("The offset and limit must be integers")
+    if offset < 0 or limit < 1:
+        raise ValidationError("The offset and limit must be positive")
+
+    return offset, min(limit, maximum)
+
+
+def status_etag(status):
+    digest = md5(dumps(status, sort_keys=True, default=str).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def find_email(action, job_id, email_id):
+    """The job of an action and one of its emails, or None if they don't exist"""
+    try:
+        job = EmailJob.objects.get(job_id=ObjectId(job_id), action=action.id)
+        email = Email.objects.get(job_id=job.job_id, email_id=email_id)
+    except (InvalidId, TypeError, DoesNotExist):
+        return None, None
+
+    return job, email
+
+
 class WorkflowViewSet(viewsets.ModelViewSet):
     lookup_field = "id"
     serializer_class = ActionSerializer
@@ -213,6 +262,37 @@ class WorkflowViewSet(viewsets.ModelViewSet):
 
                 return Response(serializer.data)
 
+    @detail_route(methods=["get", "post"])
+    def preview(self, request, id=None):
+        """
+        A page of the populated content of the action, rendered on demand. The
+        stored content is previewed by GET, and user-provided content by POST
+        """
+        action = self.get_object()
+        self.check_object_permissions(request, action)
+
+        offset, limit = page_parameters(request)
+
+        # The recipient field is searched, unless another field is given
+        search = request.query_params.get("search")
+        field = request.query_params.get("field")
+        if not field and action.emailSettings:
+            field = action.emailSettings.field
+        if search and not field:
+            raise ValidationError("A field must be chosen to search by")
+
+        content = None
+        if request.method == "POST":
+            content = request.data.get("content")
+            if not isinstance(content, dict) or not isinstance(content.get("html"), str):
+                raise ValidationError("The content to preview must include its html")
+            content = content["html"]
+
+        preview = action.preview_content(
+            content, offset=offset, limit=limit, search=search, field=field
+        )
+        return Response(preview)
+
     @detail_route(methods=["put", "delete"])
     def schedule(self, request, id=None):
         action = self.get_object()
@@ -273,13 +353,139 @@ class WorkflowViewSet(viewsets.ModelViewSet):
 
     @detail_route(methods=["get"])
     def locked(self, request, id=None):
+        """
+        Lock state and progress of the current email job of the action. Only
+        these fields are read, and a client which already has the current
+        state (i.e. sends its ETag) gets a 304 Not Modified
+        """
+        action = get_object_or_404(
+            self.get_queryset().only("container", "emailLocked", "currentEmailJob"),
+            id=id,
+        )
+        self.check_object_permissions(self.request, action)
+
+        status = {"emailLocked": action.emailLocked, "status": action.currentEmailJob}
+        etag = status_etag(status)
+
+        if etag == request.META.get("HTTP_IF_NONE_MATCH"):
+            response = Response(status=304)
+        else:
+            response = Response(status)
+        response["ETag"] = etag
+        # The state is revalidated by the browser on every request
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
+    @detail_route(methods=["get"])
+    def email_jobs(self, request, id=None):
+        """A page of the email jobs of the action, most recent first"""
+        action = self.get_object()
+        self.check_object_permissions(self.request, action)
+
+        offset, limit = page_parameters(request)
+        jobs = EmailJob.objects(action=action.id).order_by("-initiated_at")
+        page = list(jobs.skip(offset).limit(limit))
+
+        statistics = job_statistics([job.job_id for job in page])
+        items = [
+            {**EmailJobSerializer(job).data, **statistics[job.job_id]} for job in page
+        ]
+
+        return Response(
+            {"items": items, "offset": offset, "limit": limit, "total": jobs.count()}
+        )
+
+    @detail_route(
+        methods=["get"], url_path=r"email_jobs/(?P<job_id>[0-9a-f]{24})/emails"
+    )
+    def job_emails(self, request, id=None, job_id=None):
+        """
+        A page of the emails of a job (without their content), optionally only
+        those whose recipient contains the search term
+        """
+        action = self.get_object()
+        self.check_object_permissions(self.request, action)
+
+        offset, limit = page_parameters(request)
+        emails = (
+            Email.objects(action=action.id, job_id=ObjectId(job_id))
+            .exclude("content")
+            .order_by("id")
+        )
+
+        search = request.query_params.get("search")
+        if search:
+            emails = emails.filter(recipient__icontains=search)
+
+        page = emails.skip(offset).limit(limit)
+        items = add_tracking(EmailSerializer(page, many=True).data)
+
+        return Response(
+            {"items": items, "offset": offset, "limit": limit, "total": emails.count()}
+        )
+
+    @detail_route(
+        methods=["get"],
+        url_path=r"email_jobs/(?P<job_id>[0-9a-f]{24})/emails/(?P<email_id>[0-9a-f]+)",
+    )
+    def job_email(self, request, id=None, job_id=None, email_id=None):
+        """The content of an email of a job"""
         action = self.get_object()
         self.check_object_permissions(self.request, action)
 
-        action = ActionSerializer(action).data
+        job, email = find_email(action, job_id, email_id)
+        if not email:
+            raise NotFound()
+
         return Response(
-            {"emailLocked": action["emailLocked"], "emailJobs": action["emailJobs"], "status": action["currentEmailJob"]}
+            {
+                "email_id": email.email_id,
+                "recipient": email.recipient,
+                "subject": job.subject,
+                "initiated_at": job.initiated_at,
+                "content": email.content,
+            }
+        )
+
+    @detail_route(methods=["get"])
+    def export_emails(self, request, id=None):
+        """Every email sent by the action as a CSV, written as it is read"""
+        action = self.get_object()
+        self.check_object_permissions(self.request, action)
+
+        columns = [
+            "recipient",
+            "track_count",
+            "first_tracked",
+            "last_tracked",
+            "content",
+            "subject",
+            "included_feedback",
+            "action_name",
+            "action_id",
+            "reply_to_email",
+            "reply_to_name",
+        ]
+
+        def rows():
+            yield columns
+            for job in EmailJob.objects(action=action.id).order_by("initiated_at"):
+                emails = Email.objects(job_id=job.job_id).order_by("id").no_cache()
+                batch = []
+                for email in emails:
+                    batch.append(email)
+                    if len(batch) == EXPORT_BATCH_SIZE:
+                        yield from export_rows(action, job, batch, columns)
+                        batch = []
+                yield from export_rows(action, job, batch, columns)
+
+        writer = csv.writer(Echo())
+        response = StreamingHttpResponse(
+            (writer.writerow(row) for row in rows()), content_type="text/csv"
         )
+        response["Content-Disposition"] = f"attachment; filename={action.name}.csv"
+        response["Access-Control-Expose-Headers"] = "Content-Disposition"
+        return response
 
     @list_route(methods=["get"], permission_classes=[AllowAny])
     def read_receipt(self, request):
@@ -293,24 +499,9 @@ class WorkflowViewSet(viewsets.ModelViewSet):
                 # Invalid token, ignore the read receipt
                 return HttpResponse(PIXEL_GIF_DATA, content_type="image/gif")
 
-            action = Workflow.objects.get(id=decrypted_token["action_id"])
-
-            did_update = False
-            for job in action.emailJobs:
-                if str(job.job_id) == decrypted_token["job_id"]:
-                    for email in job.emails:
-                        if email.email_id == decrypted_token["email_id"]:
-                            if not email.first_tracked:
-                                email.first_tracked = datetime.utcnow()
-                            else:
-                                email.last_tracked = datetime.utcnow()
-                            email.track_count += 1
-                            did_update = True
-                            break
-                    break
-
-            if did_update:
-                action.save()
+            # Recorded without loading the action, as emails are often opened
+            # many times at once after they are sent
+            record_event(decrypted_token, "read")
 
         return HttpResponse(PIXEL_GIF_DATA, content_type="image/gif")
 
@@ -326,27 +517,7 @@ class WorkflowViewSet(viewsets.ModelViewSet):
                 # Invalid token, ignore the read receipt
                 return HttpResponse()
 
-            action = Workflow.objects.get(id=decrypted_token["action_id"])
-            print("decrypted token: ", decrypted_token)
-            did_update = False
-            for job in action.emailJobs:
-                if str(job.job_id) == decrypted_token["job_id"]:
-                    for email in job.emails:
-                        if email.email_id == decrypted_token["email_id"]:
-                            baseURL = decrypted_token["href"].split('?')
-                            print('BASE URL: ', baseURL)
-                            # email.first_tracked = datetime.utcnow()
-                            links = email.link_clicks
-                            if baseURL[0] in links:
-                                links[str(baseURL[0].replace('.', '(dot)'))] += 1
-                            else:
-                                links[str(baseURL[0].replace('.', '(dot)'))] = 1
-                            did_update = True
-                            break
-                    break
-
-            if did_update:
-                action.save()
+            record_event(decrypted_token, "click", link=decrypted_token["href"])
 
         return HttpResponseRedirect(decrypted_token["href"])
     
@@ -391,6 +562,35 @@ class WorkflowViewSet(viewsets.ModelViewSet):
         )
 
 
+class Echo:
+    """File-like object which returns what is written, to stream a CSV"""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(action, job, emails, columns):
+    emails = add_tracking(
+        [
+            {**EmailSerializer(email).data, "content": email.content}
+            for email in emails
+        ]
+    )
+    email_settings = action.emailSettings
+
+    for email in emails:
+        row = {
+            **email,
+            "subject": job.subject,
+            "included_feedback": job.included_feedback,
+            "action_name": action.name,
+            "action_id": str(action.id),
+            "reply_to_email": email_settings.replyTo if email_settings else None,
+            "reply_to_name": email_settings.fromName if email_settings else None,
+        }
+        yield [row.get(column) for column in columns]
+
+
 class FeedbackView(APIView):
     permission_classes = [AllowAny]
 
@@ -404,31 +604,29 @@ class FeedbackView(APIView):
         email_id = request.GET.get("email")
 
         payload = None
-        for job in action.emailJobs:
-            if str(job.job_id) == job_id and job.included_feedback:
-                for email in job.emails:
-                    if email.email_id == email_id:
-                        payload = {
-                            "dropdown": {
-                                "enabled": action.emailSettings.feedback_list,
-                                "question": action.emailSettings.list_question,
-                                "type": action.emailSettings.list_type,
-                                "options": [
-                                    {"label": option.label, "value": option.value}
-                                    for option in action.emailSettings.list_options
-                                ],
-                                "value": email.list_feedback,
-                            },
-                            "textbox": {
-                                "enabled": action.emailSettings.feedback_textbox,
-                                "question": action.emailSettings.textbox_question,
-                                "value": email.textbox_feedback,
-                            },
-                            "subject": job.subject,
-                            "email_datetime": job.initiated_at,
-                            # "content": email.content,
-                            "feedback_datetime": email.feedback_datetime,
-                        }
+        job, email = find_email(action, job_id, email_id)
+        if job and email and job.included_feedback:
+            payload = {
+                "dropdown": {
+                    "enabled": action.emailSettings.feedback_list,
+                    "question": action.emailSettings.list_question,
+                    "type": action.emailSettings.list_type,
+                    "options": [
+                        {"label": option.label, "value": option.value}
+                        for option in action.emailSettings.list_options
+                    ],
+                    "value": email.list_feedback,
+                },
+                "textbox": {
+                    "enabled": action.emailSettings.feedback_textbox,
+                    "question": action.emailSettings.textbox_question,
+                    "value": email.textbox_feedback,
+                },
+                "subject": job.subject,
+                "email_datetime": job.initiated_at,
+                # "content": email.content,
+                "feedback_datetime": email.feedback_datetime,
+            }
 
         if not payload:
             return JsonResponse({"error": "Invalid feedback URL"})
@@ -447,18 +645,17 @@ class FeedbackView(APIView):
             return JsonResponse({"error": "Empty feedback cannot be submitted"})
 
         did_update = False
-        for job in action.emailJobs:
-            if str(job.job_id) == job_id and job.included_feedback:
-                for email in job.emails:
-                    if email.email_id == email_id:
-                        email.textbox_feedback = textbox
-                        email.list_feedback = dropdown
-                        email.feedback_datetime = datetime.utcnow()
-                        did_update = True
-
-        if did_update:
-            action.save()
-        else:
+        job, email = find_email(action, job_id, email_id)
+        if job and email and job.included_feedback:
+            # Only the feedback of the email is written, rather than the action
+            email.update(
+                set__textbox_feedback=textbox,
+                set__list_feedback=dropdown,
+                set__feedback_datetime=datetime.utcnow(),
+            )
+            did_update = True
+
+        if not did_update:
             # None of the email recipients must have matched the request user's email
             return JsonResponse(
                 {
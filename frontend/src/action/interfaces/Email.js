@@ -116,13 +116,12 @@ class Email extends React.Component {
   };
 
   checkEmailStatus = () => {
-    const { action, updateAction } = this.props;
+    const { action } = this.props;
 
     apiRequest(`/workflow/${action.id}/locked/`, {
       method: "GET",
-      onSuccess: ({ emailLocked, emailJobs, status }) => {
+      onSuccess: ({ emailLocked, status }) => {
         this.setState({ emailLocked, status });
-        updateAction({ ...action, emailJobs });
       },
       onError: (error) => console.log(error),
     });
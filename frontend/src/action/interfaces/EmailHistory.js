@@ -16,7 +16,6 @@ import moment from "moment";
 import EmailSettings from "./EmailSettings";
 import EmailJobDetails from "./EmailJobDetails";
 import apiRequest from "../../shared/apiRequest";
-const { Parser } = require('json2csv');
 // const FormItem = Form.Item;
 
 class EmailHistory extends React.Component {
@@ -41,6 +40,9 @@ class EmailHistory extends React.Component {
       options,
       emailLocked: true,
       intervalId: null,
+      emailJobs: [],
+      loading: true,
+      pagination: { current: 1, pageSize: 20, total: 0 },
     };
 
     this.dayMap = {
@@ -54,46 +56,51 @@ class EmailHistory extends React.Component {
     };
   }
 
+  componentDidMount = () => {
+    this.fetchEmailJobs(1);
+  };
+
+  fetchEmailJobs = (current) => {
+    const { action } = this.props;
+    const { pagination } = this.state;
+    const offset = (current - 1) * pagination.pageSize;
+
+    this.setState({ loading: true });
+    apiRequest(
+      `/workflow/${action.id}/email_jobs/?offset=${offset}&limit=${pagination.pageSize}`,
+      {
+        method: "GET",
+        onSuccess: ({ items, total }) =>
+          this.setState({
+            emailJobs: items,
+            loading: false,
+            pagination: { ...pagination, current, total },
+          }),
+        onError: (error) => this.setState({ error, loading: false }),
+      }
+    );
+  };
+
   EmailJobDetails = (job) => {
+    const { action } = this.props;
+
     return (
-      <EmailJobDetails job={job} />
+      <EmailJobDetails job={job} actionId={action.id} />
     );
   };
 
   export = () => {
-    const rows = [];
-    const { action } = this.props
-    for (let job of action.emailJobs) {
-      for (let email of job.emails) {
-        let object = {
-          recipient: email.recipient,
-          track_count: email.track_count,
-          first_tracked: email.first_tracked,
-          last_tracked: email.last_tracked,
-          content: email.content,
-          subject: job.subject,
-          included_feedback: job.included_feedback,
-          action_name: action.name,
-          action_id: action.id,
-          reply_to_email: action.emailSettings.replyTo,
-          reply_to_name: action.emailSettings.fromName,
-        }
-        rows.push(object)
-      }
-    }
-    const json2csvParser = new Parser();
-    const csv = json2csvParser.parse(rows);
-    var pom = document.createElement('a');
-    var blob = new Blob([csv],{type: 'text/csv;charset=utf-8;'});
-    var url = URL.createObjectURL(blob);
-    pom.href = url;
-    let filename = action.name.replace(" ", "_") + action.id + ".csv"
-    pom.setAttribute('download', filename);
-    pom.click();
-  }
+    const { action } = this.props;
+
+    apiRequest(`/workflow/${action.id}/export_emails/`, {
+      method: "GET",
+      onError: (error) => this.setState({ error }),
+    });
+  };
 
   EmailHistory = () => {
     const { action } = this.props;
+    const { emailJobs, loading, pagination } = this.state;
 
     return (
       <div>
@@ -136,22 +143,21 @@ class EmailHistory extends React.Component {
             {
               title: "Tracking",
               render: (text, record) => {
-                const trackedCount = record.emails.filter(
-                  (email) => !!email.first_tracked
-                ).length;
-                const trackedPct = Math.round(
-                  (trackedCount / record.emails.length) * 100
-                );
+                const trackedPct = record.emailCount
+                  ? Math.round((record.trackedCount / record.emailCount) * 100)
+                  : 0;
                 return (
-                  <span>{`${trackedCount} of ${record.emails.length} (${trackedPct}%)`}</span>
+                  <span>{`${record.trackedCount} of ${record.emailCount} (${trackedPct}%)`}</span>
                 );
               },
             },
           ]}
-          dataSource={action.emailJobs}
+          dataSource={emailJobs}
+          loading={loading}
           expandedRowRender={this.EmailJobDetails}
           rowKey="job_id"
-          pagination={{ size: "small", pageSize: 20 }}
+          pagination={{ ...pagination, size: "small" }}
+          onChange={({ current }) => this.fetchEmailJobs(current)}
         />
       </div>
     );
@@ -12,22 +12,70 @@ import {
 import moment from "moment";
 import Highlighter from "react-highlight-words";
 
+import apiRequest from "../../shared/apiRequest";
+
 class EmailJobDetails extends React.Component {
   constructor(props) {
     super(props);
     this.state = {
       searchText: "",
       emailView: { visible: false },
+      emails: [],
+      loading: true,
+      pagination: {
+        current: 1,
+        pageSize: 10,
+        total: 0,
+        showSizeChanger: true,
+        pageSizeOptions: ["10", "25", "50"],
+      },
     };
   }
 
-  searchEntry = (dataSource, searchText) => {
-    let searchFiltered = dataSource.filter(
-      (it) =>
-        !it.recipient ||
-        (it.recipient && it.recipient.toLowerCase().includes(searchText))
+  componentDidMount = () => {
+    this.fetchEmails(1, 10, "");
+  };
+
+  fetchEmails = (current, pageSize, searchText) => {
+    const { job, actionId } = this.props;
+    const { pagination } = this.state;
+    const offset = (current - 1) * pageSize;
+
+    this.setState({ loading: true });
+    apiRequest(
+      `/workflow/${actionId}/email_jobs/${job.job_id}/emails/?offset=${offset}&limit=${pageSize}&search=${encodeURIComponent(searchText)}`,
+      {
+        method: "GET",
+        onSuccess: ({ items, total }) =>
+          this.setState({
+            emails: items,
+            loading: false,
+            pagination: { ...pagination, current, pageSize, total },
+          }),
+        onError: () => this.setState({ loading: false }),
+      }
+    );
+  };
+
+  viewEmail = (record) => {
+    const { job, actionId } = this.props;
+
+    apiRequest(
+      `/workflow/${actionId}/email_jobs/${job.job_id}/emails/${record.email_id}/`,
+      {
+        method: "GET",
+        onSuccess: ({ content }) =>
+          this.setState({
+            emailView: {
+              visible: true,
+              recipient: record.recipient,
+              subject: job.subject,
+              initiated_at: job.initiated_at,
+              text: content,
+            },
+          }),
+      }
     );
-    return searchFiltered;
   };
 
   FeedbackDetails = (record) => (
@@ -86,7 +134,7 @@ class EmailJobDetails extends React.Component {
 
   render = () => {
     const { job } = this.props;
-    const { searchText, emailView } = this.state;
+    const { searchText, emailView, emails, loading, pagination } = this.state;
 
     return (
       <div>
@@ -94,7 +142,9 @@ class EmailJobDetails extends React.Component {
           placeholder="Search by Recipient"
           prefix={<Icon type="search" style={{ color: "rgba(0,0,0,.25)" }} />}
           onChange={(e) => {
-            this.setState({ searchText: e.target.value.toLowerCase() });
+            const searchText = e.target.value.toLowerCase();
+            this.setState({ searchText });
+            this.fetchEmails(1, pagination.pageSize, searchText);
           }}
         />
         <Table
@@ -181,30 +231,20 @@ class EmailJobDetails extends React.Component {
               render: (text, record) => (
                 <span
                   style={{ cursor: "pointer", color: "#2196F3" }}
-                  onClick={() =>
-                    this.setState({
-                      emailView: {
-                        visible: true,
-                        recipient: record.recipient,
-                        subject: job.subject,
-                        text,
-                      },
-                    })
-                  }
+                  onClick={() => this.viewEmail(record)}
                 >
                   View
                 </span>
               ),
             },
           ]}
-          dataSource={this.searchEntry(job.emails, searchText)}
+          dataSource={emails}
+          loading={loading}
           rowKey="email_id"
-          pagination={{
-            size: "small",
-            defaultPageSize: 10,
-            showSizeChanger: true,
-            pageSizeOptions: ["10", "25", "50"],
-          }}
+          pagination={{ ...pagination, size: "small" }}
+          onChange={({ current, pageSize }) =>
+            this.fetchEmails(current, pageSize, searchText)
+          }
         />
          <Modal
           visible={emailView.visible}
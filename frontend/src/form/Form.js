@@ -42,13 +42,21 @@ class Form extends React.Component {
     this.setState({ token: token });
   };
 
-  componentDidMount() {
-    const { match, history } = this.props;
+  // Column filters are fetched when they are opened, and tables are paginated
+  // by the server
+  accessUrl = (query = "lazy=true") => {
+    const { match } = this.props;
     const { token } = this.state;
 
     const url = (!!token ? `/form/${match.params.id}/access/${token}/` : `/form/${match.params.id}/access/`);
+    return `${url}?${query}`;
+  };
+
+  componentDidMount() {
+    const { history } = this.props;
+    const { token } = this.state;
 
-    apiRequest(url, {
+    apiRequest(this.accessUrl(), {
       method: "GET",
       isAuthenticated: !token,
       onSuccess: form => {
@@ -176,7 +184,6 @@ class Form extends React.Component {
   };
 
   handleSubmit = (primary, field, value, index, loadingKey, filterOptions) => {
-    const { match } = this.props;
     const { saved, form, token } = this.state;
 
     const data = form.data;
@@ -187,15 +194,15 @@ class Form extends React.Component {
 
     const loading = message.loading("Saving form...", 0);
 
-    const url = (!!token ? `/form/${match.params.id}/access/${token}/` : `/form/${match.params.id}/access/`);
-
-    apiRequest(url, {
+    apiRequest(this.accessUrl(), {
       method: "PATCH",
       isAuthenticated: !token,
       payload: { primary, field, value, filterOptions },
       onSuccess: (filter_details) => {
         const savedRecord = _.get(saved, primary, {});
         savedRecord[loadingKey] = true;
+        // The options of the edited column are fetched again when next opened
+        filter_details.filters = _.omit(this.state.filter_details.filters, loadingKey);
         this.setState({ filter_details, saved: { ...saved, [primary]: savedRecord } }, () => {
           this.updateSuccess = setTimeout(() => {
             savedRecord[loadingKey] = false;
@@ -217,16 +224,15 @@ class Form extends React.Component {
 
   fetchData = (payload, setTableState) => {
     setTableState && setTableState({filterOptions: payload, loading: true});
-    const { match, history } = this.props;
+    const { history } = this.props;
     const { token } = this.state;
 
-    const url = (!!token ? `/form/${match.params.id}/access/${token}/` : `/form/${match.params.id}/access/`);
-
-    apiRequest(url, {
+    apiRequest(this.accessUrl(), {
       method: "POST",
       isAuthenticated: !token,
       payload: payload,
       onSuccess: filter_details => {
+        filter_details.filters = this.state.filter_details.filters;
         this.setState({filter_details});
         if (!!setTableState && !!payload) {
           payload.pagination.total = filter_details.paginationTotal;
@@ -244,6 +250,27 @@ class Form extends React.Component {
     });
   }
 
+  fetchFilter = column => {
+    const { token } = this.state;
+
+    apiRequest(this.accessUrl(`column=${encodeURIComponent(column)}`), {
+      method: "GET",
+      isAuthenticated: !token,
+      onSuccess: ({ filters }) => {
+        const { filter_details } = this.state;
+        this.setState({
+          filter_details: {
+            ...filter_details,
+            filters: { ...filter_details.filters, [column]: filters }
+          }
+        });
+      },
+      onError: () => {
+        message.error("Failed to load the filter options");
+      }
+    });
+  };
+
   componentWillUnmount() {
     clearTimeout(this.updateSuccess);
   }
@@ -289,21 +316,41 @@ class Form extends React.Component {
       method: "POST",
       payload,
       isJSON: false,
-      onSuccess: () => {
-        apiRequest(`/form/${match.params.id}/access/`, {
+      onSuccess: result => {
+        apiRequest(this.accessUrl(), {
           method: "GET",
           onSuccess: form => {
             const { filter_details } = form;
             this.setState({ loading: false, upload: false, form, filter_details });
-            notification["success"]({
-              message: "Successfully imported form data"
+
+            const { created, updated, errors, errorCount } = result;
+            notification[errorCount ? "warning" : "success"]({
+              message: errorCount
+                ? "Imported form data with errors"
+                : "Successfully imported form data",
+              description: (
+                <div>
+                  <div>{created} records added, {updated} records updated</div>
+                  {errors.map((error, i) => (
+                    <div key={i}>
+                      Row {error.row} ({error.field}): {error.message}
+                    </div>
+                  ))}
+                  {errorCount > errors.length && (
+                    <div>and {errorCount - errors.length} more errors</div>
+                  )}
+                </div>
+              ),
+              duration: errorCount ? 0 : 4.5
             });
           }
         });
       },
-      onError: () => {
+      onError: error => {
+        this.setState({ loading: false });
         notification["error"]({
-          message: "Failed to import form data"
+          message: "Failed to import form data",
+          description: Array.isArray(error) ? error.join(" ") : _.get(error, "detail")
         });
       }
     });
@@ -532,6 +579,7 @@ class Form extends React.Component {
                           isReadOnly={this.isReadOnly}
                           onFieldUpdate={this.onFieldUpdate}
                           fetchData={this.fetchData}
+                          fetchFilter={this.fetchFilter}
                           filters={filters}
                           groups={groups}
                           filterNum={filterNum}
@@ -6,6 +6,9 @@ import Field from "./Field";
 
 const { Search } = Input;
 
+// Placeholder option of a filter whose options are still being fetched
+const LOADING_FILTER = "__loading__";
+
 // TODO: Better Solution to <checkbox_group column>__<checkbox_group group>
 
 // Generate Initial Filters for every checkboxgroup field
@@ -31,6 +34,7 @@ const ContentTable = (props) => {
     paginationTotal,
     groups,
     fetchData,
+    fetchFilter,
     isReadOnly,
     onFieldUpdate,
     filterNum,
@@ -109,6 +113,8 @@ const ContentTable = (props) => {
   }
 
   const handleFilterChange = (pagination, filters, sorter) => {
+    filters = _.mapValues(filters, values => _.without(values, LOADING_FILTER));
+
     const filterOptions = {
       ...tableState.filterOptions,
       pagination,
@@ -135,6 +141,15 @@ const ContentTable = (props) => {
     const { dataIndex, field } = column;
     const { type, columns } = field;
 
+    // Options of the filter which haven't been fetched yet are fetched once
+    // the filter is opened
+    const isFilterLoaded = !fetchFilter || (filters && dataIndex in filters);
+    const lazyFilter = (!isPreview && !isFilterLoaded) ?
+      {
+        onFilterDropdownVisibleChange: visible => visible && fetchFilter(dataIndex)
+      }
+      : {};
+
     if (type === "checkbox-group") {
       const customFilter =
       (type === "checkbox-group" && !isPreview) ?
@@ -148,7 +163,7 @@ const ContentTable = (props) => {
               setTableState,
               tableState,
               columnName: dataIndex,
-              columns: filters[dataIndex].map(filter => filter.value),
+              columns: isFilterLoaded ? filters[dataIndex].map(filter => filter.value) : [],
             })
         }
       : {};
@@ -156,6 +171,7 @@ const ContentTable = (props) => {
       return {
         ...column,
         ...customFilter,
+        ...lazyFilter,
         sorter: !isPreview,
         sortOrder: sorter.field === dataIndex && sorter.order,
         render: (value, record, index) => {
@@ -175,7 +191,10 @@ const ContentTable = (props) => {
     else {
       return {
         ...column,
-        filters: (!isPreview && filters) ? filters[dataIndex] : null,
+        ...lazyFilter,
+        filters: (!isPreview && filters) ?
+          (isFilterLoaded ? filters[dataIndex] : [{ text: "Loading...", value: LOADING_FILTER }])
+          : null,
         sorter: (isPreview || ['checkbox', 'list'].includes(type)) ? null : true,
         sortOrder: sorter.field === dataIndex && sorter.order,
         render: (value, record, index) => {